@@ -2,6 +2,7 @@
 
 import os
 import socket
+import select
 import struct
 import time
 import sys
@@ -11,11 +12,16 @@ import threading
 import urlparse
 import Queue
 import BaseHTTPServer
+import SocketServer
 import logging
 import urllib
 import getopt
 
-from litterstore import LitterStore
+from litterstore import LitterStore, StorePool, READ_METHODS
+from littercache import TimelineCache
+from litterfilter import BloomFilter
+from litterstats import QueryStats
+from litterwire import FMAGIC, BMAGIC, WireError, Reassembler, unbatch
 from litterrouter import *
 
 # Log everything, and send it to stderr.
@@ -24,6 +30,13 @@ logging.basicConfig(level=logging.DEBUG)
 extension_mimetypes = {".js":"text/javascript", ".html":"text/html",
                        ".htm":"text/html", ".css":"text/css", "":"text/plain"}
 
+# largest udp payload, a smaller buffer silently truncates big replies
+RECV_BUFFER = 65535
+
+# json responses are encoded and written to the browser in pieces this big
+STREAM_CHUNK = 16 * 1024
+JSON_ENCODER = json.JSONEncoder(ensure_ascii=False)
+
 class MulticastServer(threading.Thread):
     """Listens for multicast and put them in queue"""
 
@@ -73,6 +86,34 @@ class MulticastServer(threading.Thread):
 
         return s
 
+    @staticmethod
+    def init_senders(intfs=[], port=PORT):
+        """One socket per interface to send multicast from, bound to the
+           interface and port so peers reply to the usual address. None
+           when they cannot be bound next to the receiving socket."""
+
+        socks = []
+        try:
+            for intf in intfs:
+                s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+                socks.append(s)
+
+                if os.name != "nt":
+                    s.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+
+                s.setsockopt(socket.SOL_IP, socket.IP_MULTICAST_TTL, 1)
+                s.setsockopt(socket.SOL_IP, socket.IP_MULTICAST_LOOP, 0)
+                s.setsockopt(socket.SOL_IP, socket.IP_MULTICAST_IF,
+                    socket.inet_aton(intf))
+                s.bind((intf, port))
+        except socket.error as ex:
+            logging.exception(ex)
+            for s in socks:
+                s.close()
+            return None
+
+        return socks
+
     @staticmethod
     def close_mcast(s, addr=MCAST_ADDR):
         intf = s.getsockname()[0]
@@ -94,15 +135,56 @@ class MulticastServer(threading.Thread):
 
         self.sock = MulticastServer.init_mcast(self.intfs)
 
+        # multicast goes out without switching the interface of a shared
+        # socket, None falls back to that
+        if len(self.intfs) > 0:
+            self.msocks = MulticastServer.init_senders(self.intfs)
+        else:
+            # the default interface, and the socialvpn hack when it is up
+            self.msocks = [self.sock] + \
+                (MulticastServer.init_senders(['172.31.0.2']) or [])
+
+        # unicast to the address of a send socket is delivered to it
+        self.socks = [self.sock] + [s for s in self.msocks or []
+                                    if s is not self.sock]
+
+        self.reassembler = Reassembler()
+        self.limiter = IngressLimiter()
+
     def run(self):
         """Waits in a loop for incoming packet then puts them in queue"""
 
         self.running.set() #set to true
         while self.running.is_set():
-            data, addr = self.sock.recvfrom(4096)
-            print "self.sock %s self.intfs %s" % (self.sock, self.intfs)
-            logging.debug("MulticastServer: sender %s %s" % (addr, data))
-            self.queue.put((data, UDPSender(self.sock, self.intfs, addr)))
+            for sock in select.select(self.socks, [], [])[0]:
+                data, addr = sock.recvfrom(RECV_BUFFER)
+                self.__receive(data, addr)
+
+    def __receive(self, data, addr):
+        if data[:1] == FMAGIC:
+            # the worker only sees whole packets
+            data = self.reassembler.add(data, addr)
+            if data == None:
+                return
+        print "self.sock %s self.intfs %s" % (self.sock, self.intfs)
+        logging.debug("MulticastServer: sender %s %s" % (addr, data))
+
+        packets = [data]
+        if data[:1] == BMAGIC:
+            # and one packet at a time
+            try:
+                packets = unbatch(data)
+            except WireError as err:
+                logging.warning("dropping batch from %s: %s", addr, err)
+                return
+
+        for packet in packets:
+            # a chatty peer or a backlog costs gossip, not the browser
+            fill = float(self.queue.qsize()) / max(self.queue.maxsize, 1)
+            if not self.limiter.admit(addr[0], fill):
+                logging.debug("MulticastServer: dropped from %s", addr)
+                continue
+            self.queue.put((packet, UDPSender(self.sock, self.intfs, addr)))
 
     def stop(self):
         """Set run to false, and send an empty message"""
@@ -112,6 +194,8 @@ class MulticastServer(threading.Thread):
         msender.send("", (LOOP_ADDR, PORT))
 
     def __del__(self):
+        for s in self.socks[1:]:
+            s.close()
         self.close_mcast(self.sock)
 
 class HTTPHandler(BaseHTTPServer.BaseHTTPRequestHandler):
@@ -151,6 +235,14 @@ class HTTPHandler(BaseHTTPServer.BaseHTTPRequestHandler):
 
         logging.debug("HTTPHandler: %s " % request)
         data = request['json'][0]
+
+        # reads go straight to the pool instead of waiting behind ingest
+        query = json.loads(data)
+        if query.get('m', None) in READ_METHODS and 'posts' not in query \
+            and self.server.pool != None:
+            self.send_json(self.server.pool.process(query))
+            return
+
         queue = Queue.Queue(1)
         sender = HTTPSender(queue, self.client_address)
         self.server.queue.put((data, sender), timeout=2)
@@ -161,10 +253,27 @@ class HTTPHandler(BaseHTTPServer.BaseHTTPRequestHandler):
             #Exception happened, TODO do something better here:
             self.send_error(500, str(err))
         else:
-            self.send_response(200)
-            self.send_header("Content-type", "text/x-json; charset=utf-8")
-            self.end_headers()
-            self.wfile.write(data.encode("utf-8"))
+            self.send_json(data)
+
+    def send_json(self, response):
+        """Sends a response as json, encoded and written STREAM_CHUNK bytes
+           at a time instead of as one string"""
+
+        self.send_response(200)
+        self.send_header("Content-type", "text/x-json; charset=utf-8")
+        self.end_headers()
+
+        chunk = []
+        size = 0
+        for part in JSON_ENCODER.iterencode(response):
+            chunk.append(part)
+            size += len(part)
+            if size >= STREAM_CHUNK:
+                self.wfile.write(u"".join(chunk).encode("utf-8"))
+                chunk = []
+                size = 0
+
+        self.wfile.write(u"".join(chunk).encode("utf-8"))
 
     def process_file(self, path):
         """Handles HTTP file requests"""
@@ -211,13 +320,21 @@ class HTTPHandler(BaseHTTPServer.BaseHTTPRequestHandler):
             logging.exception(ex)
 
 
+class ThreadingHTTPServer(SocketServer.ThreadingMixIn,
+    BaseHTTPServer.HTTPServer):
+    """Handles each request in its own thread"""
+
+    daemon_threads = True
+
+
 class HTTPThread(threading.Thread):
 
-    def __init__(self, queue, addr=LOOP_ADDR, port=8080):
+    def __init__(self, queue, pool, addr=LOOP_ADDR, port=8080):
         threading.Thread.__init__(self)
         self.port = port
-        self.http = BaseHTTPServer.HTTPServer((addr, port), HTTPHandler)
+        self.http = ThreadingHTTPServer((addr, port), HTTPHandler)
         self.http.queue = queue
+        self.http.pool = pool
         self.running = threading.Event()
 
     def run(self):
@@ -229,46 +346,63 @@ class HTTPThread(threading.Thread):
         self.running.clear()
         #wake up the server:
         urllib.urlopen("http://127.0.0.1:%i/ping" % (self.port,)).read()
+        if self.http.pool != None:
+            self.http.pool.close()
 
 
 class WorkerThread(threading.Thread):
 
-    def __init__(self, queue, name, router):
+    def __init__(self, queue, name, router, cache=None, options=None):
         threading.Thread.__init__(self)
         self.queue = queue
         self.name = name
         self.router = router
+        self.cache = cache
+        self.options = options if options != None else {}
 
     def run(self):
         # SQL database has to be created in same thread
-        self.litstore = LitterStore(self.name)
+        self.litstore = LitterStore(self.name, cache=self.cache,
+            **self.options)
         while True:
-            data, sender = self.queue.get()
+            try:
+                # wakes up when the next coalesced batch is due
+                data, sender = self.queue.get(timeout=self.router.flush())
+            except Queue.Empty:
+                continue
+
             if sender == None and data == None:
                 # we close DB then break out of loop to stop thread
+                self.router.flush(force=True)
                 self.litstore.close()
                 break
 
             try:
-                logging.debug("REQ: %s : %s" % (sender, data))
+                logging.debug("REQ: %s : %s", sender, data)
 
                 if not isinstance(data, dict):
-                    data = unicode(data, "utf-8")
-                    request = json.loads(data)
+                    # binary from peers that read it, json from the others
+                    request = self.router.decode(data)
                 else:
                     request = data
 
                 # save method locally before sending it litterstore
                 # just in case it gets modified
                 response = None
-                if self.router.should_process(request, sender):
-                    response = self.litstore.process(request)
-                    logging.debug("REP: %s : %s" % (sender, response))
-                    self.router.send(response, sender)
-
+                if request.get('m', None) == 'routes':
+                    # the routing tables live here, not in the store
+                    response = {'routes': self.router.stats()}
+                elif self.router.should_process(request, sender):
+                    response = self.litstore.process(request,
+                        self.router.hop_wire(sender))
+                    logging.debug("REP: %s : %s", sender, response)
+                    # somebody is waiting on what the browser asked for
+                    self.router.send(response, sender,
+                        urgent=isinstance(sender, HTTPSender))
+
+                # encoded by the HTTP thread, the worker goes back to ingest
                 if isinstance(sender, HTTPSender):
-                    data = json.dumps(response, ensure_ascii=False)
-                    sender.send(data)
+                    sender.send(response)
 
             except Exception as ex:
                 if isinstance(sender, HTTPSender):
@@ -280,7 +414,10 @@ class WorkerThread(threading.Thread):
 
 
 def usage():
-    print "usage: ./litter.py [-i intf] [-n name] [-p port]"
+    print "usage: ./litter.py [-i intf] [-n name] [-p port] [-c cache_size]"
+    print "                   [-r max_days] [-k max_posts] [-s max_mbytes]"
+    print "                   [-e sqlite|log|sharded[:count]] [-t] [-q slow_ms]"
+    print "                   [-w coalesce_ms] [-a]"
 
 
 def main():
@@ -288,10 +425,16 @@ def main():
     devs = []
     name = socket.gethostname()
     port = "8080"
+    cache_size = "100"
+    options = {}
+    timed = False
+    slow_ms = None
+    coalesce_ms = COALESCE_WINDOW * 1000
+    sync = False
     debug_input = False
 
     try:
-        opts, args = getopt.getopt(sys.argv[1:], "i:n:p:")
+        opts, args = getopt.getopt(sys.argv[1:], "i:n:p:c:r:k:s:e:tq:w:a")
     except getopt.GetoptError, err:
         usage()
         sys.exit()
@@ -303,6 +446,27 @@ def main():
             name = a
         elif o == "-p":
             port = a
+        elif o == "-c":
+            cache_size = a
+        elif o == "-r":
+            options['max_age'] = float(a) * 24 * 3600
+        elif o == "-k":
+            options['max_posts'] = int(a)
+        elif o == "-s":
+            options['max_bytes'] = int(float(a) * 1024 * 1024)
+        elif o == "-e":
+            engine, sep, shards = a.partition(":")
+            options['engine'] = engine
+            if shards:
+                options['shards'] = int(shards)
+        elif o == "-t":
+            timed = True
+        elif o == "-q":
+            slow_ms = a
+        elif o == "-w":
+            coalesce_ms = float(a)
+        elif o == "-a":
+            sync = True
         else:
             usage()
             sys.exit()
@@ -314,17 +478,44 @@ def main():
     mserver = MulticastServer(queue, devs)
     mserver.start()
 
-    router = LitterRouter(mserver.sock, mserver.intfs, name)
+    # 0 sends every packet as it comes
+    coalescer = None
+    if coalesce_ms > 0:
+        coalescer = Coalescer(coalesce_ms / 1000)
+
+    router = LitterRouter(mserver.sock, mserver.intfs, name,
+        reassembler=mserver.reassembler, coalescer=coalescer,
+        limiter=mserver.limiter, msocks=mserver.msocks)
 
-    wthread = WorkerThread(queue, name, router)
+    # shared so the read pool sees what the worker writes
+    cache = TimelineCache(int(cache_size))
+    bloom = BloomFilter(name + ".filter")
+    options['bloom'] = bloom
+
+    # query instrumentation only costs when it is asked for
+    stats = None
+    if timed or slow_ms != None:
+        stats = QueryStats(None if slow_ms == None else
+            float(slow_ms) / 1000)
+    options['stats'] = stats
+
+    wthread = WorkerThread(queue, name, router, cache, options)
     wthread.start()
 
-    httpd = HTTPThread(queue, port=int(port))
+    # the log keeps its index in the worker, every request goes through it,
+    # shards already read in parallel behind the worker
+    pool = None
+    if options.get('engine', 'sqlite') == 'sqlite':
+        pool = StorePool(name, cache=cache, stats=stats, bloom=bloom)
+
+    httpd = HTTPThread(queue, pool, port=int(port))
     httpd.start()
 
     pull_data = json.dumps({'m':'gen_pull'})
     rand_pull_data = json.dumps({'m':'gen_rand_pull'})
     gap_data = json.dumps({'m':'gen_gap'})
+    sync_data = json.dumps({'m':'gen_sync'})
+    compact_data = json.dumps({'m':'compact'})
 
     sender = Sender()
     sender.dest = (MCAST_ADDR,PORT)
@@ -333,8 +524,13 @@ def main():
         while True:
             if debug_input == False:
                 queue.put((pull_data, sender))
-                queue.put((rand_pull_data, sender))
-                queue.put((gap_data, sender))
+                if sync:
+                    # digests find what random pulls and gaps would miss
+                    queue.put((sync_data, sender))
+                else:
+                    queue.put((rand_pull_data, sender))
+                    queue.put((gap_data, sender))
+                queue.put((compact_data, sender))
                 time.sleep(60)
             elif debug_input == True:
                 user_input = raw_input()
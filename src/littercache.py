@@ -0,0 +1,135 @@
+#!/usr/bin/env python
+
+import bisect
+import threading
+
+
+class Ring:
+    """Newest posts of one timeline, sorted by (txtime, sig)"""
+
+    def __init__(self, size):
+        self.size = size
+        self.keys = []
+        self.rows = {}
+        # true when the ring holds every post of its timeline
+        self.complete = False
+
+    def add(self, row):
+        """Adds a display row, returns the number of evicted posts"""
+
+        key = (row[2], row[6])
+
+        if key[1] in self.rows:
+            return 0
+
+        if len(self.keys) >= self.size and key < self.keys[0]:
+            # older than everything we keep, db has more than the ring
+            self.complete = False
+            return 0
+
+        bisect.insort(self.keys, key)
+        self.rows[key[1]] = row
+
+        if len(self.keys) > self.size:
+            txtime, sig = self.keys.pop(0)
+            del self.rows[sig]
+            self.complete = False
+            return 1
+
+        return 0
+
+    def get(self, limit):
+        """Returns the newest posts or None if the ring cannot answer"""
+
+        if limit <= 0:
+            return []
+
+        if len(self.keys) < limit and not self.complete:
+            return None
+
+        return [self.rows[sig] for txtime, sig in
+                reversed(self.keys[-limit:])]
+
+
+class TimelineCache:
+    """Bounded cache of the newest display rows in front of LitterStore.__get,
+       shared between the worker store and the read pool"""
+
+    def __init__(self, size=100, uid_size=20, max_uids=256):
+        self.size = size
+        self.uid_size = uid_size
+        self.max_uids = max_uids
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.__lock = threading.Lock()
+        self.__rings = {}
+        self.__order = []
+        self.__generation = 0
+
+    @property
+    def generation(self):
+        """Changes on every write, taken before a db read that may fill"""
+        return self.__generation
+
+    def get(self, key, limit):
+        """Newest limit rows for key, None (uid, perms) or miss"""
+
+        with self.__lock:
+            ring = self.__rings.get(key, None)
+            rows = ring.get(limit) if ring != None else None
+
+            if rows == None:
+                self.misses += 1
+            else:
+                self.hits += 1
+
+            return rows
+
+    def fill(self, key, rows, generation):
+        """Creates the ring for key from the first rows of the db, skipped
+           if a write happened since generation was read"""
+
+        with self.__lock:
+            if generation != self.__generation or key in self.__rings:
+                return
+
+            size = self.size if key == None else self.uid_size
+            ring = Ring(size)
+            ring.complete = len(rows) < size
+
+            for row in rows[:size]:
+                ring.add(row)
+
+            if key != None:
+                self.__order.append(key)
+                if len(self.__order) > self.max_uids:
+                    del self.__rings[self.__order.pop(0)]
+
+            self.__rings[key] = ring
+
+    def add(self, posts):
+        """Adds freshly stored (uid, display row) pairs to their rings"""
+
+        with self.__lock:
+            self.__generation += 1
+
+            for uid, row in posts:
+                for key in (None, (uid, row[5])):
+                    ring = self.__rings.get(key, None)
+                    if ring != None:
+                        self.evictions += ring.add(row)
+
+    def clear(self):
+        """Drops every ring, used after posts are removed from the db"""
+
+        with self.__lock:
+            self.__generation += 1
+            self.__rings = {}
+            self.__order = []
+
+    def stats(self):
+        with self.__lock:
+            return {'size': self.size, 'hits': self.hits,
+                    'misses': self.misses, 'evictions': self.evictions,
+                    'rings': len(self.__rings)}
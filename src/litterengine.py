@@ -0,0 +1,1383 @@
+#!/usr/bin/env python
+
+import os
+import io
+import cgi
+import sys
+import json
+import time
+import zlib
+import heapq
+import bisect
+import struct
+import sqlite3
+import logging
+import itertools
+import threading
+import Queue
+
+# bump this and add a step to SQLiteEngine.__migrate_db when the schema changes
+SCHEMA_VERSION = 5
+
+# posts as sent to peers, and as shown in the browser with msg and uid
+# escaped once at ingest
+POST_COLUMNS = "msg, uid, txtime, rxtime, postid, perms, sig"
+DISPLAY_COLUMNS = "emsg, euid, txtime, rxtime, postid, perms, sig"
+
+# hot queries, kept here so the query plan tests run the exact same statements
+
+# newest first by (txtime, sig) below (until, sig), a NULL sig leaves out
+# txtime == until so a plain time range and a page cursor share the query
+GET_ALL_SQL = ("SELECT %s FROM posts WHERE txtime > ? and txtime <= ? and "
+    "(txtime < ? or sig < ?) ORDER BY txtime DESC, sig DESC LIMIT ?")
+
+GET_UID_SQL = ("SELECT %s FROM posts WHERE uid == ? and perms == ? and "
+    "txtime > ? and txtime <= ? and (txtime < ? or sig < ?) "
+    "ORDER BY txtime DESC, sig DESC LIMIT ?")
+
+RANGES_SQL = ("SELECT uid, first, last, ftxtime, ltxtime FROM ranges "
+    "WHERE uid IN (SELECT fid FROM friends WHERE uid == ?) "
+    "ORDER BY uid, first")
+
+TOUCHING_RANGES_SQL = ("SELECT first, last, ftxtime, ltxtime FROM ranges "
+    "WHERE uid == ? and first <= ? ORDER BY first DESC")
+
+FRIENDS_SQL = "SELECT fid, txtime FROM friends WHERE uid == ?"
+
+INSERT_POST_SQL = ("INSERT OR IGNORE INTO posts (uid, postid, txtime, "
+    "rxtime, msg, perms, sig, emsg, euid) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)")
+
+PULL_SQL = ("SELECT msg, uid, posts.txtime, rxtime, postid, perms, sig "
+    "FROM pull CROSS JOIN posts ON posts.uid == pull.fid and "
+    "posts.perms == 1 and posts.txtime > pull.txtime "
+    "ORDER BY posts.txtime LIMIT ?")
+
+# inserts or moves forward every watermark of a pull request at once
+PULL_WATERMARK_SQL = ("INSERT OR REPLACE INTO friends (uid, fid, txtime) "
+    "SELECT ?, pull.fid, pull.txtime FROM pull LEFT JOIN friends ON "
+    "friends.uid == ? and friends.fid == pull.fid "
+    "WHERE friends.fid IS NULL or friends.txtime < pull.txtime")
+
+INSERT_RANGE_SQL = ("INSERT INTO ranges (uid, first, last, ftxtime, "
+    "ltxtime) VALUES (?, ?, ?, ?, ?)")
+
+INSERT_FRIEND_SQL = ("INSERT OR IGNORE INTO friends (uid, fid, txtime) "
+    "VALUES (?, ?, ?)")
+
+UPDATE_FRIEND_SQL = ("UPDATE friends SET txtime = ? WHERE uid == ? and "
+    "fid == ? and txtime < ?")
+
+# full-text search over msg, ranked by bm25 or newest first
+SEARCH_SQL = ("SELECT %s FROM posts_fts JOIN posts ON "
+    "posts.rowid == posts_fts.rowid WHERE posts_fts MATCH ? and "
+    "(? IS NULL or posts.uid == ?) and posts.txtime > ? and "
+    "posts.txtime < ? ORDER BY %s LIMIT ?")
+
+SEARCH_ORDERS = {'rank': "posts_fts.rank",
+    'time': "posts.txtime DESC, posts.sig DESC"}
+
+INSERT_FTS_SQL = "INSERT INTO posts_fts (rowid, msg) VALUES (?, ?)"
+
+DELETE_FTS_SQL = ("INSERT INTO posts_fts (posts_fts, rowid, msg) "
+    "SELECT 'delete', rowid, msg FROM posts WHERE sig == ?")
+
+# most sigs looked up by a single statement, under SQLITE_MAX_VARIABLE_NUMBER
+KNOWN_CHUNK = 500
+
+# posts per compressed archive segment
+SEGMENT_SIZE = 500
+
+# free pages given back to the filesystem per compaction
+VACUUM_PAGES = 1000
+
+INSERT_SEGMENT_SQL = ("INSERT INTO archive.segments (uid, first, last, "
+    "count, data) VALUES (?, ?, ?, ?, ?)")
+
+ARCHIVE_SQL = ("SELECT last, data FROM archive.segments WHERE "
+    "(? IS NULL or uid == ?) and last > ? and first < ? ORDER BY last DESC")
+
+# sqlite files of a sharded store, kept in <path>.shards once created
+SHARDS = 4
+
+# log segment files are rolled over past this size
+LOG_SEGMENT_BYTES = 4 * 1024 * 1024
+
+class StoreError(Exception):
+    """Used to raise litterstore error"""
+
+    def __init__(self, msg):
+        self.msg = msg
+
+    def __str__(self):
+        return str(self.msg)
+
+
+def runs(rows):
+    """Yields (uid, first, last, ftxtime, ltxtime) for every run of
+       consecutive postids in (uid, postid, txtime) rows sorted by
+       uid and postid"""
+
+    run = None
+    for uid, postid, txtime in rows:
+        if run != None and run[0] == uid and postid <= run[2] + 1:
+            run[2], run[4] = postid, txtime
+            continue
+
+        if run != None:
+            yield tuple(run)
+        run = [uid, postid, postid, txtime, txtime]
+
+    if run != None:
+        yield tuple(run)
+
+
+def latest(rows):
+    """Newest txtime per author of posts rows"""
+
+    result = {}
+    for row in rows:
+        if row[0] not in result or result[row[0]] < row[2]:
+            result[row[0]] = row[2]
+    return result
+
+
+def match_text(text):
+    """FTS query matching posts with every word of text, so user input
+       never reaches the query syntax"""
+
+    words = text.split()
+    if len(words) == 0:
+        raise StoreError("empty search")
+
+    return " ".join('"%s"' % word.replace('"', '""') for word in words)
+
+
+def pack_segments(rows):
+    """Splits post rows sorted by uid and txtime into (uid, first, last,
+       count, data) archive segments, returns them with the newest txtime
+       of every uid"""
+
+    segments = []
+    horizons = []
+
+    for uid, group in itertools.groupby(rows, lambda row: row[1]):
+        group = list(group)
+        for i in range(0, len(group), SEGMENT_SIZE):
+            chunk = group[i:i + SEGMENT_SIZE]
+            data = zlib.compress(json.dumps(chunk, ensure_ascii=False)
+                .encode("utf-8"))
+            segments.append((uid, chunk[0][2], chunk[-1][2], len(chunk), data))
+        horizons.append((uid, group[-1][2]))
+
+    return segments, horizons
+
+
+def unpack_segments(segments, begin, until, limit):
+    """Newest archived posts first in display form, out of (last, data)
+       segments ordered by last descending"""
+
+    results = []
+
+    for last, data in segments:
+        # segments come by newest post, the rest cannot beat what we have
+        results.sort(key=lambda row: row[2], reverse=True)
+        if len(results) >= limit and results[limit - 1][2] >= last:
+            break
+
+        for row in json.loads(zlib.decompress(data)):
+            if begin < row[2] < until:
+                results.append((cgi.escape(row[0]), cgi.escape(row[1]))
+                    + tuple(row[2:]))
+
+    results.sort(key=lambda row: row[2], reverse=True)
+    return results[:limit]
+
+
+class StorageEngine:
+    """Where LitterStore keeps posts, watermarks and received ranges.
+
+       Rows are (uid, postid, txtime, rxtime, msg, perms, sig, emsg, euid)
+       tuples as built by LitterStore, posts are returned in POST_COLUMNS
+       order or in DISPLAY_COLUMNS order when display is set."""
+
+    def insert(self, owner, rows):
+        """Stores rows, skipping known sigs, merges their postids into the
+           received ranges and moves the watermarks of owner to the newest
+           txtime of every author, returns the new rows"""
+        raise NotImplementedError
+
+    def known(self, sigs):
+        """The sigs of a list that are stored"""
+        raise NotImplementedError
+
+    def sigs(self):
+        """Iterates over every stored sig"""
+        raise NotImplementedError
+
+    def upsert_watermarks(self, uid, marks):
+        """Inserts or moves forward (fid, txtime) watermarks of uid"""
+        raise NotImplementedError
+
+    def watermarks(self, uid):
+        """(fid, txtime) watermarks of uid"""
+        raise NotImplementedError
+
+    def scan(self, uid=None, perms=None, begin=0, until=sys.maxint, limit=10,
+        display=False, sig=None):
+        """Newest posts first by (txtime, sig) with begin < txtime < until,
+           of uid with perms or of everybody when uid is None. With sig it
+           also returns posts at until with a smaller sig, to page on."""
+        raise NotImplementedError
+
+    def fetch(self, uid, postids):
+        """Public posts of uid with the given postids"""
+        raise NotImplementedError
+
+    def private_keys(self):
+        """Sorted (uid, postid) of the posts that are not public, fetch never
+           returns them unless a public post has the same postid"""
+        raise NotImplementedError
+
+    def pull(self, uid, marks, limit):
+        """Moves the watermarks of uid to marks then returns the public posts
+           newer than them, oldest first"""
+        raise NotImplementedError
+
+    def gap_ranges(self, uid):
+        """(fid, first, last, ftxtime, ltxtime) received ranges of every fid
+           uid has a watermark for, ordered by fid and first"""
+        raise NotImplementedError
+
+    def horizons(self):
+        """Newest archived txtime per uid"""
+        raise NotImplementedError
+
+    def max_postid(self, uid):
+        raise NotImplementedError
+
+    def search(self, text, uid=None, begin=0, until=sys.maxint, limit=10,
+        order='rank'):
+        """Posts containing every word of text in display form, best match
+           first or newest first when order is 'time'"""
+        raise StoreError("search is only available from sqlite")
+
+    def compact(self, owner, max_age=None, max_posts=None, max_bytes=None):
+        """Archives posts not written by owner past retention and gives back
+           free space, returns (archived posts, freed bytes)"""
+        raise NotImplementedError
+
+    def archive_scan(self, uid=None, begin=0, until=sys.maxint, limit=10):
+        """Newest archived posts first, in display form"""
+        raise NotImplementedError
+
+    def explain(self, action, params=()):
+        raise StoreError("query plans are only available from sqlite")
+
+    def close(self):
+        pass
+
+
+class SQLiteEngine(StorageEngine):
+    """Posts in <path>.db, archive segments in <path>.archive.db, both in
+       memory when path is None"""
+
+    def __init__(self, path=None, readonly=False, stats=None):
+        self.__path = path
+        self.__stats = stats
+
+        if readonly:
+            # an in-memory database is only seen by its own connection
+            if path == None:
+                raise StoreError("read-only stores need a database file")
+
+            # read-only stores are handed between threads by StorePool
+            self.__con = sqlite3.connect(path + ".db",
+                check_same_thread=False)
+            self.__db_call("PRAGMA query_only = 1")
+            self.__search = self.__has_search()
+        else:
+            self.__con = sqlite3.connect(":memory:" if path == None else
+                path + ".db")
+            self.__db_call("ATTACH DATABASE ? AS archive", (":memory:" if
+                path == None else path + ".archive.db",))
+            self.__init_db()
+
+    def __db_call(self, action, params=None, commit=True):
+        logging.debug("dbcall -- %s %s", action, params)
+
+        stats = self.__stats
+        if stats != None:
+            begin = time.time()
+
+        try:
+            cur = self.__con.cursor()
+
+            if params != None:
+                cur.execute(action, params)
+            else:
+                cur.execute(action)
+
+            result = cur.fetchall()
+            if commit:
+                self.__con.commit()
+            cur.close()
+
+        except sqlite3.IntegrityError as ie:
+            raise StoreError(str(ie))
+
+        if stats != None:
+            stats.record(action, time.time() - begin, len(result), params)
+
+        return result
+
+    def __db_many(self, action, seq):
+        """Runs a statement for every params in seq without committing,
+           the caller owns the transaction"""
+        logging.debug("dbmany -- %s", action)
+
+        stats = self.__stats
+        if stats != None:
+            begin = time.time()
+
+        try:
+            cur = self.__con.cursor()
+            cur.executemany(action, seq)
+            rows = cur.rowcount
+            cur.close()
+
+        except sqlite3.IntegrityError as ie:
+            raise StoreError(str(ie))
+
+        if stats != None:
+            stats.record(action, time.time() - begin, max(rows, 0))
+
+    def __init_db(self):
+        # only applies to new files, older ones are converted by migration
+        self.__db_call("PRAGMA auto_vacuum = INCREMENTAL")
+
+        # WAL lets StorePool readers run while this connection writes
+        self.__db_call("PRAGMA journal_mode = WAL")
+        self.__db_call("PRAGMA synchronous = NORMAL")
+
+        self.__db_call("CREATE TABLE IF NOT EXISTS posts "
+            "(uid TEXT, postid INTEGER, msg TEXT, txtime NUM, "
+            "rxtime NUM, perms NUM, sig TEXT, emsg TEXT, euid TEXT, "
+            "PRIMARY KEY(sig ASC))")
+
+        self.__db_call("CREATE TABLE IF NOT EXISTS friends "
+            "(uid TEXT, fid TEXT, txtime NUM, PRIMARY KEY(uid, fid))")
+
+        # contiguous postid ranges received per uid, gaps are in between
+        self.__db_call("CREATE TABLE IF NOT EXISTS ranges "
+            "(uid TEXT, first INTEGER, last INTEGER, ftxtime NUM, "
+            "ltxtime NUM, PRIMARY KEY(uid, first))")
+
+        # newest txtime archived per uid, gaps before it are not requested
+        self.__db_call("CREATE TABLE IF NOT EXISTS horizons "
+            "(uid TEXT PRIMARY KEY, txtime NUM)")
+
+        # posts past retention, SEGMENT_SIZE zlib compressed rows of one uid
+        self.__db_call("CREATE TABLE IF NOT EXISTS archive.segments "
+            "(uid TEXT, first NUM, last NUM, count INTEGER, data BLOB)")
+        self.__db_call("CREATE INDEX IF NOT EXISTS archive.segments_uid_last "
+            "ON segments (uid, last)")
+
+        # watermarks of the pull request being answered
+        self.__db_call("CREATE TEMP TABLE IF NOT EXISTS pull "
+            "(fid TEXT PRIMARY KEY, txtime NUM)")
+
+        self.__migrate_db()
+
+    def __migrate_db(self):
+        """Upgrades an existing database file to SCHEMA_VERSION"""
+
+        version = self.__db_call("PRAGMA user_version")[0][0]
+
+        if version < 1:
+            # scan over all posts, walks txtime backwards and pages on
+            # (txtime, sig), ties are ordered by the index
+            self.__db_call("CREATE INDEX IF NOT EXISTS posts_txtime_sig "
+                "ON posts (txtime, sig)")
+            # scan for one uid, used by pull and gap replies
+            self.__db_call("CREATE INDEX IF NOT EXISTS "
+                "posts_uid_perms_txtime_sig ON posts "
+                "(uid, perms, txtime, sig)")
+            # covers watermarks and upsert_watermarks
+            self.__db_call("CREATE INDEX IF NOT EXISTS friends_uid_fid_txtime "
+                "ON friends (uid, fid, txtime)")
+
+        if version < 2:
+            # gaps are read from ranges instead of scanning every post
+            self.__rebuild_ranges()
+
+        if version < 3:
+            # display form of msg and uid, escaped once instead of per read
+            columns = [row[1] for row in
+                self.__db_call("PRAGMA table_info(posts)")]
+            for column in ('emsg', 'euid'):
+                if column not in columns:
+                    self.__db_call("ALTER TABLE posts ADD COLUMN %s TEXT" %
+                        column)
+            self.__con.create_function("html_escape", 1, cgi.escape)
+            self.__db_call("UPDATE posts SET emsg = html_escape(msg), "
+                "euid = html_escape(uid)")
+
+        if version < 4:
+            # lets compaction give free pages back a few at a time
+            if self.__db_call("PRAGMA auto_vacuum")[0][0] != 2:
+                self.__db_call("PRAGMA auto_vacuum = INCREMENTAL")
+                self.__db_call("VACUUM")
+
+        if version < 5:
+            # words of msg, external content over the posts rowid which
+            # incremental_vacuum never changes, insert and __archive keep
+            # it in sync
+            try:
+                self.__db_call("CREATE VIRTUAL TABLE IF NOT EXISTS posts_fts "
+                    "USING fts5(msg, content='posts', content_rowid='rowid')")
+                self.__db_call("INSERT INTO posts_fts (posts_fts) "
+                    "VALUES ('rebuild')")
+            except sqlite3.OperationalError as oe:
+                logging.warning("search is unavailable: %s", oe)
+
+        # without FTS5 the index misses the posts stored meanwhile, the
+        # last step runs again once a sqlite that has it opens the file
+        self.__search = self.__has_search()
+        target = SCHEMA_VERSION if self.__search else 4
+
+        if version != target:
+            logging.info("migrated %s.db from schema %s to %s" %
+                (self.__path, version, target))
+            self.__db_call("PRAGMA user_version = %d" % target)
+
+    def __has_search(self):
+        """False when this sqlite has no FTS5 or the index was not built"""
+
+        try:
+            self.__db_call("SELECT rowid FROM posts_fts LIMIT 0",
+                commit=False)
+        except sqlite3.OperationalError:
+            return False
+        return True
+
+    def __rebuild_ranges(self):
+        self.__db_call("DELETE FROM ranges", commit=False)
+        rows = self.__db_call("SELECT uid, postid, txtime FROM posts "
+            "ORDER BY uid, postid", commit=False)
+        self.__db_many(INSERT_RANGE_SQL, runs(rows))
+        self.__con.commit()
+
+    def __merge_range(self, cur, uid, first, last, ftxtime, ltxtime):
+        """Merges a run of received postids into the ranges of uid"""
+
+        # ranges are disjoint, walk down from last + 1 until one ends
+        # before first - 1
+        touching = []
+        cur.execute(TOUCHING_RANGES_SQL, (uid, last + 1))
+        for row in cur:
+            if row[1] < first - 1:
+                break
+            touching.append(row)
+
+        for rfirst, rlast, rftxtime, rltxtime in touching:
+            if rfirst < first:
+                first, ftxtime = rfirst, rftxtime
+            if rlast > last:
+                last, ltxtime = rlast, rltxtime
+
+        cur.executemany("DELETE FROM ranges WHERE uid == ? and first == ?",
+            [(uid, row[0]) for row in touching])
+        cur.execute(INSERT_RANGE_SQL, (uid, first, last, ftxtime, ltxtime))
+
+    def __move_watermarks(self, uid, marks):
+        self.__db_many(INSERT_FRIEND_SQL, [(uid, fid, txtime)
+            for fid, txtime in marks])
+        self.__db_many(UPDATE_FRIEND_SQL, [(txtime, uid, fid, txtime)
+            for fid, txtime in marks])
+
+    def insert(self, owner, rows):
+        stats = self.__stats
+        if stats != None:
+            begin = time.time()
+
+        try:
+            cur = self.__con.cursor()
+            fresh = []
+            words = []
+            for row in rows:
+                cur.execute(INSERT_POST_SQL, row)
+                if cur.rowcount > 0:
+                    fresh.append(row)
+                    words.append((cur.lastrowid, row[4]))
+
+            if self.__search:
+                cur.executemany(INSERT_FTS_SQL, words)
+
+            # the per row inserts count as one call per batch
+            if stats != None:
+                stats.record(INSERT_POST_SQL, time.time() - begin, len(fresh))
+
+            for run in runs(sorted((row[0], row[1], row[2])
+                for row in fresh)):
+                self.__merge_range(cur, *run)
+            cur.close()
+
+            self.__move_watermarks(owner, latest(rows).items())
+            self.__con.commit()
+
+        except:
+            self.__con.rollback()
+            raise
+
+        return fresh
+
+    def known(self, sigs):
+        result = set()
+        for i in range(0, len(sigs), KNOWN_CHUNK):
+            chunk = sigs[i:i + KNOWN_CHUNK]
+            result.update(row[0] for row in self.__db_call("SELECT sig FROM "
+                "posts WHERE sig IN (%s)" % ", ".join("?" * len(chunk)),
+                chunk, commit=False))
+        return result
+
+    def sigs(self):
+        for row in self.__con.execute("SELECT sig FROM posts"):
+            yield row[0]
+
+    def upsert_watermarks(self, uid, marks):
+        self.__move_watermarks(uid, marks)
+        self.__con.commit()
+
+    def watermarks(self, uid):
+        return self.__db_call(FRIENDS_SQL, (uid,))
+
+    def scan(self, uid=None, perms=None, begin=0, until=sys.maxint, limit=10,
+        display=False, sig=None):
+        columns = DISPLAY_COLUMNS if display else POST_COLUMNS
+
+        if uid == None:
+            return self.__db_call(GET_ALL_SQL % columns,
+                (begin, until, until, sig, limit))
+
+        return self.__db_call(GET_UID_SQL % columns,
+            (uid, perms, begin, until, until, sig, limit))
+
+    def fetch(self, uid, postids):
+        results = []
+        for i in range(0, len(postids), KNOWN_CHUNK):
+            chunk = list(postids[i:i + KNOWN_CHUNK])
+            results.extend(self.__db_call("SELECT %s FROM posts WHERE "
+                "uid == ? and perms == 1 and postid IN (%s)" % (POST_COLUMNS,
+                ", ".join("?" * len(chunk))), [uid] + chunk, commit=False))
+        return results
+
+    def private_keys(self):
+        return self.__db_call("SELECT uid, postid FROM posts WHERE perms != 1 "
+            "EXCEPT SELECT uid, postid FROM posts WHERE perms == 1 "
+            "ORDER BY uid, postid", commit=False)
+
+    def pull(self, uid, marks, limit):
+        # one join over all watermarks, oldest first so the requester
+        # can continue from where the limit cut the reply
+        self.__db_call("DELETE FROM pull", commit=False)
+        self.__db_many("INSERT OR REPLACE INTO pull (fid, txtime) "
+            "VALUES (?, ?)", marks)
+        self.__db_call(PULL_WATERMARK_SQL, (uid, uid), commit=False)
+        return self.__db_call(PULL_SQL, (limit,))
+
+    def gap_ranges(self, uid):
+        return self.__db_call(RANGES_SQL, (uid,))
+
+    def horizons(self):
+        return dict(self.__db_call("SELECT uid, txtime FROM horizons"))
+
+    def max_postid(self, uid):
+        return self.__db_call("SELECT MAX(postid) FROM posts WHERE uid == ?",
+            (uid, ))[0][0]
+
+    def search(self, text, uid=None, begin=0, until=sys.maxint, limit=10,
+        order='rank'):
+        if not self.__search:
+            raise StoreError("search needs a sqlite built with FTS5")
+        if order not in SEARCH_ORDERS:
+            raise StoreError("unknown search order: " + str(order))
+
+        try:
+            return self.__db_call(SEARCH_SQL % (DISPLAY_COLUMNS,
+                SEARCH_ORDERS[order]), (match_text(text), uid, uid, begin,
+                until, limit))
+        except sqlite3.OperationalError as oe:
+            raise StoreError(str(oe))
+
+    def __archive(self, where, params):
+        """Moves the posts matching where into archive segments and raises
+           the horizon of their authors, returns how many were moved"""
+
+        rows = self.__db_call("SELECT %s FROM posts WHERE %s ORDER BY uid, "
+            "txtime" % (POST_COLUMNS, where), params, commit=False)
+        segments, horizons = pack_segments(rows)
+
+        self.__db_many(INSERT_SEGMENT_SQL, [segment[:4] +
+            (sqlite3.Binary(segment[4]),) for segment in segments])
+        if self.__search:
+            self.__db_many(DELETE_FTS_SQL, [(row[6],) for row in rows])
+        self.__db_many("DELETE FROM posts WHERE sig == ?",
+            [(row[6],) for row in rows])
+        self.__db_many("INSERT OR IGNORE INTO horizons (uid, txtime) "
+            "VALUES (?, 0)", [(uid,) for uid, txtime in horizons])
+        self.__db_many("UPDATE horizons SET txtime = ? WHERE uid == ? and "
+            "txtime < ?", [(txtime, uid, txtime) for uid, txtime in horizons])
+
+        return len(rows)
+
+    def __db_size(self):
+        pages = self.__db_call("PRAGMA page_count", commit=False)[0][0]
+        free = self.__db_call("PRAGMA freelist_count", commit=False)[0][0]
+        size = self.__db_call("PRAGMA page_size", commit=False)[0][0]
+        return (pages - free) * size
+
+    def compact(self, owner, max_age=None, max_posts=None, max_bytes=None):
+        """Archives then gives back up to VACUUM_PAGES free pages"""
+
+        archived = 0
+
+        try:
+            if max_age != None:
+                archived += self.__archive("uid != ? and txtime < ?",
+                    (owner, time.time() - max_age))
+
+            if max_posts != None:
+                for uid, count in self.__db_call("SELECT uid, COUNT(*) FROM "
+                    "posts WHERE uid != ? GROUP BY uid HAVING COUNT(*) > ?",
+                    (owner, max_posts), commit=False):
+
+                    cutoff = self.__db_call("SELECT txtime FROM posts WHERE "
+                        "uid == ? ORDER BY txtime DESC LIMIT 1 OFFSET ?",
+                        (uid, max_posts - 1), commit=False)[0][0]
+                    archived += self.__archive("uid == ? and txtime < ?",
+                        (uid, cutoff))
+
+            while max_bytes != None and self.__db_size() > max_bytes:
+                # oldest first, a segment at a time
+                moved = self.__archive("sig IN (SELECT sig FROM posts WHERE "
+                    "uid != ? ORDER BY txtime LIMIT ?)", (owner, SEGMENT_SIZE))
+                archived += moved
+                if moved == 0:
+                    break
+
+            self.__con.commit()
+
+        except:
+            self.__con.rollback()
+            raise
+
+        free = self.__db_call("PRAGMA freelist_count")[0][0]
+        self.__db_call("PRAGMA incremental_vacuum(%d)" % VACUUM_PAGES)
+        freed = free - self.__db_call("PRAGMA freelist_count")[0][0]
+        size = self.__db_call("PRAGMA page_size")[0][0]
+
+        return archived, freed * size
+
+    def archive_scan(self, uid=None, begin=0, until=sys.maxint, limit=10):
+        return unpack_segments(self.__db_call(ARCHIVE_SQL,
+            (uid, uid, begin, until)), begin, until, limit)
+
+    def explain(self, action, params=()):
+        """Returns the detail column of EXPLAIN QUERY PLAN for a statement"""
+        plan = self.__db_call("EXPLAIN QUERY PLAN " + action, params)
+        return [row[-1] for row in plan]
+
+    def close(self):
+        self.__con.close()
+
+
+class RangeSet:
+    """Disjoint [first, last] postid ranges of one uid with the txtimes of
+       both ends, sorted by first"""
+
+    def __init__(self):
+        self.firsts = []
+        self.ranges = []
+
+    def merge(self, first, last, ftxtime, ltxtime):
+        # same walk as SQLiteEngine.__merge_range, down from last + 1
+        end = bisect.bisect_right(self.firsts, last + 1)
+        start = end
+        while start > 0 and self.ranges[start - 1][1] >= first - 1:
+            start -= 1
+
+        for rfirst, rlast, rftxtime, rltxtime in self.ranges[start:end]:
+            if rfirst < first:
+                first, ftxtime = rfirst, rftxtime
+            if rlast > last:
+                last, ltxtime = rlast, rltxtime
+
+        self.firsts[start:end] = [first]
+        self.ranges[start:end] = [(first, last, ftxtime, ltxtime)]
+
+
+class LogEngine(StorageEngine):
+    """Append-only log of numbered segment files in the <path>.log directory,
+       with the whole index kept in memory and rebuilt on open.
+
+       Records are length prefixed json lists: ['p', row...] a post,
+       ['w', uid, fid, txtime] a watermark, ['r', uid, first, last, ftxtime,
+       ltxtime] a range, ['h', uid, txtime] a horizon and ['d', sig] a post
+       moved to the archive file. Compaction rewrites the live records once
+       half of the log is dead and deletes the old segments."""
+
+    def __init__(self, path=None, readonly=False, stats=None,
+        segment_bytes=LOG_SEGMENT_BYTES):
+        if readonly:
+            raise StoreError("the log engine has a single writer")
+
+        self.__dir = path + ".log" if path != None else None
+        self.__stats = stats
+        self.__segment_bytes = segment_bytes
+        self.__files = {}
+        self.__active = None
+
+        # sig -> (segment, offset, size, uid, txtime, perms, postid)
+        self.__posts = {}
+        # sorted (txtime, sig) of every post and of every uid
+        self.__all = []
+        self.__uids = {}
+        self.__ranges = {}
+        self.__marks = {}
+        self.__horizons = {}
+        # bytes of live post records and of every record in the segments
+        self.__live = 0
+        self.__bytes = 0
+        # (uid, first, last, offset) of every archive segment
+        self.__segments = []
+
+        if self.__dir != None and not os.path.isdir(self.__dir):
+            os.makedirs(self.__dir)
+
+        self.__replay()
+
+    def __open(self, number):
+        if self.__dir == None:
+            f = io.BytesIO()
+        else:
+            f = open(os.path.join(self.__dir, "%08d.seg" % number), "a+b")
+        self.__files[number] = f
+        return f
+
+    def __sync(self, f):
+        f.flush()
+        if self.__dir != None:
+            os.fsync(f.fileno())
+
+    def __replay(self):
+        numbers = []
+        if self.__dir != None:
+            numbers = sorted(int(name[:-4]) for name in
+                os.listdir(self.__dir) if name.endswith(".seg"))
+
+        for number in numbers:
+            f = self.__open(number)
+            f.seek(0)
+            offset = 0
+            while True:
+                head = f.read(4)
+                if len(head) < 4:
+                    break
+                size = struct.unpack(">I", head)[0]
+                data = f.read(size)
+                if len(data) < size:
+                    break
+                self.__apply(json.loads(data), (number, offset, size + 4))
+                offset += size + 4
+
+            # drops a record torn by a crash so appends stay readable
+            f.seek(0, 2)
+            if f.tell() != offset:
+                logging.warning("truncating segment %d at %d" %
+                    (number, offset))
+                f.truncate(offset)
+
+        self.__active = numbers[-1] if numbers else 1
+        if self.__active not in self.__files:
+            self.__open(self.__active)
+
+        if self.__dir == None:
+            self.__archive = io.BytesIO()
+            return
+
+        self.__archive = open(os.path.join(self.__dir, "archive"), "a+b")
+        self.__archive.seek(0)
+        offset = 0
+        while True:
+            head = self.__archive.read(8)
+            if len(head) < 8:
+                break
+            hsize, dsize = struct.unpack(">II", head)
+            uid, first, last, count = json.loads(self.__archive.read(hsize))
+            self.__segments.append((uid, first, last, offset))
+            offset += 8 + hsize + dsize
+            self.__archive.seek(offset)
+
+    def __append(self, records):
+        """Writes records to the active segment with one fsync, returns
+           their (segment, offset, size)"""
+
+        stats = self.__stats
+        if stats != None:
+            begin = time.time()
+
+        f = self.__files[self.__active]
+        f.seek(0, 2)
+        offset = f.tell()
+        chunks = []
+        places = []
+
+        for record in records:
+            data = json.dumps(record)
+            chunks.append(struct.pack(">I", len(data)) + data)
+            places.append((self.__active, offset, len(data) + 4))
+            offset += len(data) + 4
+
+        f.write("".join(chunks))
+        self.__sync(f)
+
+        if stats != None:
+            stats.record("log append", time.time() - begin, len(records))
+
+        if offset > self.__segment_bytes:
+            self.__active += 1
+            self.__open(self.__active)
+
+        return places
+
+    def __write(self, records):
+        for record, place in zip(records, self.__append(records)):
+            self.__apply(record, place)
+
+    def __apply(self, record, place):
+        kind = record[0]
+        self.__bytes += place[2]
+
+        if kind == 'p':
+            uid, postid, txtime, perms, sig = (record[1], record[2],
+                record[3], record[6], record[7])
+            if sig in self.__posts:
+                return
+            self.__posts[sig] = place + (uid, txtime, perms, postid)
+            self.__live += place[2]
+            bisect.insort(self.__all, (txtime, sig))
+            bisect.insort(self.__uids.setdefault(uid, []), (txtime, sig))
+            self.__ranges.setdefault(uid, RangeSet()).merge(postid, postid,
+                txtime, txtime)
+
+        elif kind == 'd':
+            post = self.__posts.pop(record[1])
+            for index in (self.__all, self.__uids[post[3]]):
+                del index[bisect.bisect_left(index, (post[4], record[1]))]
+            self.__live -= post[2]
+
+        elif kind == 'w':
+            self.__marks.setdefault(record[1], {})[record[2]] = record[3]
+
+        elif kind == 'r':
+            self.__ranges.setdefault(record[1], RangeSet()).merge(*record[2:])
+
+        elif kind == 'h':
+            self.__horizons[record[1]] = record[2]
+
+    def __raw(self, sig):
+        post = self.__posts[sig]
+        f = self.__files[post[0]]
+        f.seek(post[1] + 4)
+        return json.loads(f.read(post[2] - 4))[1:]
+
+    def __read(self, sig, display=False):
+        (uid, postid, txtime, rxtime, msg, perms, sig, emsg,
+            euid) = self.__raw(sig)
+
+        if display:
+            return (emsg, euid, txtime, rxtime, postid, perms, sig)
+        return (msg, uid, txtime, rxtime, postid, perms, sig)
+
+    def __mark_records(self, uid, marks):
+        current = self.__marks.get(uid, {})
+        records = []
+
+        for fid, txtime in dict(marks).iteritems():
+            if fid not in current or (current[fid] != None and
+                current[fid] < txtime):
+                records.append(['w', uid, fid, txtime])
+
+        return records
+
+    def insert(self, owner, rows):
+        fresh = []
+        sigs = set()
+        for row in rows:
+            if row[6] not in self.__posts and row[6] not in sigs:
+                sigs.add(row[6])
+                fresh.append(row)
+
+        records = [['p'] + list(row) for row in fresh]
+        records.extend(self.__mark_records(owner, latest(rows).items()))
+
+        if records:
+            self.__write(records)
+
+        return fresh
+
+    def known(self, sigs):
+        return set(sig for sig in sigs if sig in self.__posts)
+
+    def sigs(self):
+        return iter(self.__posts.keys())
+
+    def upsert_watermarks(self, uid, marks):
+        records = self.__mark_records(uid, marks)
+        if records:
+            self.__write(records)
+
+    def watermarks(self, uid):
+        return self.__marks.get(uid, {}).items()
+
+    def scan(self, uid=None, perms=None, begin=0, until=sys.maxint, limit=10,
+        display=False, sig=None):
+        index = self.__all if uid == None else self.__uids.get(uid, [])
+        results = []
+
+        i = bisect.bisect_left(index, (until,) if sig == None else
+            (until, sig)) - 1
+        while i >= 0 and len(results) < limit:
+            txtime, sig = index[i]
+            if txtime <= begin:
+                break
+            if uid == None or self.__posts[sig][5] == perms:
+                results.append(self.__read(sig, display))
+            i -= 1
+
+        return results
+
+    def fetch(self, uid, postids):
+        postids = set(postids)
+        posts = self.__posts
+        return [self.__read(sig) for txtime, sig in self.__uids.get(uid, [])
+            if posts[sig][6] in postids and posts[sig][5] == 1]
+
+    def private_keys(self):
+        keys = {}
+        for sig, post in self.__posts.iteritems():
+            key = (post[3], post[6])
+            keys[key] = keys.get(key, False) or post[5] == 1
+        return sorted(key for key, public in keys.iteritems() if not public)
+
+    def __newer(self, fid, txtime):
+        """(txtime, sig) of the public posts of fid after txtime"""
+
+        index = self.__uids.get(fid, [])
+        for i in xrange(bisect.bisect_left(index, (txtime,)), len(index)):
+            if index[i][0] > txtime and self.__posts[index[i][1]][5] == 1:
+                yield index[i]
+
+    def pull(self, uid, marks, limit):
+        marks = dict(marks)
+        self.upsert_watermarks(uid, marks.items())
+
+        merged = heapq.merge(*[self.__newer(fid, txtime)
+            for fid, txtime in marks.iteritems()])
+        return [self.__read(sig) for txtime, sig in
+            itertools.islice(merged, limit)]
+
+    def gap_ranges(self, uid):
+        results = []
+        for fid in sorted(self.__marks.get(uid, {})):
+            if fid in self.__ranges:
+                results.extend((fid,) + r for r in self.__ranges[fid].ranges)
+        return results
+
+    def horizons(self):
+        return dict(self.__horizons)
+
+    def max_postid(self, uid):
+        ranges = self.__ranges.get(uid, None)
+        return ranges.ranges[-1][1] if ranges != None else None
+
+    def __state(self):
+        """Watermark, range and horizon records of the current state"""
+
+        records = []
+        for uid, marks in self.__marks.iteritems():
+            records.extend(['w', uid, fid, txtime]
+                for fid, txtime in marks.iteritems())
+        for uid, ranges in self.__ranges.iteritems():
+            records.extend(['r', uid] + list(r) for r in ranges.ranges)
+        records.extend(['h', uid, txtime]
+            for uid, txtime in self.__horizons.iteritems())
+        return records
+
+    def compact(self, owner, max_age=None, max_posts=None, max_bytes=None):
+        """Archives then rewrites the log once half of it is dead"""
+
+        victims = set()
+
+        if max_age != None:
+            cutoff = time.time() - max_age
+            for txtime, sig in self.__all:
+                if txtime >= cutoff:
+                    break
+                if self.__posts[sig][3] != owner:
+                    victims.add(sig)
+
+        if max_posts != None:
+            for uid, index in self.__uids.iteritems():
+                if uid != owner and len(index) > max_posts:
+                    cutoff = index[-max_posts][0]
+                    victims.update(sig for txtime, sig in index
+                        if txtime < cutoff)
+
+        if max_bytes != None:
+            live = self.__live - sum(self.__posts[sig][2] for sig in victims)
+            for txtime, sig in self.__all:
+                if live <= max_bytes:
+                    break
+                if sig not in victims and self.__posts[sig][3] != owner:
+                    victims.add(sig)
+                    live -= self.__posts[sig][2]
+
+        if victims:
+            self.__archive_posts(victims)
+
+        # replaced watermarks, duplicates and archived posts
+        state = self.__state()
+        needed = self.__live + sum(len(json.dumps(record)) + 4
+            for record in state)
+
+        freed = 0
+        if self.__bytes - needed > needed:
+            freed = self.__rewrite(state)
+
+        return len(victims), freed
+
+    def __archive_posts(self, sigs):
+        rows = sorted((self.__read(sig) for sig in sigs),
+            key=lambda row: (row[1], row[2]))
+        segments, horizons = pack_segments(rows)
+
+        self.__archive.seek(0, 2)
+        offset = self.__archive.tell()
+        for uid, first, last, count, data in segments:
+            header = json.dumps([uid, first, last, count])
+            self.__archive.write(struct.pack(">II", len(header), len(data)) +
+                header + data)
+            self.__segments.append((uid, first, last, offset))
+            offset += 8 + len(header) + len(data)
+        self.__sync(self.__archive)
+
+        # the archive is on disk before the posts leave the log
+        records = [['d', row[6]] for row in rows]
+        records.extend(['h', uid, txtime] for uid, txtime in horizons
+            if self.__horizons.get(uid, 0) < txtime)
+        self.__write(records)
+
+    def __rewrite(self, state):
+        """Copies the posts and state records to new segments then deletes
+           the old ones, returns the freed bytes"""
+
+        old = sorted(self.__files)
+        before = self.__bytes
+
+        self.__active = old[-1] + 1
+        self.__open(self.__active)
+        self.__live = self.__bytes = 0
+
+        # posts keep their place in the index, only where they are moves
+        posts = [(sig, ['p'] + list(self.__raw(sig)))
+            for txtime, sig in self.__all]
+        for i in range(0, len(posts), SEGMENT_SIZE):
+            chunk = posts[i:i + SEGMENT_SIZE]
+            places = self.__append([record for sig, record in chunk])
+            for (sig, record), place in zip(chunk, places):
+                self.__posts[sig] = place + self.__posts[sig][3:]
+                self.__live += place[2]
+                self.__bytes += place[2]
+
+        for place in self.__append(state):
+            self.__bytes += place[2]
+
+        for number in old:
+            self.__files.pop(number).close()
+            if self.__dir != None:
+                os.remove(os.path.join(self.__dir, "%08d.seg" % number))
+
+        return before - self.__bytes
+
+    def __archived(self, uid, begin, until):
+        segments = sorted((s for s in self.__segments if (uid == None or
+            s[0] == uid) and s[2] > begin and s[1] < until),
+            key=lambda s: s[2], reverse=True)
+
+        for suid, first, last, offset in segments:
+            self.__archive.seek(offset)
+            hsize, dsize = struct.unpack(">II", self.__archive.read(8))
+            self.__archive.seek(offset + 8 + hsize)
+            yield last, self.__archive.read(dsize)
+
+    def archive_scan(self, uid=None, begin=0, until=sys.maxint, limit=10):
+        return unpack_segments(self.__archived(uid, begin, until), begin,
+            until, limit)
+
+    def close(self):
+        for f in self.__files.values():
+            f.close()
+        self.__archive.close()
+
+
+def shard_of(uid, count):
+    """Shard holding the posts, ranges and horizon of an author, and the
+       watermarks other nodes keep for it"""
+    if isinstance(uid, unicode):
+        uid = uid.encode("utf-8")
+    return (zlib.crc32(uid) & 0xffffffff) % count
+
+
+def shard_paths(path, count):
+    """File prefixes of the shards, named after the count so a reshard
+       can write the new set next to the old one"""
+    return ["%s.%d-%d" % (path, count, i) for i in range(count)]
+
+
+def read_shards(path):
+    """Shard count of a sharded store, None if it was never created"""
+
+    if path == None or not os.path.isfile(path + ".shards"):
+        return None
+
+    with open(path + ".shards") as f:
+        return int(f.read())
+
+
+def write_shards(path, count):
+    with open(path + ".shards.tmp", "w") as f:
+        f.write("%d\n" % count)
+    os.rename(path + ".shards.tmp", path + ".shards")
+
+
+class ShardThread(threading.Thread):
+    """Owns the SQLiteEngine of one shard, its connection stays in the
+       thread that opened it. Jobs are functions of the engine."""
+
+    def __init__(self, path, readonly, stats):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.__args = (path, readonly, stats)
+        self.__jobs = Queue.Queue()
+        self.start()
+
+        # opens the shard, a broken file fails here instead of later
+        err, result = self.submit(lambda engine: None).get()
+        if err != None:
+            self.stop()
+            raise err
+
+    def run(self):
+        engine = None
+        while True:
+            job, reply = self.__jobs.get()
+            if job == None:
+                break
+
+            try:
+                if engine == None:
+                    engine = SQLiteEngine(*self.__args)
+                reply.put((None, job(engine)))
+            except Exception as ex:
+                reply.put((ex, None))
+
+        if engine != None:
+            engine.close()
+
+    def submit(self, job):
+        """Queues job, returns the queue its (error, result) comes back on"""
+        reply = Queue.Queue(1)
+        self.__jobs.put((job, reply))
+        return reply
+
+    def stop(self):
+        self.__jobs.put((None, None))
+        self.join()
+
+
+class ShardedEngine(StorageEngine):
+    """Posts partitioned by author across SQLite files, each written by
+       its own thread. Queries for one author go to its shard, the others
+       run on every shard at once and are merged."""
+
+    def __init__(self, path=None, readonly=False, stats=None, shards=SHARDS):
+        count = read_shards(path)
+        if count == None:
+            if readonly:
+                raise StoreError("no sharded store at " + str(path))
+            if path != None and os.path.isfile(path + ".db"):
+                raise StoreError("%s.db is a single file store, convert it "
+                    "with reshard.py" % path)
+            count = shards
+            if path != None:
+                write_shards(path, count)
+
+        self.__count = count
+        paths = shard_paths(path, count) if path != None else [None] * count
+        self.__shards = [ShardThread(shard, readonly, stats)
+            for shard in paths]
+
+    def __shard(self, uid):
+        return shard_of(uid, self.__count)
+
+    def __call(self, jobs):
+        """Runs {shard: job} on their shards in parallel, returns the
+           results by shard"""
+
+        replies = [(i, self.__shards[i].submit(job))
+            for i, job in jobs.iteritems()]
+
+        results = {}
+        error = None
+        for i, reply in replies:
+            err, results[i] = reply.get()
+            if error == None:
+                error = err
+
+        if error != None:
+            raise error
+        return results
+
+    def __all(self, job):
+        return self.__call(dict((i, job) for i in
+            range(self.__count))).values()
+
+    def __one(self, uid, job):
+        shard = self.__shard(uid)
+        return self.__call({shard: job})[shard]
+
+    def __group(self, items, uid=lambda item: item[0]):
+        groups = {}
+        for item in items:
+            groups.setdefault(self.__shard(uid(item)), []).append(item)
+        return groups
+
+    @staticmethod
+    def __newest(lists, limit):
+        """k-way merge of display or post rows sorted newest first"""
+
+        merged = heapq.merge(*[[((row[2], row[6]), row) for row in
+            reversed(rows)] for rows in lists])
+        return [row for key, row in reversed(list(merged))][:limit]
+
+    def insert(self, owner, rows):
+        # each shard moves the watermarks of owner for its own authors
+        groups = self.__group(rows)
+        results = self.__call(dict((i, lambda engine, group=group:
+            engine.insert(owner, group)) for i, group in groups.iteritems()))
+        return list(itertools.chain(*results.values()))
+
+    def known(self, sigs):
+        return set().union(*self.__all(lambda engine: engine.known(sigs)))
+
+    def sigs(self):
+        return itertools.chain(*self.__all(lambda engine:
+            list(engine.sigs())))
+
+    def upsert_watermarks(self, uid, marks):
+        groups = self.__group(marks)
+        self.__call(dict((i, lambda engine, group=group:
+            engine.upsert_watermarks(uid, group))
+            for i, group in groups.iteritems()))
+
+    def watermarks(self, uid):
+        return list(itertools.chain(*self.__all(lambda engine:
+            engine.watermarks(uid))))
+
+    def scan(self, uid=None, perms=None, begin=0, until=sys.maxint, limit=10,
+        display=False, sig=None):
+        job = lambda engine: engine.scan(uid, perms, begin, until, limit,
+            display, sig)
+
+        if uid != None:
+            return self.__one(uid, job)
+        return self.__newest(self.__all(job), limit)
+
+    def pull(self, uid, marks, limit):
+        groups = self.__group(dict(marks).items())
+        results = self.__call(dict((i, lambda engine, group=group:
+            engine.pull(uid, group, limit))
+            for i, group in groups.iteritems()))
+
+        # oldest first, same as a single file
+        merged = heapq.merge(*[[((row[2], row[6]), row) for row in rows]
+            for rows in results.values()])
+        return [row for key, row in itertools.islice(merged, limit)]
+
+    def fetch(self, uid, postids):
+        return self.__one(uid, lambda engine: engine.fetch(uid, postids))
+
+    def private_keys(self):
+        return sorted(itertools.chain(*self.__all(lambda engine:
+            engine.private_keys())))
+
+    def gap_ranges(self, uid):
+        return sorted(itertools.chain(*self.__all(lambda engine:
+            engine.gap_ranges(uid))))
+
+    def horizons(self):
+        result = {}
+        for horizons in self.__all(lambda engine: engine.horizons()):
+            result.update(horizons)
+        return result
+
+    def max_postid(self, uid):
+        return self.__one(uid, lambda engine: engine.max_postid(uid))
+
+    def search(self, text, uid=None, begin=0, until=sys.maxint, limit=10,
+        order='rank'):
+        job = lambda engine: engine.search(text, uid, begin, until, limit,
+            order)
+
+        if uid != None:
+            return self.__one(uid, job)
+
+        lists = self.__all(job)
+        if order == 'time':
+            return self.__newest(lists, limit)
+
+        # bm25 scores of different shards are close but not comparable,
+        # the best of every shard come first
+        ranked = itertools.izip_longest(*lists)
+        return [row for row in itertools.chain(*ranked) if row != None][:limit]
+
+    def compact(self, owner, max_age=None, max_posts=None, max_bytes=None):
+        """Every shard keeps its share of max_bytes"""
+
+        if max_bytes != None:
+            max_bytes /= self.__count
+
+        results = self.__all(lambda engine: engine.compact(owner, max_age,
+            max_posts, max_bytes))
+        return (sum(archived for archived, freed in results),
+            sum(freed for archived, freed in results))
+
+    def archive_scan(self, uid=None, begin=0, until=sys.maxint, limit=10):
+        job = lambda engine: engine.archive_scan(uid, begin, until, limit)
+
+        if uid != None:
+            return self.__one(uid, job)
+        return self.__newest(self.__all(job), limit)
+
+    def explain(self, action, params=()):
+        return self.__call({0: lambda engine: engine.explain(action,
+            params)})[0]
+
+    def close(self):
+        for shard in self.__shards:
+            shard.stop()
+
+
+# storage engines by name, selected with LitterStore(engine=...)
+ENGINES = {'sqlite': SQLiteEngine, 'log': LogEngine, 'sharded': ShardedEngine}
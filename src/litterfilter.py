@@ -0,0 +1,144 @@
+#!/usr/bin/env python
+
+import os
+import zlib
+import math
+import struct
+
+# sigs the filter is sized for and the false positive rate it has there
+FILTER_CAPACITY = 1000000
+FILTER_FP_RATE = 0.01
+
+# the bit array is written back to its file in pages of this many bytes,
+# once every SAVE_ADDS sigs and on close
+PAGE_SIZE = 4096
+PAGE_SHIFT = 15
+SAVE_ADDS = 1000
+
+HEADER = struct.Struct(">4sQQQ")
+MAGIC = "LBF2"
+
+
+class BloomFilter:
+    """Bloom filter over post sigs. A miss means the sig was never added,
+       a hit has to be confirmed since it can be a false positive.
+
+       With a path the bit array lives in a sidecar file, only the pages
+       changed since the last save are written back."""
+
+    def __init__(self, path=None, capacity=FILTER_CAPACITY,
+        fp_rate=FILTER_FP_RATE):
+        self.path = path
+        self.bits = int(math.ceil(-capacity * math.log(fp_rate) /
+            math.log(2) ** 2))
+        self.hashes = max(1, int(round(float(self.bits) / capacity *
+            math.log(2))))
+        self.count = 0
+
+        # sigs looked up, dropped as confirmed duplicates and hits that
+        # turned out to be new
+        self.checked = 0
+        self.skipped = 0
+        self.false_positives = 0
+
+        self.__array = bytearray((self.bits + 7) / 8)
+        self.__dirty = set()
+        self.__unsaved = 0
+
+    def __start(self, sig):
+        """First bit and step of the double hashing h1 + i * h2, from two
+           checksums since sigs are already hashes"""
+
+        if isinstance(sig, unicode):
+            sig = sig.encode("utf-8")
+        bits = self.bits
+        return ((zlib.crc32(sig) & 0xffffffff) % bits,
+            (zlib.adler32(sig) & 0xffffffff) % (bits - 1) + 1)
+
+    def __contains__(self, sig):
+        array = self.__array
+        bits = self.bits
+        pos, step = self.__start(sig)
+
+        for i in xrange(self.hashes):
+            if not array[pos >> 3] & (1 << (pos & 7)):
+                return False
+            pos += step
+            if pos >= bits:
+                pos -= bits
+        return True
+
+    def add(self, sig):
+        array = self.__array
+        bits = self.bits
+        pos, step = self.__start(sig)
+
+        for i in xrange(self.hashes):
+            array[pos >> 3] |= 1 << (pos & 7)
+            self.__dirty.add(pos >> PAGE_SHIFT)
+            pos += step
+            if pos >= bits:
+                pos -= bits
+        self.count += 1
+
+        self.__unsaved += 1
+        if self.__unsaved >= SAVE_ADDS:
+            self.save()
+
+    @property
+    def fp_rate(self):
+        """Expected false positive rate at the current count"""
+        return (1 - math.exp(-float(self.hashes) * self.count /
+            self.bits)) ** self.hashes
+
+    def load(self):
+        """Reads the sidecar file, False if it is missing or was written
+           for another size, the caller then adds every sig again"""
+
+        if self.path == None or not os.path.isfile(self.path):
+            return False
+
+        with open(self.path, "rb") as f:
+            header = f.read(HEADER.size)
+            if len(header) < HEADER.size:
+                return False
+            magic, bits, hashes, count = HEADER.unpack(header)
+            if magic != MAGIC or bits != self.bits or hashes != self.hashes:
+                return False
+            data = f.read()
+
+        if len(data) != len(self.__array):
+            return False
+
+        self.__array = bytearray(data)
+        self.count = count
+        self.__dirty = set()
+        self.__unsaved = 0
+        return True
+
+    def save(self):
+        """Writes the header and the changed pages, without fsync since a
+           lost page only costs lookups that the store does anyway"""
+
+        self.__unsaved = 0
+        if self.path == None:
+            return
+
+        if not os.path.isfile(self.path):
+            self.__dirty = set(range(len(self.__array) / PAGE_SIZE + 1))
+            open(self.path, "wb").close()
+
+        with open(self.path, "r+b") as f:
+            f.write(HEADER.pack(MAGIC, self.bits, self.hashes, self.count))
+            for page in sorted(self.__dirty):
+                f.seek(HEADER.size + page * PAGE_SIZE)
+                f.write(self.__array[page * PAGE_SIZE:
+                    (page + 1) * PAGE_SIZE])
+
+        self.__dirty = set()
+
+    def stats(self):
+        return {'count': self.count, 'bits': self.bits,
+                'hashes': self.hashes, 'fp_rate': self.fp_rate,
+                'checked': self.checked, 'skipped': self.skipped,
+                'false_positives': self.false_positives}
@@ -1,9 +1,14 @@
 #!/usr/bin/env python
 
-import json
+import time
 import socket
 import random
 import logging
+import threading
+import collections
+
+from litterwire import WIRE_VERSION, MTU, BATCH_OVERHEAD, WireError, \
+    WireStats, encode, encode_json, compress, decode, fragment, batch
 
 #logging.basicConfig(level=logging.DEBUG)
 
@@ -12,6 +17,53 @@ PORT = 50000
 LOOP_ADDR = "127.0.0.1"
 IP_ANY = "0.0.0.0"
 
+# peers and uids we heard from, forgotten after an hour of silence
+ROUTE_CAPACITY = 1024
+ROUTE_TTL = 3600
+
+# reply routes of forwarded requests, replies come back within seconds
+REQUEST_CAPACITY = 4096
+REQUEST_TTL = 120
+
+# a flooded message reaches every node within a few hops, copies arriving
+# later than SEEN_TTL seconds are processed again
+SEEN_TTL = 30
+SEEN_BUCKETS = 6
+
+# a request sent to any peer that got no reply in REPLY_TIMEOUT seconds
+# counts against the next hop it went to
+REPLY_TIMEOUT = 5
+
+# weight of a new sample in the reply time and success averages, scores
+# drift back to the prior with a half life of SCORE_DECAY seconds
+SCORE_ALPHA = 0.25
+SCORE_DECAY = 600
+
+# what a peer without samples is assumed to do
+PRIOR_RTT = 0.5
+PRIOR_SUCCESS = 1.0
+
+# share of requests to any peer that go to a uniformly chosen one, so new
+# and badly scored peers keep getting tried
+PROBE_RATE = 0.1
+
+# packets a second one address may put in the worker queue, and how many
+# it may send at once after a quiet spell
+PEER_RATE = 50
+PEER_BURST = 100
+
+# the same for all addresses together
+INGRESS_RATE = 500
+INGRESS_BURST = 1000
+
+# packets from peers are shed once the worker queue is this full, so the
+# browser and the timers still get in
+SHED_FILL = 0.5
+
+# unicast packets to peers that read batches wait this long for others to
+# the same next hop
+COALESCE_WINDOW = 0.02
+
 class Sender:
     """Base class sender interface"""
 
@@ -25,10 +77,11 @@ class Sender:
 class UDPSender(Sender):
     """Implements sender over UDP socket"""
 
-    def __init__(self, sock, intfs=None, dest=None):
+    def __init__(self, sock, intfs=None, dest=None, msocks=None):
         self.__sock = sock
         self.__dest = dest
         self.__intfs = intfs
+        self.__msocks = msocks
 
     @property
     def dest(self):
@@ -37,14 +90,26 @@ class UDPSender(Sender):
     def __str__(self):
         return "UDP Sender: %s" % (self.dest,)
 
-    def send(self, data, dest=None):
+    def __sendto(self, data, dest, mtu):
+        if mtu != None and len(data) > mtu:
+            for piece in fragment(data, mtu):
+                self.__sock.sendto(piece, dest)
+        else:
+            self.__sock.sendto(data, dest)
+
+    def send(self, data, dest=None, mtu=None):
         """Sends over UDP socket, if no destination address is found,
-           multicast address is used"""
+           multicast address is used, from msocks when there are sockets
+           set to each interface. Unicast data longer than mtu is sent as
+           fragments."""
 
         if dest == None and self.__dest == None and self.__intfs != None:
             dest = (MCAST_ADDR, PORT)
 
-            if len(self.__intfs) > 0:
+            if self.__msocks != None:
+                for msock in self.__msocks:
+                    msock.sendto(data, dest)
+            elif len(self.__intfs) > 0:
                 for intf in self.__intfs:
                     self.__sock.setsockopt(socket.SOL_IP, 
                         socket.IP_MULTICAST_IF, socket.inet_aton(intf))
@@ -62,12 +127,12 @@ class UDPSender(Sender):
 
         elif dest == None and self.__dest != None:
             dest = self.__dest
-            self.__sock.sendto(data, dest)
+            self.__sendto(data, dest, mtu)
 
         elif dest != None:
-            self.__sock.sendto(data, dest)
+            self.__sendto(data, dest, mtu)
 
-        logging.debug('UDP send : %s : %s' % (dest, data))
+        logging.debug('UDP send : %s : %r', dest, data)
         return dest
 
 
@@ -96,6 +161,426 @@ class HTTPSender(Sender):
 
 
 
+class RouteTable:
+    """Bounded map of routes. Entries expire ttl seconds after they were
+       last heard and the least recently heard one is evicted when the
+       table is full. Membership, lookups and random choice are O(1)."""
+
+    def __init__(self, capacity, ttl=None):
+        self.capacity = capacity
+        self.ttl = ttl
+        self.clock = time.time
+        self.evicted = 0
+        self.expired = 0
+
+        # key -> (value, time heard), least recently heard first
+        self.__entries = collections.OrderedDict()
+        # the same keys in no order, and their positions, for choice
+        self.__keys = []
+        self.__index = {}
+
+    def __remove(self, key):
+        del self.__entries[key]
+
+        # the last key takes the place of the removed one
+        pos = self.__index.pop(key)
+        last = self.__keys.pop()
+        if pos < len(self.__keys):
+            self.__keys[pos] = last
+            self.__index[last] = pos
+
+    def __expire(self):
+        """Drops expired entries, they are all at the front"""
+
+        if self.ttl == None:
+            return
+
+        deadline = self.clock() - self.ttl
+        entries = self.__entries
+        while len(entries) > 0:
+            key = next(iter(entries))
+            if entries[key][1] > deadline:
+                break
+            self.__remove(key)
+            self.expired += 1
+
+    def put(self, key, value):
+        """Adds or refreshes an entry as the most recently heard"""
+
+        if key in self.__entries:
+            del self.__entries[key]
+        else:
+            self.__index[key] = len(self.__keys)
+            self.__keys.append(key)
+        self.__entries[key] = (value, self.clock())
+
+        self.__expire()
+        while len(self.__entries) > self.capacity:
+            self.__remove(next(iter(self.__entries)))
+            self.evicted += 1
+
+    def get(self, key, default=None):
+        self.__expire()
+        entry = self.__entries.get(key, None)
+        return entry[0] if entry != None else default
+
+    def choice(self):
+        """A random key, None when the table is empty"""
+
+        self.__expire()
+        if len(self.__keys) < 1:
+            return None
+        return random.choice(self.__keys)
+
+    def keys(self):
+        self.__expire()
+        return list(self.__keys)
+
+    def __contains__(self, key):
+        self.__expire()
+        return key in self.__entries
+
+    def __len__(self):
+        self.__expire()
+        return len(self.__entries)
+
+    def stats(self):
+        return {'size': len(self), 'capacity': self.capacity,
+                'ttl': self.ttl, 'evicted': self.evicted,
+                'expired': self.expired}
+
+
+class SeenCache:
+    """Keys of recently seen messages in SEEN_BUCKETS sets of ttl / buckets
+       seconds each. The oldest set is dropped as a whole when time moves
+       past it, so a key is remembered between ttl - ttl / buckets and ttl
+       seconds."""
+
+    def __init__(self, ttl=SEEN_TTL, buckets=SEEN_BUCKETS):
+        self.ttl = ttl
+        self.width = float(ttl) / buckets
+        self.clock = time.time
+        self.checked = 0
+        self.duplicates = 0
+
+        self.__count = buckets
+        self.__buckets = collections.deque([set()])
+        self.__start = None
+
+    def __rotate(self):
+        now = self.clock()
+        if self.__start == None:
+            self.__start = now
+
+        steps = int((now - self.__start) / self.width)
+        if steps < 1:
+            return
+
+        self.__start += steps * self.width
+        if steps >= self.__count:
+            self.__buckets.clear()
+            steps = 1
+        for i in range(steps):
+            self.__buckets.append(set())
+        while len(self.__buckets) > self.__count:
+            self.__buckets.popleft()
+
+    def __contains__(self, key):
+        self.__rotate()
+        for bucket in self.__buckets:
+            if key in bucket:
+                return True
+        return False
+
+    def add(self, key):
+        self.__rotate()
+        self.__buckets[-1].add(key)
+
+    def seen(self, key):
+        """True when key was seen before, records it otherwise"""
+
+        self.checked += 1
+        if key in self:
+            self.duplicates += 1
+            return True
+        self.__buckets[-1].add(key)
+        return False
+
+    def stats(self):
+        return {'size': sum(len(bucket) for bucket in self.__buckets),
+                'ttl': self.ttl, 'checked': self.checked,
+                'duplicates': self.duplicates}
+
+
+class PeerScores:
+    """Reply time and success rate of next hops, measured on requests sent
+       to any peer by matching the replies that come back. Next hops are
+       drawn with weights success / rtt, so quick and reliable peers get
+       most requests and the others a share through probes."""
+
+    def __init__(self, timeout=REPLY_TIMEOUT, capacity=REQUEST_CAPACITY,
+        alpha=SCORE_ALPHA, decay=SCORE_DECAY, probe=PROBE_RATE):
+        self.timeout = timeout
+        self.capacity = capacity
+        self.alpha = alpha
+        self.decay = decay
+        self.probe = probe
+        self.clock = time.time
+        self.replies = 0
+        self.timeouts = 0
+        self.probes = 0
+
+        # addr -> [rtt, success, last sample], least recently sampled first
+        self.__scores = collections.OrderedDict()
+        # (hfrom, hid) -> (addr, time sent), oldest first
+        self.__pending = collections.OrderedDict()
+
+    def __sample(self, addr, now, rtt, success):
+        alpha = self.alpha
+        score = self.__scores.pop(addr, None)
+        if score == None:
+            score = [PRIOR_RTT, PRIOR_SUCCESS, now]
+        if rtt != None:
+            score[0] += alpha * (rtt - score[0])
+        score[1] += alpha * (success - score[1])
+        score[2] = now
+        self.__scores[addr] = score
+
+        while len(self.__scores) > self.capacity:
+            self.__scores.popitem(last=False)
+
+    def __expire(self, now):
+        """Requests past the timeout are failures of their next hop"""
+
+        pending = self.__pending
+        while len(pending) > 0:
+            key = next(iter(pending))
+            addr, sent = pending[key]
+            if sent > now - self.timeout and len(pending) <= self.capacity:
+                break
+            del pending[key]
+            if sent <= now - self.timeout:
+                self.__sample(addr, now, None, 0.0)
+                self.timeouts += 1
+
+    def sent(self, key, addr):
+        """A request that expects a reply went to addr"""
+
+        now = self.clock()
+        self.__pending[key] = (addr, now)
+        self.__expire(now)
+
+    def replied(self, key):
+        """A reply came back, only the first one is a sample"""
+
+        now = self.clock()
+        self.__expire(now)
+        request = self.__pending.pop(key, None)
+        if request != None:
+            self.__sample(request[0], now, now - request[1], 1.0)
+            self.replies += 1
+
+    def weight(self, addr, now=None):
+        now = self.clock() if now == None else now
+        score = self.__scores.get(addr, None)
+        if score == None:
+            return PRIOR_SUCCESS / PRIOR_RTT
+
+        # old samples say less about the peer than new ones
+        fade = 0.5 ** ((now - score[2]) / self.decay)
+        rtt = PRIOR_RTT + (score[0] - PRIOR_RTT) * fade
+        success = PRIOR_SUCCESS + (score[1] - PRIOR_SUCCESS) * fade
+        return max(success, 0.01) / max(rtt, 0.001)
+
+    def choose(self, addrs):
+        """A next hop out of addrs, None when there is none"""
+
+        if len(addrs) < 1:
+            return None
+        if random.random() < self.probe:
+            self.probes += 1
+            return random.choice(addrs)
+
+        now = self.clock()
+        self.__expire(now)
+        weights = [self.weight(addr, now) for addr in addrs]
+        pick = random.random() * sum(weights)
+        for addr, weight in zip(addrs, weights):
+            pick -= weight
+            if pick < 0:
+                return addr
+        return addrs[-1]
+
+    def stats(self):
+        """Counters and the scores of the peers sampled, times in ms"""
+
+        scores = self.__scores.values()
+        return {'peers': len(scores), 'pending': len(self.__pending),
+                'replies': self.replies, 'timeouts': self.timeouts,
+                'probes': self.probes,
+                'rtt_ms': sum(score[0] for score in scores) * 1000 /
+                    max(len(scores), 1),
+                'success': sum(score[1] for score in scores) /
+                    max(len(scores), 1)}
+
+
+class IngressLimiter:
+    """Token buckets for every source address and one for all of them,
+       checked before a packet from the network is queued for the worker.
+       A packet takes a token from both, without one it is throttled, and
+       when the queue is fuller than shed_fill it is shed."""
+
+    def __init__(self, rate=PEER_RATE, burst=PEER_BURST,
+        global_rate=INGRESS_RATE, global_burst=INGRESS_BURST,
+        shed_fill=SHED_FILL, capacity=ROUTE_CAPACITY):
+        self.rate = rate
+        self.burst = burst
+        self.global_rate = global_rate
+        self.global_burst = global_burst
+        self.shed_fill = shed_fill
+        self.capacity = capacity
+        self.clock = time.time
+        self.admitted = 0
+        self.throttled = 0
+        self.throttled_global = 0
+        self.shed = 0
+
+        # addr -> [tokens, last refill], least recently heard first
+        self.__lock = threading.Lock()
+        self.__buckets = collections.OrderedDict()
+        self.__global = [global_burst, None]
+
+    def __refill(self, bucket, rate, burst, now):
+        if bucket[1] != None:
+            bucket[0] = min(burst, bucket[0] + (now - bucket[1]) * rate)
+        bucket[1] = now
+
+    def admit(self, addr, fill=0.0):
+        """True when a packet from addr may join a worker queue that is
+           fill full, between 0 and 1"""
+
+        now = self.clock()
+        with self.__lock:
+            if fill >= self.shed_fill:
+                self.shed += 1
+                return False
+
+            bucket = self.__buckets.pop(addr, None)
+            if bucket == None:
+                bucket = [self.burst, None]
+            self.__buckets[addr] = bucket
+            while len(self.__buckets) > self.capacity:
+                self.__buckets.popitem(last=False)
+
+            # a throttled peer does not use up the tokens of the others
+            self.__refill(bucket, self.rate, self.burst, now)
+            if bucket[0] < 1:
+                self.throttled += 1
+                return False
+
+            self.__refill(self.__global, self.global_rate,
+                self.global_burst, now)
+            if self.__global[0] < 1:
+                self.throttled_global += 1
+                return False
+
+            bucket[0] -= 1
+            self.__global[0] -= 1
+            self.admitted += 1
+            return True
+
+    def stats(self):
+        with self.__lock:
+            return {'peers': len(self.__buckets), 'rate': self.rate,
+                    'global_rate': self.global_rate,
+                    'admitted': self.admitted, 'throttled': self.throttled,
+                    'throttled_global': self.throttled_global,
+                    'shed': self.shed}
+
+
+class Coalescer:
+    """Packets waiting to go out, per next hop. Those of a next hop leave as
+       one batch once the first of them waited window seconds, when the
+       next one would not fit in mtu bytes or when an urgent one joins."""
+
+    def __init__(self, window=COALESCE_WINDOW, mtu=MTU):
+        self.window = window
+        self.mtu = mtu
+        self.clock = time.time
+        self.packets = 0
+        self.sends = 0
+        self.delay = 0.0
+        self.max_delay = 0.0
+
+        # dest -> [first added, sender, packets, batch size, sum of the
+        # times they were added], first added first
+        self.__pending = collections.OrderedDict()
+
+    def __send(self, dest, now):
+        first, sender, packets, size, added = self.__pending.pop(dest)
+
+        self.packets += len(packets)
+        self.sends += 1
+        self.delay += now * len(packets) - added
+        self.max_delay = max(self.max_delay, now - first)
+
+        try:
+            if len(packets) > 1:
+                sender.send(batch(packets))
+            else:
+                sender.send(packets[0], mtu=self.mtu)
+        except socket.error as ex:
+            logging.exception(ex)
+
+    def add(self, sender, packet, urgent=False):
+        dest = sender.dest
+        now = self.clock()
+        pending = self.__pending
+
+        entry = pending.get(dest, None)
+        if entry != None and \
+            entry[3] + len(packet) + BATCH_OVERHEAD > self.mtu:
+            self.__send(dest, now)
+            entry = None
+
+        if entry == None:
+            entry = pending[dest] = [now, sender, [], 1, 0.0]
+        entry[2].append(packet)
+        entry[3] += len(packet) + BATCH_OVERHEAD
+        entry[4] += now
+
+        # too big to share a datagram, or somebody waits for it
+        if urgent or entry[3] > self.mtu:
+            self.__send(dest, now)
+
+    def flush(self, force=False):
+        """Sends the batches that waited window seconds, all of them with
+           force. Seconds until the next one is due, None when none wait."""
+
+        now = self.clock()
+        pending = self.__pending
+        while len(pending) > 0:
+            dest = next(iter(pending))
+            wait = pending[dest][0] + self.window - now
+            if wait > 0 and not force:
+                return wait
+            self.__send(dest, now)
+        return None
+
+    def stats(self):
+        """Packets sent and the datagrams they took, delays in ms"""
+        return {'window': self.window * 1000, 'packets': self.packets,
+                'sends': self.sends, 'saved': self.packets - self.sends,
+                'pending': len(self.__pending),
+                'delay_ms': self.delay * 1000 / max(self.packets, 1),
+                'max_delay_ms': self.max_delay * 1000}
+
+
+def message_key(headers):
+    """What makes a message the same one on every path it takes"""
+    return (headers.get('hfrom'), headers.get('hid'), headers.get('htype'))
+
+
 class RouterError(Exception):
     """Used to raise litterstore error"""
 
@@ -105,43 +590,80 @@ class RouterError(Exception):
 
 class LitterRouter:
 
-    def __init__(self, sock, intfs, uid):
+    def __init__(self, sock, intfs, uid, route_capacity=ROUTE_CAPACITY,
+        route_ttl=ROUTE_TTL, request_capacity=REQUEST_CAPACITY,
+        request_ttl=REQUEST_TTL, seen_ttl=SEEN_TTL, reassembler=None,
+        coalescer=None, reply_timeout=REPLY_TIMEOUT, limiter=None,
+        msocks=None):
         self.__sock = sock
         self.__intfs = intfs
+        self.__msocks = msocks
         self.__uid = uid
-        self.__addrs = []
-        self.__uid_to_addr = {}
-        self.__mid_to_addr = {}
+
+        # only kept to report what the receiving thread reassembles and
+        # what it drops
+        self.__reassembler = reassembler
+        self.__limiter = limiter
+
+        # batches packets to next hops that read them, None sends each
+        # packet right away
+        self.__coalescer = coalescer
+
+        # wire version each next hop said it reads, json when unknown
+        self.__wires = RouteTable(route_capacity, route_ttl)
+        self.wire_stats = WireStats()
+
+        # None picks next hops for any uniformly
+        self.peers = None
+        if reply_timeout != None:
+            self.peers = PeerScores(reply_timeout, request_capacity)
+
+        # None turns duplicate suppression back to request hids only
+        self.__seen = SeenCache(seen_ttl) if seen_ttl != None else None
+        self.__addrs = RouteTable(route_capacity, route_ttl)
+        self.__uid_to_addr = RouteTable(route_capacity, route_ttl)
+        self.__mid_to_addr = RouteTable(request_capacity, request_ttl)
 
     def __get_bcast_sender(self):
         logging.debug('GET BCAST')
-        return UDPSender(self.__sock, self.__intfs)
+        return UDPSender(self.__sock, self.__intfs, msocks=self.__msocks)
 
     def __get_rand_sender(self):
-        sender = None
-        length = len(self.__addrs)
+        if self.peers != None:
+            next_hop = self.peers.choose(self.__addrs.keys())
+        else:
+            next_hop = self.__addrs.choice()
 
-        if length < 1:
+        if next_hop == None:
             raise RouterError("empty routing table")
 
-        if length >= 1:
-            rand_idx = random.randint(0, length-1)
-            next_hop = self.__addrs[rand_idx]
-            sender = UDPSender(self.__sock, dest=next_hop)
+        sender = UDPSender(self.__sock, dest=next_hop)
 
         logging.debug('GET RND: %s' % (sender,))
         return sender
 
+    def __get_fan_senders(self, count, exclude=None):
+        """Up to count distinct next hops picked at random, other than the
+           one a message came from, the segment when none is known yet"""
+
+        addrs = [addr for addr in self.__addrs.keys() if addr != exclude]
+        if len(addrs) == 0:
+            return [self.__get_bcast_sender()]
+
+        return [UDPSender(self.__sock, dest=next_hop) for next_hop in
+            random.sample(addrs, min(count, len(addrs)))]
+
     def __get_sender(self, uid=None, mid=None):
         sender = None
 
-        if mid != None and mid in self.__mid_to_addr:
-            addr = self.__mid_to_addr[mid]
-            sender = UDPSender(self.__sock, dest=addr)
+        mid_addr = self.__mid_to_addr.get(mid) if mid != None else None
+        uid_addr = self.__uid_to_addr.get(uid) if uid != None else None
+
+        if mid_addr != None:
+            sender = UDPSender(self.__sock, dest=mid_addr)
             logging.debug('MID %s' % (sender,))
-        elif uid != None and uid in self.__uid_to_addr:
-            addr = self.__uid_to_addr[uid]
-            sender = UDPSender(self.__sock, dest=addr)
+        elif uid_addr != None:
+            sender = UDPSender(self.__sock, dest=uid_addr)
             logging.debug('UID %s' % (sender,))
         else:
             raise RouterError("uid or mid not found")
@@ -149,16 +671,17 @@ class LitterRouter:
         return sender
 
     def __add_route(self, headers, addr):
-        logging.debug('ADD ROUTE : %s : %s' % (headers, addr))
+        logging.debug('ADD ROUTE : %s : %s', headers, addr)
 
         if addr != None and not addr[0].startswith('127'):
-            self.__uid_to_addr[headers['hfrom']] = addr
+            self.__uid_to_addr.put(headers['hfrom'], addr)
 
             if headers['htype'] == 'req': 
-                self.__mid_to_addr[headers['hid']] = addr
+                self.__mid_to_addr.put(headers['hid'], addr)
 
-            if addr not in self.__addrs: 
-                self.__addrs.append(addr)
+            # the timers send from the multicast group, which is no peer
+            if addr[0] != MCAST_ADDR:
+                self.__addrs.put(addr, True)
 
             return True
 
@@ -177,15 +700,73 @@ class LitterRouter:
         if htype == 'req': result = result and hid not in self.__mid_to_addr
         return result
 
-    def send(self, data, sender=None, addr=None):
-        logging.debug('SEND : %s %s' % (sender, data))
+    def __learn_wire(self, headers, sender):
+        """Remembers the wire version of the previous hop. Nodes stamp hwire
+           with the httl they send, a stamp left by an older node that
+           forwarded the message no longer matches httl."""
+
+        hwire = headers.get('hwire', None)
+        if isinstance(hwire, list) and len(hwire) == 2 and \
+            hwire[1] == headers.get('httl') and sender.dest != None:
+            self.__wires.put(sender.dest, hwire[0])
+
+    def __wire(self, dest):
+        return self.__wires.get(dest, 0) if dest != None else 0
+
+    def __encode(self, data, dest):
+        """Binary for next hops that read it, compressed when they read that
+           too, json for the others and for multicast, which old nodes
+           receive too"""
+
+        wire = self.__wire(dest)
+
+        packet = None
+        if wire >= 1:
+            try:
+                packet = encode(data)
+            except WireError as err:
+                logging.warning("sending as json: %s", err)
+        if packet == None:
+            packet = encode_json(data)
+
+        if wire >= 2:
+            packet = compress(packet, self.wire_stats)
+        return packet
+
+    def hop_wire(self, sender):
+        """Wire version of the hop a message came through, None when it
+           comes from this node"""
+
+        if not isinstance(sender, UDPSender) or sender.dest == None:
+            return None
+        return self.__wire(sender.dest)
+
+    def decode(self, data):
+        """Message of a packet in any format a peer may send"""
+        return decode(data, self.wire_stats)
+
+    def send(self, data, sender=None, addr=None, urgent=False):
+        logging.debug('SEND : %s %s', sender, data)
 
         new_sender = sender
         headers = data.get('headers', None)
 
+        # copies of what we send or forward come back from the mesh
+        if self.__seen != None and isinstance(headers, dict):
+            self.__seen.add(message_key(headers))
+
         if headers != None and self.__should_send(headers):
 
-            if headers['hto'] == 'any' and headers['htype'] == 'req':
+            # pushes go to hfan peers and expect no reply
+            fanout = headers.get('hfan', None)
+
+            senders = None
+            if headers['hto'] == 'any' and headers['htype'] == 'req' and \
+                fanout != None:
+                senders = self.__get_fan_senders(fanout,
+                    sender.dest if isinstance(sender, Sender) else None)
+                new_sender = senders[0]
+            elif headers['hto'] == 'any' and headers['htype'] == 'req':
                 new_sender = self.__get_rand_sender()
             elif headers['hto'] == 'all' and headers['htype'] == 'req':
                 new_sender = self.__get_bcast_sender()
@@ -197,8 +778,15 @@ class LitterRouter:
             headers['httl'] -= 1
 
             if isinstance(new_sender, Sender) and headers['httl'] >= 0:
-                msg = json.dumps(data, ensure_ascii=False).encode("utf-8")
-                new_sender.send(msg)
+                headers['hwire'] = [WIRE_VERSION, headers['httl']]
+                for next_sender in senders or [new_sender]:
+                    self.__transmit(next_sender, data, urgent)
+
+                # the reply tells how good a choice the next hop was
+                if self.peers != None and headers['hto'] == 'any' and \
+                    headers['htype'] == 'req' and fanout == None:
+                    self.peers.sent((headers['hfrom'], headers['hid']),
+                        new_sender.dest)
 
         # always update route even if we dont foward packet
         if isinstance(sender, Sender) and headers != None:
@@ -206,15 +794,59 @@ class LitterRouter:
 
         return new_sender
 
+    def __transmit(self, sender, data, urgent):
+        dest = sender.dest
+        packet = self.__encode(data, dest)
+        if self.__coalescer != None and self.__wire(dest) >= 4:
+            self.__coalescer.add(sender, packet, urgent)
+        else:
+            sender.send(packet, mtu=MTU if self.__wire(dest) >= 3 else None)
+
+    def flush(self, force=False):
+        """Sends the batches that are due, seconds until the next one is"""
+
+        if self.__coalescer == None:
+            return None
+        return self.__coalescer.flush(force)
+
+    def stats(self):
+        """Sizes and eviction counters of the routing tables"""
+        return {'addrs': self.__addrs.stats(),
+                'uids': self.__uid_to_addr.stats(),
+                'requests': self.__mid_to_addr.stats(),
+                'wires': self.__wires.stats(),
+                'compression': self.wire_stats.stats(),
+                'fragments': self.__reassembler.stats()
+                    if self.__reassembler != None else None,
+                'coalesce': self.__coalescer.stats()
+                    if self.__coalescer != None else None,
+                'peers': self.peers.stats() if self.peers != None else None,
+                'ingress': self.__limiter.stats()
+                    if self.__limiter != None else None,
+                'seen': self.__seen.stats() if self.__seen != None else None}
+
     def should_process(self, data, sender=None):
-        logging.debug('SPROCESS : %s %s' % (sender, data))
+        logging.debug('SPROCESS : %s %s', sender, data)
 
         headers = data.get('headers', None)
         if isinstance(sender, Sender) and sender.dest[0] in self.__intfs: 
             return False
+
+        if isinstance(sender, Sender) and isinstance(headers, dict):
+            self.__learn_wire(headers, sender)
+
+        if isinstance(headers, dict) and headers.get('htype') == 'rep' and \
+            self.peers != None:
+            self.peers.replied((headers.get('hto'), headers.get('hid')))
+
+        if isinstance(headers, dict) and self.__seen != None:
+            # first, before forwarding and before the store sees it
+            if self.__seen.seen(message_key(headers)):
+                return False
         elif isinstance(headers, dict) and headers['htype'] == 'req' and \
             headers['hid'] in self.__mid_to_addr: return False
-        elif headers != None:
+
+        if headers != None:
             try:
                 self.send(data, sender)
                 #restore ttl since send decrements it
@@ -0,0 +1,71 @@
+#!/usr/bin/env python
+
+import re
+import logging
+import threading
+
+# upper bounds of the latency histogram buckets in ms, the last is open
+BUCKETS = (0.1, 0.25, 0.5, 1, 2.5, 5, 10, 25, 50, 100, 250, 500, 1000)
+
+# IN lists and numbers built into statements, folded so they count as one
+PLACEHOLDERS = re.compile(r"\?(, \?)+")
+NUMBERS = re.compile(r"\b\d+\b")
+
+
+def normalize(action):
+    """Statement text with whitespace, IN lists and numbers folded"""
+    action = " ".join(action.split())
+    return NUMBERS.sub("N", PLACEHOLDERS.sub("?, ...", action))
+
+
+class QueryStats:
+    """Calls, rows and a latency histogram per normalized statement, shared
+       by the worker store and the read pool. Statements slower than slow
+       seconds are logged."""
+
+    def __init__(self, slow=None):
+        self.slow = slow
+        self.__lock = threading.Lock()
+        self.__names = {}
+        self.__stats = {}
+
+    def record(self, action, elapsed, rows, params=None):
+        if self.slow != None and elapsed >= self.slow:
+            logging.warning("slow query %.1f ms, %d rows -- %s %s",
+                elapsed * 1000, rows, action, params)
+
+        ms = elapsed * 1000
+        bucket = 0
+        while bucket < len(BUCKETS) and ms > BUCKETS[bucket]:
+            bucket += 1
+
+        with self.__lock:
+            name = self.__names.get(action, None)
+            if name == None:
+                name = self.__names[action] = normalize(action)
+
+            stat = self.__stats.get(name, None)
+            if stat == None:
+                stat = self.__stats[name] = {'calls': 0, 'rows': 0,
+                    'total': 0.0, 'max': 0.0,
+                    'histogram': [0] * (len(BUCKETS) + 1)}
+
+            stat['calls'] += 1
+            stat['rows'] += rows
+            stat['total'] += ms
+            stat['max'] = max(stat['max'], ms)
+            stat['histogram'][bucket] += 1
+
+    def report(self):
+        """Statements by total time spent, times in ms"""
+
+        with self.__lock:
+            results = [dict(stat, sql=name, histogram=list(stat['histogram']))
+                for name, stat in self.__stats.iteritems()]
+
+        results.sort(key=lambda stat: stat['total'], reverse=True)
+        return {'buckets': BUCKETS, 'slow': self.slow, 'queries': results}
+
+    def clear(self):
+        with self.__lock:
+            self.__stats = {}
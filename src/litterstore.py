@@ -1,83 +1,116 @@
 #!/usr/bin/env python
 
-import sqlite3 
 import time
 import sys
 import random
 import socket
 import logging
 import cgi
+import threading
+import Queue
+import json
+import base64
+import itertools
 from jsoncert import JsonCert
+from littercache import TimelineCache
+from litterfilter import BloomFilter, FILTER_CAPACITY
+from littersync import DigestTree, answer, compare, clip, drop_keys, \
+    key_runs, run_keys
+from litterengine import *
 
 #logging.basicConfig(level=logging.DEBUG)
 
-class StoreError(Exception):
-    """Used to raise litterstore error"""
+# most posts sent back for a single pull or gap request, replies larger
+# than a datagram are fragmented for peers that reassemble
+PULL_LIMIT = 200
 
-    def __init__(self, msg):
-        self.msg = msg
+# what requests without a limit get, older nodes receive into 4096 bytes
+OLD_PULL_LIMIT = 20
 
-    def __str__(self):
-        return str(self.msg)
+# peers a new post is pushed to right away, and how many times the nodes
+# that did not have it yet push it on
+PUSH_FANOUT = 3
+PUSH_HOPS = 6
 
+# request ids are integers, short on the wire, older nodes send floats
+HID_BITS = 48
 
-class LitterStore:
-    """Handles storage and processes requests"""
-
-    def __init__(self, uid=None, test=False):
-        self.__uid = uid if uid != None else socket.gethostname()
-        self.__con = sqlite3.connect(":memory:" if test else self.__uid + ".db")
-        self.__nextid = 1
-        self.__init_db()
-
-    def __db_call(self, action, params=None):
-        logging.debug("dbcall -- %s %s" % (action, params))
-
-        try:
-            cur = self.__con.cursor()
-
-            if params != None:
-                cur.execute(action, params) 
-            else:
-                cur.execute(action)
-
-            result = cur.fetchall()
-            self.__con.commit()
-            cur.close()
+# methods a read-only store can answer without the worker thread
+READ_METHODS = ('get', 'search', 'stats', 'queries')
 
-        except sqlite3.IntegrityError as ie:
-            raise StoreError(str(ie))
+def make_cursor(post):
+    """Opaque cursor for the page after a post"""
+    return base64.urlsafe_b64encode(json.dumps([post[2], post[6]]))
 
-        return result
-
-    def __init_db(self):
-        self.__db_call("CREATE TABLE IF NOT EXISTS posts "
-            "(uid TEXT, postid INTEGER, msg TEXT, txtime NUM, "
-            "rxtime NUM, perms NUM, sig TEXT, PRIMARY KEY(sig ASC))")
-
-        self.__db_call("CREATE TABLE IF NOT EXISTS friends "
-            "(uid TEXT, fid TEXT, txtime NUM, PRIMARY KEY(uid, fid))")
+def parse_cursor(cursor):
+    """Returns the (txtime, sig) a cursor continues from"""
 
-        cid = self.__db_call("SELECT MAX(postid) FROM posts WHERE uid == ?",
-            (self.__uid, ))
+    try:
+        txtime, sig = json.loads(base64.urlsafe_b64decode(str(cursor)))
+    except (TypeError, ValueError):
+        raise StoreError("invalid cursor: " + str(cursor))
 
-        if cid[0][0] != None: 
-            self.__nextid = cid[0][0] + 1
+    return txtime, sig
 
-    def __update_time(self, uid, fid, txtime=0):
-        msg = "SELECT txtime FROM friends WHERE uid == ? and fid == ?"
-        results = self.__db_call(msg,(uid, fid))
 
-        if len(results) < 1:
-            msg = "INSERT INTO friends (uid, fid, txtime) VALUES (?, ?, ?)"
-            self.__db_call(msg, (uid, fid, txtime))
-
-        elif results[0][0] != None and results[0][0] < txtime:
-            msg = "UPDATE friends SET txtime = ? WHERE uid == ? and fid == ?"
-            self.__db_call(msg, (txtime, uid, fid))
+class LitterStore:
+    """Handles storage and processes requests"""
 
-    def __post(self, msg, uid=None, txtime=None, rxtime=None, postid=-1, 
-        perms=None, sig=None):
+    def __init__(self, uid=None, test=False, readonly=False, cache=None,
+        pull_limit=PULL_LIMIT, max_age=None, max_posts=None, max_bytes=None,
+        engine='sqlite', filter_capacity=FILTER_CAPACITY, stats=None,
+        shards=SHARDS, bloom=None):
+        self.__uid = uid if uid != None else socket.gethostname()
+        self.__readonly = readonly
+        self.__nextid = 1
+        self.__pull_limit = pull_limit
+
+        # retention of other authors' posts, in seconds, posts per author
+        # and database bytes, None keeps everything
+        self.__max_age = max_age
+        self.__max_posts = max_posts
+        self.__max_bytes = max_bytes
+
+        # readers only get a cache when it is shared with the writer
+        if cache == None and not readonly:
+            cache = TimelineCache()
+        self.__cache = cache
+
+        if engine not in ENGINES:
+            raise StoreError("unknown storage engine: " + str(engine))
+
+        # per statement instrumentation, shared like the cache, None is off
+        self.__stats = stats
+        options = {'readonly': readonly, 'stats': stats}
+        if engine == 'sharded':
+            options['shards'] = shards
+        self.__engine = ENGINES[engine](None if test else self.__uid,
+            **options)
+
+        # digests of the received postids for sync, built when first asked
+        # for, the keys of posts that came in since are added on the next
+        self.__digests = None
+        self.__new_keys = []
+
+        cid = self.__engine.max_postid(self.__uid)
+        if cid != None:
+            self.__nextid = cid + 1
+
+        # sigs already stored, most gossip is posts we have, None disables.
+        # Readers only get one when it is shared with the writer, which
+        # alone fills and saves it.
+        if bloom == None and filter_capacity != None and not readonly:
+            bloom = BloomFilter(None if test else self.__uid + ".filter",
+                filter_capacity)
+        self.__filter = bloom
+        if bloom != None and not readonly and not bloom.load():
+            for sig in self.__engine.sigs():
+                bloom.add(sig)
+            bloom.save()
+
+    def __make_post(self, msg, uid=None, txtime=None, rxtime=None,
+        postid=-1, perms=None, sig=None):
+        """Validates a post and returns it as a posts row"""
 
         rxtime = time.time()
 
@@ -85,6 +118,9 @@ class LitterStore:
         if perms == None:
             perms = 1
 
+        if len(msg) > 140:
+            raise StoreError("message too long")
+
         if uid == None:
             uid = self.__uid
             txtime = rxtime
@@ -93,120 +129,265 @@ class LitterStore:
             sig = JsonCert.cal_hash('%s%s%s%s%s' % 
                                      (msg, uid, txtime, postid, perms))
 
-        post = (uid, postid, txtime, rxtime, msg, perms, sig)
+        post = (uid, postid, txtime, rxtime, msg, perms, sig,
+            cgi.escape(msg), cgi.escape(uid))
 
-        logging.debug('POST : %s %s %s %s %s %s %s' % post)
-
-        if len(msg) > 140:
-            raise StoreError("message too long")
+        logging.debug('POST : %s %s %s %s %s %s %s %s %s', *post)
 
         if postid == -1:
             raise StoreError("Invalid postid: " + str(postid))
 
-        self.__db_call("INSERT INTO posts (uid, postid, txtime, "
-            "rxtime, msg, perms, sig) VALUES (?, ?, ?, ?, ?, ?, ?)", post)
-
-        self.__update_time(self.__uid, uid, txtime)
-
         return post
 
-    def __get(self, uid=None, perms=None, begin=0, until=sys.maxint, limit=10):
-
-        msg = None
-        pref = "SELECT msg, uid, txtime, rxtime, postid, perms, sig \
-                FROM posts WHERE "
+    def __post(self, posts):
+        """Stores a batch of posts in a single engine write, duplicates are
+           skipped, returns (new rows, duplicates)"""
+
+        rows = []
+        for post in posts:
+            try:
+                if isinstance(post, dict):
+                    rows.append(self.__make_post(**post))
+                elif isinstance(post, (list, tuple)):
+                    rows.append(self.__make_post(*post))
+
+            except StoreError as err:
+                logging.exception(err)
+
+        if len(rows) == 0:
+            return [], 0
+
+        total = len(rows)
+        fresh = []
+        rows = self.__drop_known(rows)
+        if len(rows) > 0:
+            fresh = self.__engine.insert(self.__uid, rows)
+        if self.__digests != None:
+            self.__new_keys.extend((row[0], row[1]) for row in fresh
+                if row[5] == 1)
+
+        if self.__filter != None:
+            for row in fresh:
+                self.__filter.add(row[6])
+
+        if self.__cache != None:
+            self.__cache.add([(uid, (emsg, euid, txtime, rxtime, postid,
+                perms, sig)) for uid, postid, txtime, rxtime, msg, perms,
+                sig, emsg, euid in fresh])
+
+        return fresh, total - len(fresh)
+
+    def __drop_known(self, rows):
+        """Drops the posts the filter and the engine agree are stored, so
+           replayed gossip is not written again and a batch of only those
+           costs one read instead of a write transaction. Watermarks
+           already moved past these posts when they came in."""
+
+        if self.__filter == None:
+            return rows
+
+        # a miss is new for sure, hits are confirmed in one lookup since
+        # they can be false positives
+        bloom = self.__filter
+        bloom.checked += len(rows)
+        hits = set(row[6] for row in rows if row[6] in bloom)
+        if len(hits) == 0:
+            return rows
+
+        known = self.__engine.known(list(hits))
+        bloom.false_positives += len(hits - known)
+        if len(known) == 0:
+            return rows
+
+        fresh = [row for row in rows if row[6] not in known]
+        bloom.skipped += len(rows) - len(fresh)
+        return fresh
+
+    def __get(self, uid=None, perms=None, begin=0, until=sys.maxint, limit=10,
+        display=False, sig=None):
+        """Newest posts first, display selects the escaped form for the
+           browser instead of the raw one sent to peers, sig continues
+           from a cursor at until"""
+
+        if limit <= 0:
+            return []
+
+        key = None
 
         if uid == None or uid == self.__uid:
-            msg = pref + ("txtime > ? and txtime < ? ORDER BY "
-                "txtime DESC LIMIT ?"), (begin, until, limit)
+            uid = None
         else:
-            msg = pref + ("uid == ? and perms == ? and txtime > ? and "
-                "txtime < ? ORDER BY txtime DESC LIMIT ?"), \
-                (uid, perms, begin, until, limit)
-
-        data = self.__db_call(msg[0], msg[1])
-        for i in range(len(data)):
-            d = list(data[i])
-            d[0] = cgi.escape(d[0])
-            d[1] = cgi.escape(d[1])
-            data[i] = tuple(d)
-        return data
-
-    def __pull(self, uid, friends=None):
+            key = (uid, perms)
+
+        # the newest posts of a timeline come from the cache when possible
+        cache = self.__cache
+        size = 0
+        if cache != None and display and begin == 0 and until == sys.maxint:
+            size = cache.size if key == None else cache.uid_size
+
+        if limit <= size:
+            rows = cache.get(key, limit)
+            if rows != None:
+                return rows
+            generation = cache.generation
+
+        data = self.__engine.scan(uid, perms, begin, until, max(limit, size),
+            display, sig)
+
+        if limit <= size:
+            cache.fill(key, data, generation)
+
+        return data[:limit]
+
+    def __limit(self, query, wire=None):
+        """Posts a pull or gap reply may carry for the node asking, and for
+           the hop it came through when that one does not reassemble
+           fragments, since the reply goes back the same way"""
+
+        limit = min(query.get('limit', OLD_PULL_LIMIT), self.__pull_limit)
+        if wire != None and wire < 3:
+            limit = min(limit, OLD_PULL_LIMIT)
+        return limit
+
+    def __pull(self, uid, friends=None, limit=OLD_PULL_LIMIT):
         results = []
-        self.__update_time(self.__uid, uid, 0)
+        self.__engine.upsert_watermarks(self.__uid, [(uid, 0)])
 
         if friends != None and len(friends) == 0:
             # if friends is empty, this is a new node, so reply your posts
-            results = self.__get(uid=self.__uid, perms=1)
+            results = self.__get(uid=self.__uid, perms=1, limit=limit)
         elif friends != None:
-            for fid, txtime in friends:
-                self.__update_time(uid, fid, txtime)
-                results.extend(self.__get(uid=fid, perms=1, begin=txtime))
+            results = self.__engine.pull(uid, friends, limit)
 
         return results
 
-    # Code adapted from Ben Englard implemetation
-    def __find_gaps_by_uid(self, uid):
-        msg = ("SELECT postid, txtime FROM posts WHERE uid == ? " 
-               "ORDER BY txtime DESC")
-        results = self.__db_call(msg, (uid,))
-        gaps = []
-        last_item = None
+    def __gap(self, uid, friends=None, limit=OLD_PULL_LIMIT):
+        results = []
+        self.__engine.upsert_watermarks(self.__uid, [(uid, 0)])
 
-        for postid, txtime in results:
-            if last_item == None:
-                last_item = (postid, txtime)
-                continue
+        for fid, gaps in friends.iteritems():
+            for start, end in gaps:
+                self.__engine.upsert_watermarks(uid, [(fid, end)])
+                if len(results) >= limit:
+                    continue
+                posts = self.__get(uid=fid, perms=1, begin=start, until=end,
+                    limit=limit - len(results))
+                results.extend(posts)
 
-            diff = last_item[0] - postid
+        return results
 
-            if diff > 1:
-                gaps.append((txtime, last_item[1]))
+    def __gen_push(self, fresh):
+        """Public posts to push, the new ones or our newest when there are
+           none"""
 
-            last_item = (postid, txtime)
+        if fresh == None:
+            return self.__engine.scan(self.__uid, 1, limit=1)
 
-        # last item should be 1, if not we have a gap
-        if last_item != None and last_item[0] != 1:
-            gaps.append((0, last_item[1]))
+        return [[msg, uid, txtime, rxtime, postid, perms, sig] for uid,
+            postid, txtime, rxtime, msg, perms, sig, emsg, euid in fresh
+            if perms == 1]
 
-        return gaps
+    def __gen_pull(self):
+        request = { 'm' : 'pull', 'uid': self.__uid,
+            'limit': self.__pull_limit}
+        request['friends'] = []
+        request['friends'].extend(self.__engine.watermarks(self.__uid))
+        return request
+
+    def __tree(self):
+        """Digests of the postids of the public posts, the only ones a peer
+           can get from us"""
+
+        if self.__digests == None:
+            ranges = ((uid, first, last) for uid, first, last, ftxtime,
+                ltxtime in self.__engine.gap_ranges(self.__uid))
+            self.__digests = DigestTree(drop_keys(ranges,
+                self.__engine.private_keys()))
+        elif len(self.__new_keys) > 0:
+            self.__digests.add(self.__new_keys)
+        self.__new_keys = []
+        return self.__digests
+
+    def __gen_sync(self):
+        """First round of a sync, the digest of every postid we received"""
+        return {'m': 'sync', 'uid': self.__uid, 'limit': self.__pull_limit,
+            'ranges': [self.__tree().summary()]}
+
+    def __sync(self, query, wire=None):
+        """Posts the peer asked for or lacks, and our digests of the parts
+           of its ranges that differ"""
+
+        tree = self.__tree()
+        limit = self.__limit(query, wire)
+        want = itertools.islice(run_keys(query.get('want', [])), limit)
+        missing, ranges = answer(tree, query.get('ranges', []), limit)
+        keys, ranges = clip(tree, list(want) + missing, ranges, limit)
+
+        posts = []
+        for uid, group in itertools.groupby(keys, lambda key: key[0]):
+            posts.extend(self.__engine.fetch(uid, [key[1] for key in group]))
+
+        return posts, {'ranges': ranges}
+
+    def __sync_next(self, sync):
+        """Next round of a sync after a reply, None once nothing differs"""
+
+        tree = self.__tree()
+        want, ranges = compare(tree, sync.get('ranges', []),
+            self.__pull_limit)
+        if len(want) == 0 and len(ranges) == 0:
+            return None
+
+        want, ranges = clip(tree, want, ranges, self.__pull_limit)
+        return {'m': 'sync', 'uid': self.__uid, 'limit': self.__pull_limit,
+            'ranges': ranges, 'want': key_runs(want)}
 
     def __find_all_gaps(self):
-        msg = "SELECT DISTINCT fid FROM friends WHERE uid ==?"
-        fids = self.__db_call(msg, (self.__uid,))
+        """Reads the missing (start, end) txtimes of every friend from the
+           ranges between received postids"""
+
         results = {}
+        last = {}
 
-        for fid, in fids:
-            gaps = self.__find_gaps_by_uid(fid)
+        # nothing older than what retention would purge again is requested
+        horizons = self.__engine.horizons()
+        floor = 0
+        if self.__max_age != None:
+            floor = time.time() - self.__max_age
 
-            # only add if gaps are found
-            if len(gaps) > 0:
-                results[fid] = self.__find_gaps_by_uid(fid)
+        for uid, first, _, ftxtime, ltxtime in self.__engine.gap_ranges(
+            self.__uid):
 
-        return results
+            gap = None
+            results.setdefault(uid, [])
 
-    def __gap(self, uid, friends=None):
-        results = []
-        self.__update_time(self.__uid, uid, 0)
+            if uid in last:
+                gap = (last[uid], ftxtime)
+            elif first != 1:
+                # first post should be 1, if not we have a gap
+                gap = (0, ftxtime)
 
-        for fid, gaps in friends.iteritems():
-            for start, end in gaps:
-                self.__update_time(uid, fid, end)
-                posts = self.__get(uid=fid, begin=start, until=end)
-                results.extend(posts)
+            horizon = max(floor, horizons.get(uid, 0))
+            if gap != None and gap[1] > horizon:
+                results[uid].append((max(gap[0], horizon), gap[1]))
 
-        return results
+            last[uid] = ltxtime
 
-    def __gen_push(self):
-        pass
+        # only keep friends with gaps
+        return dict((uid, gaps) for uid, gaps in results.iteritems() if gaps)
 
-    def __gen_pull(self):
-        request = { 'm' : 'pull', 'uid': self.__uid}
-        msg = "SELECT fid, txtime FROM friends WHERE uid == ?"
-        request['friends'] = []
-        request['friends'].extend(self.__db_call(msg, (self.__uid,)))
-        return request
+    def __compact(self):
+        """Archives posts past retention and gives back free space, returns
+           (archived posts, freed bytes). Our own posts are never archived,
+           peers pull them from us."""
+
+        archived, freed = self.__engine.compact(self.__uid, self.__max_age,
+            self.__max_posts, self.__max_bytes)
+
+        if archived > 0 and self.__cache != None:
+            self.__cache.clear()
+
+        return archived, freed
 
     def __gen_gap(self):
         request = []
@@ -214,24 +395,34 @@ class LitterStore:
 
         # only return dictionary if gaps are found
         if len(gap_list) > 0:
-            request = {'m': 'gap', 'friends': gap_list}
+            request = {'m': 'gap', 'uid': self.__uid, 'friends': gap_list,
+                'limit': self.__pull_limit}
 
         return request
 
     def __get_headers(self, request, meth=None):
 
-        logging.debug('GETHEADERS : %s %s' % (request,meth))
+        logging.debug('GETHEADERS : %s %s', request, meth)
 
         headers = None
 
-        if meth == 'gen_push' or meth == 'gen_pull' or meth == 'gen_gap':
+        if meth == 'gen_push':
+            headers = {}
+            headers['hto'] = 'any'
+            headers['hfrom'] = self.__uid
+            headers['hid'] = random.getrandbits(HID_BITS)
+            headers['htype'] = 'req'
+            headers['httl'] = 1
+            headers['hfan'] = PUSH_FANOUT
+        elif meth == 'gen_pull' or meth == 'gen_gap':
             headers = {}
             headers['hto'] = request.get('hto','all')
             headers['hfrom'] = self.__uid
-            headers['hid'] = random.random()
+            headers['hid'] = random.getrandbits(HID_BITS)
             headers['htype'] = 'req'
             headers['httl'] = request.get('httl', 2)
-        elif meth == 'push' or meth == 'pull' or meth == 'gap':
+        elif meth == 'push' or meth == 'pull' or meth == 'gap' or \
+            meth == 'sync':
             headers = {}
             headers['hto'] = request.get('hfrom', 'any')
             headers['hfrom'] = self.__uid
@@ -242,59 +433,201 @@ class LitterStore:
             headers = {}
             headers['hto'] = request.get('hto','any')
             headers['hfrom'] = self.__uid
-            headers['hid'] = random.random()
+            headers['hid'] = random.getrandbits(HID_BITS)
             headers['htype'] = 'req'
             headers['httl'] = request.get('httl', 5) #should be higher
-
+        elif meth == 'gen_sync' or meth == 'sync_next':
+            # a sync starts with one neighbour, later rounds go back to
+            # the peer that answered, every round with its own hid
+            headers = {}
+            headers['hto'] = 'any'
+            headers['httl'] = 1
+            if meth == 'sync_next':
+                headers['hto'] = request.get('hfrom')
+                headers['httl'] = 2
+            headers['hfrom'] = self.__uid
+            headers['hid'] = random.getrandbits(HID_BITS)
+            headers['htype'] = 'req'
 
         return headers
 
-    def process(self, request):
+    def process(self, request, wire=None):
+        """Answers a request, wire is the version the hop it came through
+           reads, None when it comes from this node"""
 
-        logging.debug('PROCESS : %s' % (request,))
+        logging.debug('PROCESS : %s', request)
 
         result = {}
         meth = request.get('m', None)
         headers = request.get('headers', {})
 
+        fresh = None
         if 'posts' in request:
-            for post in request['posts']:
-                try:
-                    if isinstance(post, dict):
-                        #self.post__(msg=post['msg'],perms=post['perms'])
-                        self.__post(**post)
-                    elif isinstance(post, list):
-                        self.__post(*post)
-
-                except StoreError as err:
-                    if str(err) != "column sig is not unique":
-                        logging.exception(err)
+            fresh, dup = self.__post(request['posts'])
+            result['ingest'] = {'new': len(fresh), 'dup': dup}
 
         if 'query' in request:
             meth = request['query']['m']
 
+        # pushed posts go on from the nodes that did not have them, for
+        # the others a sig they already stored ends the gossip
+        hops = PUSH_HOPS
+        if 'push' in request and headers.get('htype') == 'req':
+            hops = request['push'] - 1
+            if hops > 0 and fresh != None and len(fresh) > 0:
+                meth = 'gen_push'
+
+        if 'sync' in request and headers.get('htype') == 'rep':
+            result['query'] = self.__sync_next(request['sync'])
+            if result['query'] != None:
+                meth = 'sync_next'
+            else:
+                del result['query']
+
         if meth == 'get':
             limit = request['limit']
-            result['posts'] = self.__get(limit=limit)
+            until, sig = request.get('until', sys.maxint), None
+            if request.get('cursor', None) != None:
+                until, sig = parse_cursor(request['cursor'])
+
+            result['posts'] = self.__get(begin=request.get('begin', 0),
+                until=until, limit=limit, display=True, sig=sig)
+
+            # a short page is the last one
+            result['cursor'] = None
+            if len(result['posts']) == limit and limit > 0:
+                result['cursor'] = make_cursor(result['posts'][-1])
+        elif meth == 'search':
+            result['posts'] = self.__engine.search(request['text'],
+                request.get('uid', None), request.get('begin', 0),
+                request.get('until', sys.maxint), request.get('limit', 10),
+                request.get('order', 'rank'))
+        elif meth == 'archive':
+            result['posts'] = self.__engine.archive_scan(request.get('uid', None),
+                request.get('begin', 0), request.get('until', sys.maxint),
+                request.get('limit', 10))
+        elif meth == 'compact':
+            archived, freed = self.__compact()
+            result['compact'] = {'archived': archived, 'freed': freed}
+        elif meth == 'stats':
+            result['cache'] = None
+            if self.__cache != None:
+                result['cache'] = self.__cache.stats()
+            result['filter'] = None
+            if self.__filter != None:
+                result['filter'] = self.__filter.stats()
+        elif meth == 'queries':
+            result['queries'] = None
+            if self.__stats != None:
+                result['queries'] = self.__stats.report()
         elif meth == 'gen_push' or meth == 'gen_rand_push':
-            result['posts'] = self.__get(self.__uid, limit=1)
+            result['posts'] = self.__gen_push(fresh)
+            if meth == 'gen_push':
+                result['push'] = hops
+            # private posts stay here
+            if len(result['posts']) == 0:
+                meth = None
         elif meth == 'gen_pull' or meth == 'gen_rand_pull':
             result['query'] = self.__gen_pull()
         elif meth == 'pull':
             uid = request['query']['uid']
             friends = request['query']['friends']
-            result['posts'] = self.__pull(uid, friends)
+            result['posts'] = self.__pull(uid, friends,
+                self.__limit(request['query'], wire))
+        elif meth == 'gen_sync':
+            result['query'] = self.__gen_sync()
+        elif meth == 'sync':
+            result['posts'], result['sync'] = self.__sync(request['query'],
+                wire)
         elif meth == 'gen_gap':
             result['query'] = self.__gen_gap()
         elif meth == 'gap':
             uid = request['query']['uid']
             friends = request['query']['friends']
-            result['posts'] = self.__gap(uid, friends)
+            result['posts'] = self.__gap(uid, friends,
+                self.__limit(request['query'], wire))
 
         result['headers'] = self.__get_headers(headers, meth)
         return result
 
+    def explain(self, action, params=()):
+        """Returns the detail column of EXPLAIN QUERY PLAN for a statement"""
+        return self.__engine.explain(action, params)
+
     def close(self):
-        self.__con.close()
+        if self.__filter != None and not self.__readonly:
+            self.__filter.save()
+        self.__engine.close()
+
+
+class StorePool:
+    """Pool of read-only stores over the same WAL database, used to answer
+       READ_METHODS off the worker thread"""
+
+    def __init__(self, uid=None, size=4, cache=None, stats=None,
+        bloom=None):
+        self.__uid = uid if uid != None else socket.gethostname()
+        self.__size = size
+        self.__cache = cache
+        self.__bloom = bloom
+        self.__stats = stats
+        self.__opened = 0
+        self.__closed = False
+        self.__lock = threading.Lock()
+        self.__stores = Queue.Queue(size)
+
+    def __checkout(self, timeout):
+        try:
+            return self.__stores.get_nowait()
+        except Queue.Empty:
+            pass
+
+        # connections are opened lazily so the worker creates the db first
+        with self.__lock:
+            if self.__closed:
+                raise StoreError("store pool is closed")
+            if self.__opened < self.__size:
+                self.__opened += 1
+                return LitterStore(self.__uid, readonly=True,
+                    cache=self.__cache, stats=self.__stats,
+                    bloom=self.__bloom)
+
+        return self.__stores.get(timeout=timeout)
+
+    def process(self, request, timeout=2):
+        """Same as LitterStore.process but only for READ_METHODS"""
+
+        if request.get('m', None) not in READ_METHODS or 'posts' in request:
+            raise StoreError("not a read request")
+
+        store = self.__checkout(timeout)
+        try:
+            return store.process(request)
+        finally:
+            self.__checkin(store)
+
+    def __checkin(self, store):
+        with self.__lock:
+            if not self.__closed:
+                self.__stores.put(store)
+                return
+            self.__opened -= 1
+
+        # the pool was closed while the store was in use
+        store.close()
+
+    def close(self):
+        """Closes the idle stores, those in use are closed when they come
+           back so a slow read does not hold up the shutdown"""
+
+        with self.__lock:
+            self.__closed = True
+            while True:
+                try:
+                    store = self.__stores.get_nowait()
+                except Queue.Empty:
+                    break
+                store.close()
+                self.__opened -= 1
 
 
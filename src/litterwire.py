@@ -0,0 +1,455 @@
+#!/usr/bin/env python
+
+import re
+import json
+import time
+import zlib
+import random
+import struct
+import threading
+import collections
+
+# what this node reads, sent in the hwire header: 1 is the binary format,
+# 2 adds compressed packets, 3 fragments, 4 batches
+WIRE_VERSION = 4
+
+# layout of binary packets, written after MAGIC
+BINARY_FORMAT = 1
+
+# first byte of a binary packet, a compressed one, a fragment and a batch,
+# json text always starts with '{'
+MAGIC = "\xb1"
+ZMAGIC = "\xb2"
+FMAGIC = "\xb3"
+BMAGIC = "\xb4"
+
+# packets at least this big are compressed, smaller ones barely shrink
+COMPRESS_THRESHOLD = 1024
+COMPRESS_LEVEL = 6
+
+# most bytes a compressed packet may inflate to
+MAX_INFLATE = 1024 * 1024
+
+# values are a tag byte followed by their data
+NONE, TRUE, FALSE, INT, NEG, FLOAT, STR, REF, WORD, SIG, LIST, DICT = \
+    [chr(i) for i in range(12)]
+
+# hex sha1 digests travel as their 20 raw bytes
+HEX_SIG = re.compile(r"\A[0-9a-f]{40}\Z")
+
+# protocol words in almost every packet, sent as their index
+WORDS = (u"headers", u"hto", u"hfrom", u"hid", u"htype", u"httl", u"hwire",
+    u"posts", u"query", u"m", u"uid", u"friends", u"req", u"rep", u"all",
+    u"any", u"push", u"pull", u"gap", u"ingest", u"new", u"dup")
+WORD_INDEX = dict((word, i) for i, word in enumerate(WORDS))
+
+DOUBLE = struct.Struct(">d")
+
+# largest datagram sent to peers that reassemble, under the ethernet mtu so
+# ip never fragments it and a lost piece costs one datagram
+MTU = 1400
+
+# FMAGIC, message id, fragment index and count
+FRAGMENT = struct.Struct(">cQHH")
+
+# a message reassembles to at most MAX_INFLATE bytes
+MAX_FRAGMENTS = MAX_INFLATE / (MTU - FRAGMENT.size) + 1
+
+# a message missing fragments this long is dropped, the next pull or gap
+# asks for its posts again
+REASSEMBLY_TIMEOUT = 5
+
+# fragments kept for messages being reassembled, the oldest go first
+MAX_PENDING = 4 * 1024 * 1024
+
+# bytes a batch adds per packet, the varint length of anything under MTU
+BATCH_OVERHEAD = 2
+
+
+class WireError(Exception):
+    """Used to raise wire format errors"""
+
+    def __init__(self, msg):
+        self.msg = msg
+
+    def __str__(self):
+        return str(self.msg)
+
+
+class WireStats:
+    """Bytes in and out of compression and the time it took, both ways"""
+
+    def __init__(self):
+        self.compressed = 0
+        self.raw_bytes = 0
+        self.packed_bytes = 0
+        self.compress_time = 0.0
+        self.inflated = 0
+        self.received_bytes = 0
+        self.inflated_bytes = 0
+        self.inflate_time = 0.0
+
+    def stats(self):
+        """Ratios are compressed over raw bytes, times in ms"""
+        return {'compressed': self.compressed,
+                'compress_ratio': float(self.packed_bytes) /
+                    max(self.raw_bytes, 1),
+                'compress_ms': self.compress_time * 1000,
+                'inflated': self.inflated,
+                'inflate_ratio': float(self.received_bytes) /
+                    max(self.inflated_bytes, 1),
+                'inflate_ms': self.inflate_time * 1000}
+
+
+class Reassembler:
+    """Collects fragments per (address, message id) until every one came
+       in. Incomplete messages expire after timeout seconds and the oldest
+       ones are dropped when more than max_pending bytes are held."""
+
+    def __init__(self, timeout=REASSEMBLY_TIMEOUT, max_pending=MAX_PENDING):
+        self.timeout = timeout
+        self.max_pending = max_pending
+        self.clock = time.time
+        self.completed = 0
+        self.expired = 0
+        self.evicted = 0
+        self.invalid = 0
+
+        # (addr, id) -> (first arrival, count, {index: payload}), oldest
+        # first
+        self.__lock = threading.Lock()
+        self.__messages = collections.OrderedDict()
+        self.__pending = 0
+
+    def __drop(self, key):
+        parts = self.__messages.pop(key)[2]
+        self.__pending -= sum(len(part) for part in parts.itervalues())
+
+    def __expire(self, now):
+        messages = self.__messages
+        while len(messages) > 0:
+            key = next(iter(messages))
+            if messages[key][0] > now - self.timeout:
+                break
+            self.__drop(key)
+            self.expired += 1
+
+    def add(self, data, addr):
+        """The whole packet once data completes it, None until then"""
+
+        try:
+            magic, ident, index, count = FRAGMENT.unpack_from(data)
+        except struct.error:
+            magic = None
+        if magic != FMAGIC or not index < count or count > MAX_FRAGMENTS:
+            self.invalid += 1
+            return None
+
+        payload = data[FRAGMENT.size:]
+        key = (addr, ident)
+        now = self.clock()
+
+        with self.__lock:
+            self.__expire(now)
+
+            message = self.__messages.get(key, None)
+            if message == None:
+                message = self.__messages[key] = (now, count, {})
+            if message[1] != count or index in message[2]:
+                self.invalid += 1
+                return None
+
+            parts = message[2]
+            parts[index] = payload
+            self.__pending += len(payload)
+
+            if len(parts) == count:
+                self.__drop(key)
+                self.completed += 1
+                return "".join(parts[i] for i in xrange(count))
+
+            while self.__pending > self.max_pending:
+                self.__drop(next(iter(self.__messages)))
+                self.evicted += 1
+
+        return None
+
+    def stats(self):
+        with self.__lock:
+            return {'pending': len(self.__messages),
+                    'pending_bytes': self.__pending,
+                    'completed': self.completed, 'expired': self.expired,
+                    'evicted': self.evicted, 'invalid': self.invalid}
+
+
+def fragment(packet, mtu=MTU):
+    """Datagrams of at most mtu bytes carrying packet, for Reassembler"""
+
+    size = mtu - FRAGMENT.size
+    count = (len(packet) + size - 1) / size
+    if count > MAX_FRAGMENTS:
+        raise WireError("%d bytes is too big to fragment" % len(packet))
+
+    ident = random.getrandbits(64)
+    return [FRAGMENT.pack(FMAGIC, ident, i, count) +
+        packet[i * size:(i + 1) * size] for i in xrange(count)]
+
+
+def batch(packets):
+    """One datagram carrying several packets, BMAGIC then each packet after
+       its length"""
+
+    out = [BMAGIC]
+    for packet in packets:
+        pack_varint(len(packet), out)
+        out.append(packet)
+    return "".join(out)
+
+
+def unbatch(data):
+    """Packets of a batch, which are never batches or fragments"""
+
+    packets = []
+    pos = 1
+    try:
+        while pos < len(data):
+            length, pos = unpack_varint(data, pos)
+            packet = data[pos:pos + length]
+            pos += length
+            if len(packet) < length or packet[:1] in (BMAGIC, FMAGIC):
+                raise WireError("truncated or nested batch")
+            packets.append(packet)
+    except IndexError:
+        raise WireError("truncated batch")
+    return packets
+
+
+def pack_varint(n, out):
+    while n >= 0x80:
+        out.append(chr(n & 0x7f | 0x80))
+        n >>= 7
+    out.append(chr(n))
+
+
+def unpack_varint(data, pos):
+    n = 0
+    shift = 0
+    while True:
+        byte = ord(data[pos])
+        pos += 1
+        n |= (byte & 0x7f) << shift
+        if byte < 0x80:
+            return n, pos
+        shift += 7
+
+
+def count_strings(value, counts):
+    """Counts the strings of a message that could go in its dictionary,
+       in practice the uids repeated by every post"""
+
+    if isinstance(value, basestring):
+        # sigs are unique, they never make it in
+        if value not in WORD_INDEX:
+            counts[value] = counts.get(value, 0) + 1
+    elif isinstance(value, (list, tuple)):
+        for item in value:
+            count_strings(item, counts)
+    elif isinstance(value, dict):
+        for key, item in value.iteritems():
+            count_strings(key, counts)
+            count_strings(item, counts)
+
+
+def pack_value(value, refs, out):
+    if value is None:
+        out.append(NONE)
+    elif value is True:
+        out.append(TRUE)
+    elif value is False:
+        out.append(FALSE)
+    elif isinstance(value, (int, long)):
+        if 0 <= value < 0x80:
+            out.append(INT + chr(value))
+        elif value >= 0:
+            out.append(INT)
+            pack_varint(value, out)
+        else:
+            out.append(NEG)
+            pack_varint(-value, out)
+    elif isinstance(value, float):
+        out.append(FLOAT)
+        out.append(DOUBLE.pack(value))
+    elif isinstance(value, basestring):
+        if value in WORD_INDEX:
+            out.append(WORD)
+            out.append(chr(WORD_INDEX[value]))
+        elif value in refs:
+            out.append(REF)
+            pack_varint(refs[value], out)
+        elif HEX_SIG.match(value):
+            out.append(SIG)
+            out.append(str(value).decode("hex"))
+        else:
+            if isinstance(value, unicode):
+                value = value.encode("utf-8")
+            out.append(STR)
+            pack_varint(len(value), out)
+            out.append(value)
+    elif isinstance(value, (list, tuple)):
+        out.append(LIST)
+        pack_varint(len(value), out)
+        for item in value:
+            pack_value(item, refs, out)
+    elif isinstance(value, dict):
+        out.append(DICT)
+        pack_varint(len(value), out)
+        for key, item in value.iteritems():
+            if not isinstance(key, basestring):
+                raise WireError("non-string key: %r" % (key,))
+            pack_value(key, refs, out)
+            pack_value(item, refs, out)
+    else:
+        raise WireError("cannot encode %r" % (value,))
+
+
+def unpack_value(data, pos, strings):
+    tag = data[pos]
+    pos += 1
+
+    if tag == STR:
+        size, pos = unpack_varint(data, pos)
+        return data[pos:pos + size].decode("utf-8"), pos + size
+    elif tag == REF:
+        index, pos = unpack_varint(data, pos)
+        return strings[index], pos
+    elif tag == WORD:
+        return WORDS[ord(data[pos])], pos + 1
+    elif tag == SIG:
+        return unicode(data[pos:pos + 20].encode("hex")), pos + 20
+    elif tag == INT:
+        return unpack_varint(data, pos)
+    elif tag == NEG:
+        n, pos = unpack_varint(data, pos)
+        return -n, pos
+    elif tag == FLOAT:
+        return DOUBLE.unpack_from(data, pos)[0], pos + 8
+    elif tag == LIST:
+        size, pos = unpack_varint(data, pos)
+        items = []
+        for i in xrange(size):
+            item, pos = unpack_value(data, pos, strings)
+            items.append(item)
+        return items, pos
+    elif tag == DICT:
+        size, pos = unpack_varint(data, pos)
+        items = {}
+        for i in xrange(size):
+            key, pos = unpack_value(data, pos, strings)
+            items[key], pos = unpack_value(data, pos, strings)
+        return items, pos
+    elif tag == NONE:
+        return None, pos
+    elif tag == TRUE:
+        return True, pos
+    elif tag == FALSE:
+        return False, pos
+
+    raise WireError("unknown tag %d at %d" % (ord(tag), pos - 1))
+
+
+def encode(message):
+    """Binary packet of a json-like message: MAGIC, WIRE_VERSION, the
+       strings used more than once, then the message referring to them"""
+
+    counts = {}
+    count_strings(message, counts)
+    strings = [value for value, count in counts.iteritems() if count > 1]
+
+    out = [MAGIC, chr(BINARY_FORMAT)]
+    pack_varint(len(strings), out)
+    refs = {}
+    for i, value in enumerate(strings):
+        refs[value] = i
+        if isinstance(value, unicode):
+            value = value.encode("utf-8")
+        pack_varint(len(value), out)
+        out.append(value)
+
+    pack_value(message, refs, out)
+    return "".join(out)
+
+
+def encode_json(message):
+    return json.dumps(message, ensure_ascii=False).encode("utf-8")
+
+
+def compress(packet, stats=None, level=COMPRESS_LEVEL):
+    """ZMAGIC and the deflated packet, the packet itself when it is below
+       COMPRESS_THRESHOLD or does not shrink"""
+
+    if len(packet) < COMPRESS_THRESHOLD:
+        return packet
+
+    begin = time.time()
+    packed = ZMAGIC + zlib.compress(packet, level)
+    if stats != None:
+        stats.compressed += 1
+        stats.raw_bytes += len(packet)
+        stats.packed_bytes += min(len(packed), len(packet))
+        stats.compress_time += time.time() - begin
+
+    return packed if len(packed) < len(packet) else packet
+
+
+def inflate(data, stats=None):
+    """The packet inside a compressed one, at most MAX_INFLATE bytes"""
+
+    begin = time.time()
+    try:
+        inflater = zlib.decompressobj()
+        packet = inflater.decompress(data[1:], MAX_INFLATE)
+    except zlib.error as ex:
+        raise WireError("corrupt compressed packet: %s" % ex)
+
+    if inflater.unconsumed_tail:
+        raise WireError("packet inflates past %d bytes" % MAX_INFLATE)
+    if packet[:1] == ZMAGIC:
+        raise WireError("compressed packet inside a compressed one")
+
+    if stats != None:
+        stats.inflated += 1
+        stats.received_bytes += len(data)
+        stats.inflated_bytes += len(packet)
+        stats.inflate_time += time.time() - begin
+    return packet
+
+
+def decode(data, stats=None):
+    """Message of a binary, json or compressed packet"""
+
+    if data[:1] == ZMAGIC:
+        data = inflate(data, stats)
+
+    if data[:1] != MAGIC:
+        return json.loads(unicode(data, "utf-8"))
+
+    try:
+        if ord(data[1]) > BINARY_FORMAT:
+            raise WireError("binary format %d is newer than %d" %
+                (ord(data[1]), BINARY_FORMAT))
+
+        size, pos = unpack_varint(data, 2)
+        strings = []
+        for i in xrange(size):
+            length, pos = unpack_varint(data, pos)
+            strings.append(data[pos:pos + length].decode("utf-8"))
+            pos += length
+
+        message, pos = unpack_value(data, pos, strings)
+
+    except (IndexError, struct.error, UnicodeDecodeError) as ex:
+        raise WireError("truncated or corrupt packet: %s" % ex)
+
+    if pos != len(data):
+        raise WireError("%d bytes after the message" % (len(data) - pos))
+    return message
@@ -0,0 +1,107 @@
+#!/usr/bin/env python
+"""Splits a single file store, or an existing sharded one, into a new set
+of shards for ShardedEngine. The old files are left in place, the new set
+is used once the <name>.shards manifest is written.
+
+usage: python reshard.py name shards
+"""
+
+import os
+import sys
+import sqlite3
+import logging
+
+from litterengine import SQLiteEngine, StoreError, shard_of, shard_paths, \
+    read_shards, write_shards
+
+POST_COPY_COLUMNS = "uid, postid, msg, txtime, rxtime, perms, sig, emsg, euid"
+
+# what moves to a shard and the column that picks it
+COPIES = [("posts", POST_COPY_COLUMNS, "uid"),
+          ("friends", "uid, fid, txtime", "fid"),
+          ("ranges", "uid, first, last, ftxtime, ltxtime", "uid"),
+          ("horizons", "uid, txtime", "uid")]
+
+
+def sources(path):
+    """File prefixes the data currently lives in"""
+
+    count = read_shards(path)
+    if count != None:
+        return count, shard_paths(path, count)
+    if os.path.isfile(path + ".db"):
+        return None, [path]
+    raise StoreError("no store at " + path)
+
+
+def remove(prefix):
+    for suffix in (".db", ".db-wal", ".db-shm", ".archive.db",
+        ".archive.db-wal", ".archive.db-shm"):
+        if os.path.isfile(prefix + suffix):
+            os.remove(prefix + suffix)
+
+
+def copy_shard(target, number, shards, old):
+    """Copies the rows of every source that belong to shard number"""
+
+    con = sqlite3.connect(target + ".db")
+    con.create_function("shard", 1, lambda uid: shard_of(uid, shards))
+    con.execute("ATTACH DATABASE ? AS archive", (target + ".archive.db",))
+
+    for source in old:
+        con.execute("ATTACH DATABASE ? AS src", (source + ".db",))
+        con.execute("ATTACH DATABASE ? AS srcarchive",
+            (source + ".archive.db",))
+
+        for table, columns, key in COPIES:
+            con.execute("INSERT OR IGNORE INTO main.%s (%s) SELECT %s "
+                "FROM src.%s WHERE shard(%s) == ?" % (table, columns,
+                columns, table, key), (number,))
+        con.execute("INSERT INTO archive.segments (uid, first, last, count, "
+            "data) SELECT uid, first, last, count, data FROM "
+            "srcarchive.segments WHERE shard(uid) == ?", (number,))
+
+        con.commit()
+        con.execute("DETACH DATABASE src")
+        con.execute("DETACH DATABASE srcarchive")
+
+    con.execute("INSERT INTO posts_fts (posts_fts) VALUES ('rebuild')")
+    con.commit()
+    con.close()
+
+
+def reshard(path, shards):
+    """Writes the data of the store at path into shards new files and
+       switches the store to them"""
+
+    count, old = sources(path)
+    if count == shards:
+        return
+
+    # brings every source to the current schema before copying
+    for source in old:
+        SQLiteEngine(source).close()
+
+    new = shard_paths(path, shards)
+    for number, target in enumerate(new):
+        # leftovers of an interrupted reshard were never in a manifest
+        remove(target)
+        SQLiteEngine(target).close()
+        copy_shard(target, number, shards, old)
+        logging.info("wrote shard %d of %d to %s.db", number + 1, shards,
+            target)
+
+    write_shards(path, shards)
+
+
+def main():
+    if len(sys.argv) != 3:
+        print __doc__.strip()
+        sys.exit(1)
+
+    logging.basicConfig(level=logging.INFO)
+    reshard(sys.argv[1], int(sys.argv[2]))
+
+
+if __name__ == '__main__':
+    main()
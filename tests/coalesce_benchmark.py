@@ -0,0 +1,50 @@
+#!/usr/bin/env python
+"""Datagrams saved by coalescing and the latency it adds.
+
+Runs the mesh of flood_benchmark with the seen cache, without coalescing
+and with windows of a few ms. Multicast always goes out right away, the
+unicast replies and forwarded requests to a next hop wait up to the window
+for others to share their datagram.
+
+usage: PYTHONPATH=../src python coalesce_benchmark.py [nodes]
+"""
+
+import sys
+import logging
+from litterrouter import SEEN_TTL
+from flood_benchmark import Mesh
+
+WINDOWS = (None, 0.005, 0.02, 0.05)
+
+
+def main():
+    size = int(sys.argv[1]) if len(sys.argv) > 1 else 50
+    logging.disable(logging.CRITICAL)
+
+    for window in WINDOWS:
+        mesh = Mesh(size, SEEN_TTL, window)
+        mesh.run()
+
+        stats = {'packets': 0, 'saved': 0, 'delay_ms': 0.0,
+                 'max_delay_ms': 0.0}
+        for sock, router, store in mesh.nodes.values():
+            coalesce = router.stats()['coalesce']
+            if coalesce == None:
+                continue
+            stats['packets'] += coalesce['packets']
+            stats['saved'] += coalesce['saved']
+            stats['delay_ms'] += coalesce['delay_ms'] * coalesce['packets']
+            stats['max_delay_ms'] = max(stats['max_delay_ms'],
+                coalesce['max_delay_ms'])
+
+        print "window %5s  %3d nodes  processed %6d  datagrams %6d  " \
+            "coalesced %6d  saved %5d (%4.1f%%)  delay %5.1f ms  max " \
+            "%5.1f ms" % ('off' if window == None else '%gms' %
+            (window * 1000), size, mesh.processed, mesh.datagrams,
+            stats['packets'], stats['saved'], 100.0 * stats['saved'] /
+            max(stats['packets'], 1), stats['delay_ms'] /
+            max(stats['packets'], 1), stats['max_delay_ms'])
+
+
+if __name__ == '__main__':
+    main()
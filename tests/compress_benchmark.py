@@ -0,0 +1,48 @@
+#!/usr/bin/env python
+"""Compression of pull replies, per encoding and zlib level.
+
+Uses the pull replies of wire_benchmark. For each encoding and level it
+reports the compressed size, the share of replies that fit in the 4096
+byte buffer litter used to receive into, and the CPU cost both ways.
+
+usage: PYTHONPATH=../src python compress_benchmark.py [replies]
+"""
+
+import sys
+import time
+from litterwire import WireStats, encode, encode_json, compress, decode
+from wire_benchmark import make_store, make_replies
+
+LEVELS = (1, 6, 9)
+OLD_BUFFER = 4096
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+    replies = make_replies(make_store(), count)
+
+    for name, encoder in (('json', encode_json), ('binary', encode)):
+        packets = [encoder(reply) for reply in replies]
+        size = sum(len(packet) for packet in packets)
+        fits = sum(1 for packet in packets if len(packet) <= OLD_BUFFER)
+        print "%-6s  plain   %6.0f bytes/reply  %5.1f%% fit" % (name,
+            float(size) / count, 100.0 * fits / count)
+
+        for level in LEVELS:
+            stats = WireStats()
+            packed = [compress(packet, stats, level) for packet in packets]
+            for packet in packed:
+                decode(packet, stats)
+
+            size = sum(len(packet) for packet in packed)
+            fits = sum(1 for packet in packed if len(packet) <= OLD_BUFFER)
+            result = stats.stats()
+            print "%-6s  zlib %d  %6.0f bytes/reply  %5.1f%% fit  ratio " \
+                "%.2f  compress %5.1f us  inflate %5.1f us" % (name, level,
+                float(size) / count, 100.0 * fits / count,
+                result['compress_ratio'], result['compress_ms'] * 1000 /
+                count, result['inflate_ms'] * 1000 / count)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,79 @@
+#!/usr/bin/env python
+"""Ingest of gossip that is mostly posts we already have.
+
+Fills a store, then replays batches where some percent of every BATCH
+posts are already stored, with and without the sig filter in front of
+the engine.
+
+usage: PYTHONPATH=../src python dupfilter_benchmark.py [posts] [batches]
+"""
+
+import os
+import sys
+import time
+import shutil
+import random
+import tempfile
+from litterstore import LitterStore
+
+AUTHORS = 100
+BATCH = 100
+DUPLICATES = (50, 90, 100)
+
+
+def post(i):
+    return ['post %d' % i, 'peer%d' % (i % AUTHORS), i, i, i / AUTHORS + 1,
+            1, 'sig%d' % i]
+
+
+def run(size, batches, duplicates, filter_capacity):
+    store = LitterStore("bench", filter_capacity=filter_capacity)
+    for i in range(0, size, 1000):
+        store.process({'posts': [post(j) for j in range(i, i + 1000)]})
+
+    random.seed(1)
+    fresh = size
+    requests = []
+    for i in range(batches):
+        posts = [post(random.randrange(size)) for j in range(duplicates)]
+        posts += [post(fresh + j) for j in range(BATCH - duplicates)]
+        fresh += BATCH - duplicates
+        random.shuffle(posts)
+        requests.append({'posts': posts})
+
+    begin = time.time()
+    for request in requests:
+        store.process(request)
+    spent = time.time() - begin
+
+    stats = store.process({'m': 'stats'})['filter']
+    store.close()
+    return batches * BATCH / spent, stats
+
+
+def main():
+    size = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    batches = int(sys.argv[2]) if len(sys.argv) > 2 else 2000
+    cwd = os.getcwd()
+
+    for duplicates in DUPLICATES:
+        for name, capacity in (('none', None), ('bloom', size * 2)):
+            tmpdir = tempfile.mkdtemp()
+            os.chdir(tmpdir)
+            try:
+                rate, stats = run(size, batches, duplicates, capacity)
+            finally:
+                os.chdir(cwd)
+                shutil.rmtree(tmpdir)
+
+            print "%-6s %8d posts  %3d%% duplicates  ingest %7.0f posts/s" % (
+                name, size, duplicates, rate),
+            if stats != None:
+                print " false positives %d  skipped %d" % (
+                    stats['false_positives'], stats['skipped'])
+            else:
+                print
+
+
+if __name__ == '__main__':
+    main()
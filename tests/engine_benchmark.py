@@ -0,0 +1,76 @@
+#!/usr/bin/env python
+"""Ingest and scan throughput of the storage engines.
+
+Ingest stores batches of remote posts like the worker does for gossip.
+Scan reads the newest posts of everybody, and of one uid inside a time
+range like a gap reply. Both engines write to files in a temp directory.
+
+usage: PYTHONPATH=../src python engine_benchmark.py [posts]
+"""
+
+import os
+import sys
+import cgi
+import time
+import shutil
+import random
+import tempfile
+from litterengine import ENGINES
+
+AUTHORS = 100
+BATCH = 100
+SCANS = 2000
+
+
+def make_rows(size):
+    rows = []
+    for i in range(size):
+        msg = 'post %d <of> %d' % (i, size)
+        uid = 'peer%d' % (i % AUTHORS)
+        rows.append((uid, i / AUTHORS + 1, i, i, msg, 1, 'sig%d' % i,
+                     cgi.escape(msg), uid))
+    return rows
+
+
+def run(name, rows):
+    engine = ENGINES[name]("bench")
+
+    begin = time.time()
+    for i in range(0, len(rows), BATCH):
+        engine.insert("bench", rows[i:i + BATCH])
+    ingest = len(rows) / (time.time() - begin)
+
+    begin = time.time()
+    for i in range(SCANS):
+        engine.scan(limit=100, display=True)
+    newest = SCANS / (time.time() - begin)
+
+    random.seed(1)
+    begin = time.time()
+    for i in range(SCANS):
+        start = random.randint(0, len(rows))
+        engine.scan('peer%d' % (i % AUTHORS), 1, start, start + 20 * AUTHORS)
+    ranged = SCANS / (time.time() - begin)
+    engine.close()
+
+    print "%-6s %8d posts  ingest %8.0f posts/s  newest %7.0f scans/s  " \
+        "range %7.0f scans/s" % (name, len(rows), ingest, newest, ranged)
+
+
+def main():
+    size = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    rows = make_rows(size)
+    cwd = os.getcwd()
+
+    for name in ('sqlite', 'log'):
+        tmpdir = tempfile.mkdtemp()
+        os.chdir(tmpdir)
+        try:
+            run(name, rows)
+        finally:
+            os.chdir(cwd)
+            shutil.rmtree(tmpdir)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,77 @@
+#!/usr/bin/env python
+"""Per-row cost of LitterStore.__get.
+
+'before' selects msg and uid and escapes every row in Python, like __get
+used to. 'after' selects the emsg and euid columns stored at ingest.
+
+usage: PYTHONPATH=../src python escape_benchmark.py [posts]
+"""
+
+import os
+import sys
+import cgi
+import time
+import shutil
+import sqlite3
+import tempfile
+from litterstore import LitterStore, GET_ALL_SQL, POST_COLUMNS, \
+    DISPLAY_COLUMNS
+
+REPEAT = 200
+
+
+def before(con, limit):
+    data = con.execute(GET_ALL_SQL % POST_COLUMNS,
+                       (0, sys.maxint, sys.maxint, None, limit)).fetchall()
+    for i in range(len(data)):
+        d = list(data[i])
+        d[0] = cgi.escape(d[0])
+        d[1] = cgi.escape(d[1])
+        data[i] = tuple(d)
+    return data
+
+
+def after(con, limit):
+    return con.execute(GET_ALL_SQL % DISPLAY_COLUMNS,
+                       (0, sys.maxint, sys.maxint, None, limit)).fetchall()
+
+
+def per_row(func, con, limit):
+    best = None
+    for i in range(REPEAT):
+        begin = time.time()
+        func(con, limit)
+        spent = time.time() - begin
+        best = spent if best == None else min(best, spent)
+    return best / limit * 1e6
+
+
+def main():
+    size = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+    cwd = os.getcwd()
+    tmpdir = tempfile.mkdtemp()
+    os.chdir(tmpdir)
+
+    try:
+        store = LitterStore("bench")
+        posts = [['post <%d> & "more"' % i, 'peer%d' % (i % 50), i, i,
+                  i + 1, 1, 'sig%d' % i] for i in range(size)]
+        store.process({'posts': posts})
+        store.close()
+
+        con = sqlite3.connect("bench.db")
+        assert before(con, 10) == after(con, 10)
+
+        for limit in (10, 100, 1000):
+            print "limit %5d  before %6.2f us/row  after %6.2f us/row" % (
+                limit, per_row(before, con, limit),
+                per_row(after, con, limit))
+        con.close()
+
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(tmpdir)
+
+
+if __name__ == '__main__':
+    main()
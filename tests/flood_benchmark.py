@@ -0,0 +1,188 @@
+#!/usr/bin/env python
+"""Duplicate processing of flooded messages in a simulated mesh.
+
+Every node runs a LitterRouter and an in-memory LitterStore. Multicast
+reaches the neighbours of a node, unicast reaches one node. Packets take a
+random latency and DUPLICATE of them arrive twice, like they do from a
+node on two segments or through the overlay hack of UDPSender. Each node
+sends gen_pull to all and gen_rand_pull to any every round. The benchmark
+counts how often a store processes a message it already processed, with
+duplicate suppression by request hid only and with the seen cache.
+
+usage: PYTHONPATH=../src python flood_benchmark.py [nodes]
+"""
+
+import sys
+import time
+import heapq
+import random
+import logging
+import collections
+from litterrouter import LitterRouter, Coalescer, Sender, UDPSender, \
+    MCAST_ADDR, PORT, SEEN_TTL, RouterError, message_key
+from litterstore import LitterStore
+from litterwire import FMAGIC, BMAGIC, Reassembler, decode, unbatch
+
+NEIGHBOURS = 4
+ROUNDS = 3
+# seconds between the timers of two nodes and mean packet latency
+SPACING = 0.01
+LATENCY = 0.005
+DUPLICATE = 0.05
+
+
+class MeshSocket:
+    """Socket of one node, sendto schedules deliveries on the mesh"""
+
+    def __init__(self, mesh, addr):
+        self.mesh = mesh
+        self.addr = addr
+
+    def setsockopt(self, *args):
+        pass
+
+    def sendto(self, data, dest):
+        if dest == (MCAST_ADDR, PORT):
+            targets = self.mesh.links[self.addr]
+        else:
+            targets = [dest]
+        self.mesh.datagrams += len(targets)
+        for target in targets:
+            self.mesh.deliver(target, data, self.addr)
+
+
+class Mesh:
+
+    def __init__(self, size, seen_ttl, window=None, **options):
+        random.seed(1)
+        self.now = 0.0
+        self.events = []
+        self.addrs = [('10.0.%d.%d' % (i / 250, i % 250 + 1), PORT)
+                      for i in range(size)]
+
+        # a ring keeps it connected, random links make it a mesh
+        links = dict((addr, set()) for addr in self.addrs)
+        for i, addr in enumerate(self.addrs):
+            others = [self.addrs[(i + 1) % size]] + \
+                random.sample(self.addrs, NEIGHBOURS - 1)
+            for other in others:
+                if other != addr:
+                    links[addr].add(other)
+                    links[other].add(addr)
+        self.links = dict((addr, sorted(peers))
+                          for addr, peers in links.items())
+
+        self.nodes = {}
+        self.reassemblers = {}
+        for i, addr in enumerate(self.addrs):
+            sock = MeshSocket(self, addr)
+            coalescer = None
+            if window != None:
+                coalescer = Coalescer(window)
+                coalescer.clock = lambda: self.now
+            router = LitterRouter(sock, [addr[0]], 'node%d' % i,
+                seen_ttl=seen_ttl, coalescer=coalescer, **options)
+            if router.peers != None:
+                router.peers.clock = lambda: self.now
+            store = LitterStore('node%d' % i, test=True,
+                filter_capacity=None)
+            store.process({'posts': [{'msg': 'hello from node%d' % i}]})
+            self.nodes[addr] = (sock, router, store)
+            self.reassemblers[addr] = Reassembler()
+
+        self.processed = 0
+        self.datagrams = 0
+        self.duplicates = 0
+        self.unroutable = 0
+        self.counts = collections.Counter()
+
+    def schedule(self, at, event):
+        heapq.heappush(self.events, (at, len(self.events), event))
+
+    def deliver(self, target, data, source):
+        copies = 2 if random.random() < DUPLICATE else 1
+        for i in range(copies):
+            self.schedule(self.now + random.expovariate(1 / LATENCY),
+                (target, data, source))
+
+    def handle(self, addr, request, sender):
+        """What WorkerThread does with a request, the response when the
+           store processed it"""
+
+        sock, router, store = self.nodes[addr]
+        if not router.should_process(request, sender):
+            return None
+
+        headers = request.get('headers', None)
+        if headers != None:
+            key = (addr, message_key(headers))
+            self.counts[key] += 1
+            self.processed += 1
+            if self.counts[key] > 1:
+                self.duplicates += 1
+
+        response = store.process(request, router.hop_wire(sender))
+        try:
+            router.send(response, sender)
+        except RouterError:
+            # the worker logs it and moves on
+            self.unroutable += 1
+        return response
+
+    def run(self, methods=('gen_pull', 'gen_rand_pull'), rounds=ROUNDS):
+        start = self.now
+        for i in range(rounds):
+            for j, addr in enumerate(self.addrs):
+                for m in methods:
+                    self.schedule(start + (i * len(self.addrs) + j) *
+                        SPACING, (addr, m, None))
+
+        while len(self.events) > 0:
+            self.now, seq, (target, data, source) = \
+                heapq.heappop(self.events)
+
+            if source == 'flush':
+                pass
+            elif source == None:
+                # the timer of litter.py main
+                sender = Sender()
+                sender.dest = (MCAST_ADDR, PORT)
+                self.handle(target, {'m': data}, sender)
+            else:
+                # what MulticastServer does with fragments
+                if data[:1] == FMAGIC:
+                    data = self.reassemblers[target].add(data, source)
+                    if data == None:
+                        continue
+                packets = [data]
+                if data[:1] == BMAGIC:
+                    packets = unbatch(data)
+                for packet in packets:
+                    request = decode(packet)
+                    sender = UDPSender(self.nodes[target][0], [target[0]],
+                        source)
+                    self.handle(target, request, sender)
+
+            # the worker waking up for its next batch
+            wait = self.nodes[target][1].flush()
+            if wait != None:
+                self.schedule(self.now + wait, (target, None, 'flush'))
+
+
+def main():
+    size = int(sys.argv[1]) if len(sys.argv) > 1 else 50
+    logging.disable(logging.CRITICAL)
+
+    for name, seen_ttl in (('hid only', None), ('seen cache', SEEN_TTL)):
+        mesh = Mesh(size, seen_ttl)
+        begin = time.time()
+        mesh.run()
+        spent = time.time() - begin
+        print "%-10s %3d nodes  processed %6d  duplicates %5d (%4.1f%%)  " \
+            "unroutable %4d  %5.2f s" % (name, size, mesh.processed,
+            mesh.duplicates, 100.0 * mesh.duplicates /
+            max(mesh.processed, 1), mesh.unroutable, spent)
+
+
+if __name__ == '__main__':
+    main()
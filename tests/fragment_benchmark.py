@@ -0,0 +1,68 @@
+#!/usr/bin/env python
+"""Datagrams per pull reply, before and after fragmentation.
+
+A node behind on every author pulls from the store of wire_benchmark with
+the old limit of 20 posts and with PULL_LIMIT. Replies are encoded and
+compressed like the router does for a version 3 hop, then fragmented.
+A reply is lost with any of its fragments, the survival column is for
+LOSS of the datagrams dropped independently.
+
+usage: PYTHONPATH=../src python fragment_benchmark.py [replies]
+"""
+
+import sys
+import time
+import random
+from litterstore import PULL_LIMIT, OLD_PULL_LIMIT
+from litterwire import WireStats, Reassembler, encode, compress, fragment
+from wire_benchmark import AUTHORS, POSTS, make_store
+
+LOSS = 0.01
+
+
+def make_replies(store, count, limit):
+    random.seed(2)
+    replies = []
+    for i in range(count):
+        friends = [['user%02d-laptop.lan' % j,
+                    1300000000 + random.randint(0, AUTHORS * POSTS / 2) * 7]
+                   for j in range(AUTHORS)]
+        request = {'query': {'m': 'pull', 'uid': 'peer-%d' % i,
+                   'friends': friends, 'limit': limit}, 'headers': {
+                   'hto': 'any', 'hfrom': 'peer-%d' % i,
+                   'hid': random.getrandbits(48), 'htype': 'req',
+                   'httl': 5}}
+        replies.append(store.process(request))
+    return replies
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 100
+    store = make_store()
+
+    for limit in (OLD_PULL_LIMIT, PULL_LIMIT):
+        replies = make_replies(store, count, limit)
+        posts = sum(len(reply['posts']) for reply in replies)
+        stats = WireStats()
+        packets = [compress(encode(reply), stats) for reply in replies]
+        size = sum(len(packet) for packet in packets)
+
+        begin = time.time()
+        pieces = [fragment(packet) for packet in packets]
+        reassembler = Reassembler()
+        for i, packet in enumerate(pieces):
+            results = [reassembler.add(piece, i) for piece in packet]
+            assert results[-1] == packets[i]
+        spent = (time.time() - begin) / count
+
+        datagrams = sum(len(packet) for packet in pieces)
+        survive = sum((1 - LOSS) ** len(packet) for packet in pieces) / count
+        print "limit %3d  %5.1f posts/reply  %6.0f bytes/reply  %4.1f " \
+            "datagrams/reply  %5.1f posts/datagram  survive %4.1f%%  " \
+            "split+join %5.1f us" % (limit, float(posts) / count,
+            float(size) / count, float(datagrams) / count,
+            float(posts) / datagrams, 100 * survive, spent * 1e6)
+
+
+if __name__ == '__main__':
+    main()
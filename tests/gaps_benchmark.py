@@ -0,0 +1,115 @@
+#!/usr/bin/env python
+"""Cost of gen_gap as the store grows.
+
+Compares the ranges table against the previous algorithm, which read every
+post of every friend ordered by txtime (given its covering index here).
+
+usage: PYTHONPATH=../src python gaps_benchmark.py [size ...]
+"""
+
+import os
+import sys
+import time
+import shutil
+import sqlite3
+import tempfile
+from litterstore import LitterStore
+
+AUTHORS = 100
+BATCH = 1000
+# every author misses one post in MISSING
+MISSING = 37
+
+
+def fill(store, size):
+    posts = []
+    for i in range(size):
+        postid = i / AUTHORS + 1
+        if postid % MISSING == 0:
+            continue
+        posts.append(['post %d' % i, 'peer%d' % (i % AUTHORS), i, i,
+                      postid, 1, 'sig%d' % i])
+        if len(posts) == BATCH:
+            store.process({'posts': posts})
+            posts = []
+    store.process({'posts': posts})
+
+
+def scan_gaps(con, uid):
+    results = con.execute("SELECT postid, txtime FROM posts WHERE uid == ? "
+                          "ORDER BY txtime DESC", (uid,)).fetchall()
+    gaps = []
+    last_item = None
+
+    for postid, txtime in results:
+        if last_item != None and last_item[0] - postid > 1:
+            gaps.append((txtime, last_item[1]))
+        last_item = (postid, txtime)
+
+    if last_item != None and last_item[0] != 1:
+        gaps.append((0, last_item[1]))
+
+    return gaps
+
+
+def scan_all_gaps(con):
+    fids = con.execute("SELECT DISTINCT fid FROM friends WHERE uid == ?",
+                       ("bench",)).fetchall()
+    results = {}
+    for fid, in fids:
+        if len(scan_gaps(con, fid)) > 0:
+            results[fid] = scan_gaps(con, fid)
+    return results
+
+
+def timed(func, repeat=5):
+    best = None
+    for i in range(repeat):
+        begin = time.time()
+        result = func()
+        spent = time.time() - begin
+        best = spent if best == None else min(best, spent)
+    return best, result
+
+
+def run(size):
+    store = LitterStore("bench")
+    begin = time.time()
+    fill(store, size)
+    load = time.time() - begin
+
+    con = sqlite3.connect("bench.db")
+    con.execute("CREATE INDEX IF NOT EXISTS posts_uid_txtime_postid "
+                "ON posts (uid, txtime, postid)")
+
+    scan, old = timed(lambda: scan_all_gaps(con))
+    ranges, new = timed(lambda: store.process({'m': 'gen_gap'}))
+    new = new['query']['friends']
+
+    assert sorted(old) == sorted(new)
+    assert sum(len(g) for g in old.values()) == \
+        sum(len(g) for g in new.values())
+
+    print "%8d posts  load %7.1f s  scan %9.2f ms  ranges %7.2f ms" % (
+        size, load, scan * 1000, ranges * 1000)
+
+    con.close()
+    store.close()
+
+
+def main():
+    sizes = [int(arg) for arg in sys.argv[1:]] or [10000, 100000, 1000000]
+    cwd = os.getcwd()
+
+    for size in sizes:
+        tmpdir = tempfile.mkdtemp()
+        os.chdir(tmpdir)
+        try:
+            run(size)
+        finally:
+            os.chdir(cwd)
+            shutil.rmtree(tmpdir)
+
+
+if __name__ == '__main__':
+    main()
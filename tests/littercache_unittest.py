@@ -0,0 +1,60 @@
+#!/usr/bin/env python
+
+import unittest
+from littercache import *
+
+def row(txtime, uid='usera', perms=1):
+    return ('msg %s' % txtime, uid, txtime, txtime, 1, perms, 'sig%s' % txtime)
+
+
+class RingTest(unittest.TestCase):
+
+    def test(self):
+        ring = Ring(3)
+        for txtime in (5, 1, 3, 4):
+            ring.add(row(txtime))
+
+        self.assertEqual([r[2] for r in ring.get(3)], [5, 4, 3])
+        self.assertEqual(ring.get(4), None)
+        self.assertEqual((ring.get(0), ring.get(-2)), ([], []))
+
+        # duplicates and posts older than the ring are ignored
+        self.assertEqual(ring.add(row(4)), 0)
+        self.assertEqual(ring.add(row(2)), 0)
+        self.assertEqual(ring.add(row(6)), 1)
+        self.assertEqual([r[2] for r in ring.get(2)], [6, 5])
+
+        ring = Ring(3)
+        ring.complete = True
+        ring.add(row(1))
+        self.assertEqual([r[2] for r in ring.get(3)], [1])
+
+
+class TimelineCacheTest(unittest.TestCase):
+
+    def test(self):
+        cache = TimelineCache(size=3, uid_size=2)
+        self.assertEqual(cache.get(None, 2), None)
+
+        # writes between the db read and the fill must not be lost
+        generation = cache.generation
+        cache.add([('usera', row(9))])
+        cache.fill(None, [row(2), row(1)], generation)
+        self.assertEqual(cache.get(None, 1), None)
+
+        cache.fill(None, [row(9), row(2), row(1)], cache.generation)
+        self.assertEqual([r[2] for r in cache.get(None, 2)], [9, 2])
+
+        cache.fill(('userb', 1), [], cache.generation)
+        cache.add([('userb', row(10, 'userb')), ('userb', row(11, 'userb'))])
+        self.assertEqual([r[2] for r in cache.get(('userb', 1), 2)], [11, 10])
+        self.assertEqual([r[2] for r in cache.get(None, 3)], [11, 10, 9])
+
+        stats = cache.stats()
+        self.assertEqual(stats['hits'], 3)
+        self.assertEqual(stats['misses'], 2)
+        self.assertEqual(stats['evictions'], 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
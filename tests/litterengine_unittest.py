@@ -0,0 +1,100 @@
+#!/usr/bin/env python
+
+import os
+import shutil
+import tempfile
+import unittest
+from litterengine import *
+
+def row(uid, postid, txtime=None):
+    txtime = txtime if txtime != None else postid
+    return (uid, postid, txtime, txtime, 'post %d' % postid, 1,
+            '%s%d' % (uid, postid), 'post %d' % postid, uid)
+
+
+class RangeSetTest(unittest.TestCase):
+
+    def test(self):
+        ranges = RangeSet()
+        for postid in (2, 3, 5, 9, 6):
+            ranges.merge(postid, postid, postid, postid)
+        self.assertEqual(ranges.ranges,
+            [(2, 3, 2, 3), (5, 6, 5, 6), (9, 9, 9, 9)])
+
+        # a run spanning several ranges joins them
+        ranges.merge(4, 8, 4, 8)
+        self.assertEqual(ranges.ranges, [(2, 9, 2, 9)])
+        self.assertEqual(ranges.firsts, [2])
+
+
+class LogEngineTest(unittest.TestCase):
+    """Reopens the log from its segment files"""
+
+    def setUp(self):
+        self.cwd = os.getcwd()
+        self.tmpdir = tempfile.mkdtemp()
+        os.chdir(self.tmpdir)
+
+    def tearDown(self):
+        os.chdir(self.cwd)
+        shutil.rmtree(self.tmpdir)
+
+    def test_replay(self):
+        log = LogEngine("usera")
+        fresh = log.insert("usera", [row("userb", i) for i in (1, 2, 4)])
+        self.assertEqual(len(fresh), 3)
+        self.assertEqual(log.insert("usera", [row("userb", 1)]), [])
+        log.upsert_watermarks("userc", [("userb", 1)])
+        log.close()
+
+        log = LogEngine("usera")
+        self.assertEqual([post[4] for post in log.scan(limit=10)], [4, 2, 1])
+        self.assertEqual(log.gap_ranges("usera"),
+            [("userb", 1, 2, 1, 2), ("userb", 4, 4, 4, 4)])
+        self.assertEqual(log.watermarks("userc"), [("userb", 1)])
+        self.assertEqual(log.max_postid("userb"), 4)
+        log.close()
+
+    def test_torn(self):
+        log = LogEngine("usera")
+        log.insert("usera", [row("userb", 1)])
+        log.close()
+
+        # a crash in the middle of the next append
+        f = open(os.path.join("usera.log", "%08d.seg" % 1), "ab")
+        f.write("\x00\x00\x01\x00['p', ")
+        f.close()
+
+        log = LogEngine("usera")
+        log.insert("usera", [row("userb", 2)])
+        log.close()
+
+        log = LogEngine("usera")
+        self.assertEqual([post[4] for post in log.scan(limit=10)], [2, 1])
+        log.close()
+
+    def test_rewrite(self):
+        log = LogEngine("usera", segment_bytes=1024)
+        for i in range(1, 101, 10):
+            log.insert("usera", [row("userb", j) for j in range(i, i + 10)])
+        segments = len(os.listdir("usera.log"))
+
+        archived, freed = log.compact("usera", max_posts=10)
+        self.assertEqual(archived, 90)
+        self.assertTrue(freed > 0)
+        self.assertTrue(len(os.listdir("usera.log")) < segments)
+        log.close()
+
+        log = LogEngine("usera")
+        self.assertEqual([post[4] for post in log.scan(limit=100)],
+            range(100, 90, -1))
+        self.assertEqual(log.gap_ranges("usera"),
+            [("userb", 1, 100, 1, 100)])
+        self.assertEqual(log.horizons(), {"userb": 90})
+        self.assertEqual([post[4] for post in log.archive_scan(limit=3)],
+            [90, 89, 88])
+        log.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,55 @@
+#!/usr/bin/env python
+
+import os
+import shutil
+import tempfile
+import unittest
+from litterfilter import *
+
+class BloomFilterTest(unittest.TestCase):
+
+    def setUp(self):
+        self.cwd = os.getcwd()
+        self.tmpdir = tempfile.mkdtemp()
+        os.chdir(self.tmpdir)
+
+    def tearDown(self):
+        os.chdir(self.cwd)
+        shutil.rmtree(self.tmpdir)
+
+    def test(self):
+        bloom = BloomFilter(capacity=1000)
+        for i in range(1000):
+            bloom.add('sig%d' % i)
+
+        # no false negatives, false positives close to the configured rate
+        self.assertTrue(all('sig%d' % i in bloom for i in range(1000)))
+        positives = sum(1 for i in range(1000, 11000) if 'sig%d' % i in bloom)
+        self.assertTrue(positives < 10000 * FILTER_FP_RATE * 2)
+        self.assertTrue(abs(bloom.fp_rate - FILTER_FP_RATE) < 0.002)
+        self.assertTrue(u'sig1' in bloom)
+
+    def test_file(self):
+        bloom = BloomFilter("usera.filter", capacity=100000)
+        self.assertFalse(bloom.load())
+        bloom.add('first')
+        bloom.save()
+        size = os.path.getsize("usera.filter")
+
+        # later saves only write back what changed
+        bloom.add('second')
+        bloom.save()
+        self.assertEqual(os.path.getsize("usera.filter"), size)
+
+        bloom = BloomFilter("usera.filter", capacity=100000)
+        self.assertTrue(bloom.load())
+        self.assertEqual(bloom.count, 2)
+        self.assertTrue('first' in bloom and 'second' in bloom)
+        self.assertFalse('third' in bloom)
+
+        # a file written for another capacity is rebuilt by the caller
+        self.assertFalse(BloomFilter("usera.filter", capacity=10).load())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,15 +1,23 @@
 #!/usr/bin/env python
 
 import unittest
+import random
 from litterrouter import *
+from litterstore import LitterStore, OLD_PULL_LIMIT, PULL_LIMIT
+from litterwire import MAGIC, ZMAGIC, FMAGIC, BMAGIC, MTU, WIRE_VERSION, \
+    Reassembler, decode, unbatch
 
 class MockSocket:
 
+    def __init__(self):
+        self.sent = []
+        self.options = 0
+
     def setsockopt(self, opt, mcastif, intf):
-        pass
+        self.options += 1
 
     def sendto(self, data, dest):
-        pass
+        self.sent.append((data, dest))
 
 
 class UDPSenderTest(unittest.TestCase):
@@ -41,6 +49,170 @@ class UDPSenderTest(unittest.TestCase):
         # case 7
         self.assertEqual(sender_c.send('',dest_a), dest_a)
 
+        # case 8, a socket for each interface, none switched
+        msocks = [MockSocket(), MockSocket()]
+        sender_d = UDPSender(sock, ['10.0.0.1', '10.0.1.1'], msocks=msocks)
+        options = sock.options
+        self.assertEqual(sender_d.send('x'), mcast)
+        self.assertEqual([msock.sent for msock in msocks],
+            [[('x', mcast)], [('x', mcast)]])
+        self.assertEqual(sock.options + sum(msock.options
+            for msock in msocks), options)
+
+
+class RouteTableTest(unittest.TestCase):
+
+    def setUp(self):
+        self.now = 0
+        self.table = RouteTable(3, 10)
+        self.table.clock = lambda: self.now
+
+    def test_evict(self):
+        for key in ('a', 'b', 'c'):
+            self.table.put(key, key.upper())
+        # hearing from a again makes b the least recent
+        self.table.put('a', 'A')
+        self.table.put('d', 'D')
+
+        self.assertFalse('b' in self.table)
+        self.assertEqual(self.table.get('a'), 'A')
+        self.assertEqual(self.table.get('b'), None)
+        self.assertEqual(len(self.table), 3)
+        self.assertEqual(self.table.evicted, 1)
+
+    def test_expire(self):
+        self.table.put('a', 'A')
+        self.now = 5
+        self.table.put('b', 'B')
+        self.now = 12
+
+        self.assertFalse('a' in self.table)
+        self.assertEqual(self.table.choice(), 'b')
+        self.now = 20
+        self.assertEqual(self.table.choice(), None)
+        self.assertEqual(self.table.stats()['expired'], 2)
+
+    def test_choice(self):
+        for key in ('a', 'b', 'c', 'd', 'e'):
+            self.table.put(key, key)
+        chosen = set(self.table.choice() for i in range(100))
+        self.assertEqual(chosen, set(['c', 'd', 'e']))
+
+
+class SeenCacheTest(unittest.TestCase):
+
+    def test(self):
+        now = [0]
+        seen = SeenCache(ttl=30, buckets=3)
+        seen.clock = lambda: now[0]
+
+        self.assertFalse(seen.seen('a'))
+        self.assertTrue(seen.seen('a'))
+        now[0] = 15
+        seen.add('b')
+
+        # a was in the first bucket, b is kept until 40
+        now[0] = 31
+        self.assertFalse('a' in seen)
+        self.assertTrue('b' in seen)
+        now[0] = 100
+        self.assertFalse('b' in seen)
+        self.assertEqual(seen.stats()['duplicates'], 1)
+
+
+class PeerScoresTest(unittest.TestCase):
+
+    def test(self):
+        now = [0]
+        peers = PeerScores(timeout=5, probe=0)
+        peers.clock = lambda: now[0]
+
+        # a answers in 10 ms, b never does
+        for i in range(20):
+            peers.sent(('me', 2 * i), 'a')
+            peers.sent(('me', 2 * i + 1), 'b')
+            now[0] += 0.01
+            peers.replied(('me', 2 * i))
+            peers.replied(('me', 2 * i))
+            now[0] += 6
+
+        self.assertTrue(peers.weight('a') > 100 * peers.weight('b'))
+        self.assertTrue(peers.weight('a') > peers.weight('c'))
+        chosen = [peers.choose(['a', 'b']) for i in range(100)]
+        self.assertTrue(chosen.count('a') > 95)
+
+        stats = peers.stats()
+        self.assertEqual((stats['replies'], stats['timeouts']), (20, 20))
+
+        # with time the scores go back to where they started
+        now[0] += 100 * SCORE_DECAY
+        self.assertAlmostEqual(peers.weight('b'), peers.weight('c'))
+
+
+class IngressLimiterTest(unittest.TestCase):
+
+    def test(self):
+        now = [0]
+        limiter = IngressLimiter(rate=10, burst=5, global_rate=20,
+            global_burst=8, shed_fill=0.5)
+        limiter.clock = lambda: now[0]
+
+        # a burst of a, then b gets what is left of the global one
+        results = [limiter.admit('a') for i in range(7)]
+        self.assertEqual(results, [True] * 5 + [False] * 2)
+        results = [limiter.admit('b') for i in range(5)]
+        self.assertEqual(results, [True] * 3 + [False] * 2)
+
+        # tokens come back with time, not past the burst
+        now[0] = 0.2
+        self.assertEqual(sum(limiter.admit('a') for i in range(5)), 2)
+        now[0] = 10
+        self.assertEqual(sum(limiter.admit('c') for i in range(9)), 5)
+
+        self.assertFalse(limiter.admit('d', fill=0.5))
+        stats = limiter.stats()
+        self.assertEqual((stats['admitted'], stats['throttled'],
+            stats['throttled_global'], stats['shed']), (15, 9, 2, 1))
+
+
+class CoalescerTest(unittest.TestCase):
+
+    def test(self):
+        now = [0]
+        sock = MockSocket()
+        coalescer = Coalescer(window=0.02, mtu=100)
+        coalescer.clock = lambda: now[0]
+        sender_a = UDPSender(sock, dest=('10.0.0.1', PORT))
+        sender_b = UDPSender(sock, dest=('10.0.0.2', PORT))
+
+        coalescer.add(sender_a, 'a1')
+        now[0] = 0.01
+        coalescer.add(sender_b, 'b1')
+        coalescer.add(sender_a, 'a2')
+        self.assertEqual(sock.sent, [])
+
+        # a is due first, then b
+        self.assertAlmostEqual(coalescer.flush(), 0.01)
+        now[0] = 0.02
+        self.assertAlmostEqual(coalescer.flush(), 0.01)
+        self.assertEqual(sock.sent[0][1], ('10.0.0.1', PORT))
+        self.assertEqual(unbatch(sock.sent[0][0]), ['a1', 'a2'])
+        now[0] = 0.03
+        self.assertEqual(coalescer.flush(), None)
+        self.assertEqual(sock.sent[1], ('b1', ('10.0.0.2', PORT)))
+
+        # full batches and urgent packets go right away
+        coalescer.add(sender_a, 'x' * 60)
+        coalescer.add(sender_a, 'y' * 60)
+        coalescer.add(sender_a, 'z', urgent=True)
+        self.assertEqual([data for data, dest in sock.sent[2:]],
+            ['x' * 60, BMAGIC + '\x3c' + 'y' * 60 + '\x01z'])
+
+        stats = coalescer.stats()
+        self.assertEqual((stats['packets'], stats['sends'], stats['saved']),
+            (6, 4, 2))
+        self.assertAlmostEqual(stats['max_delay_ms'], 20)
+
 
 class LitterRouterTest(unittest.TestCase):
 
@@ -155,6 +327,187 @@ class LitterRouterTest(unittest.TestCase):
         #case 16
         sender_d = UDPSender(self.sock, dest=('182.231.11.2',PORT))
         self.assertEqual(self.router_a.send({},sender=sender_c), sender_c)
+
+    def test_duplicates(self):
+        headers = {'hto': 'user_c', 'hfrom': 'user_b', 'hid': 'id1',
+                   'htype': 'rep', 'httl': 0}
+        sender = UDPSender(self.sock, dest=('10.0.0.1', PORT))
+
+        # the same reply over two paths is processed once
+        self.assertTrue(self.router_a.should_process({'headers':
+            dict(headers)}, sender))
+        self.assertFalse(self.router_a.should_process({'headers':
+            dict(headers)}, sender))
+
+        # the request it answers is another message
+        headers['htype'] = 'req'
+        self.assertTrue(self.router_a.should_process({'headers': headers},
+            sender))
+
+    def test_wire(self):
+        addr_a = ('10.0.0.1', PORT)
+        addr_c = ('10.0.0.3', PORT)
+        sock = MockSocket()
+        router = LitterRouter(sock, self.intfs, 'user_b')
+
+        # a request sent by user_a itself, then one user_c forwarded
+        # without restamping hwire
+        for hid, addr, hwire in ((1, addr_a, [WIRE_VERSION, 2]),
+                                 (2, addr_c, [WIRE_VERSION, 3])):
+            headers = {'hto': 'user_b', 'hfrom': 'user_a', 'hid': hid,
+                       'htype': 'req', 'httl': 2, 'hwire': hwire}
+            sender = UDPSender(self.sock, dest=addr)
+            router.should_process({'headers': headers}, sender)
+
+            reply = {'headers': {'hto': 'user_a', 'hfrom': 'user_b',
+                     'hid': hid, 'htype': 'rep', 'httl': 4}, 'posts': []}
+            router.send(reply, sender)
+
+        packets = dict((dest, data) for data, dest in sock.sent)
+        self.assertEqual(packets[addr_a][0], MAGIC)
+        self.assertEqual(packets[addr_c][0], '{')
+        self.assertEqual(decode(packets[addr_a])['headers']['hwire'],
+            [WIRE_VERSION, 3])
+
+        # big replies to the same hop go out compressed
+        reply = {'headers': {'hto': 'user_a', 'hfrom': 'user_b', 'hid': 1,
+                 'htype': 'rep', 'httl': 4},
+                 'posts': [['post %d' % i, 'user_b', i, i, i, 1, 'sig']
+                           for i in range(100)]}
+        router.send(reply, sender)
+        data, dest = sock.sent[-1]
+        self.assertEqual((data[0], dest), (ZMAGIC, addr_a))
+        self.assertEqual(len(router.decode(data)['posts']), 100)
+        self.assertEqual(router.stats()['compression']['inflated'], 1)
+
+        # past the MTU they go out as fragments, random sigs do not compress
+        reply['posts'] = [['post %d' % i, 'user_b', i, i, i, 1,
+                           '%040x' % random.getrandbits(160)]
+                          for i in range(100)]
+        sent = len(sock.sent)
+        router.send(reply, sender)
+        pieces = [data for data, dest in sock.sent[sent:]]
+        self.assertTrue(len(pieces) > 1)
+        self.assertTrue(all(len(piece) <= MTU and piece[0] == FMAGIC
+                            for piece in pieces))
+        reassembler = Reassembler()
+        packet = [reassembler.add(piece, addr_a) for piece in pieces][-1]
+        self.assertEqual(router.decode(packet)['posts'], reply['posts'])
+
+    def test_relayed_pull(self):
+        store = LitterStore('user_b', test=True)
+        store.process({'posts': [['post %d' % i, 'user_c', i, i, i, 1,
+                                  'sig%d' % i] for i in range(1, 101)]})
+        router = LitterRouter(MockSocket(), self.intfs, 'user_b')
+        query = {'m': 'pull', 'uid': 'user_a', 'limit': PULL_LIMIT,
+                 'friends': [['user_c', 0]]}
+
+        # user_a reads fragments, the reply is only as big as the hop
+        # it goes back through reads: user_c forwarded it without
+        # restamping hwire, user_d stamped its own
+        for hid, addr, hwire, count in (
+                (1, ('10.0.0.3', PORT), [WIRE_VERSION, 3], OLD_PULL_LIMIT),
+                (2, ('10.0.0.4', PORT), [WIRE_VERSION, 2], 100)):
+            headers = {'hto': 'user_b', 'hfrom': 'user_a', 'hid': hid,
+                       'htype': 'req', 'httl': 2, 'hwire': hwire}
+            request = {'headers': headers, 'query': query}
+            sender = UDPSender(MockSocket(), dest=addr)
+            self.assertTrue(router.should_process(request, sender))
+            result = store.process(request, router.hop_wire(sender))
+            self.assertEqual(len(result['posts']), count)
+
+        # requests from this node are not clamped
+        self.assertEqual(router.hop_wire(Sender()), None)
+        store.close()
+
+    def test_coalesce(self):
+        addr_a = ('10.0.0.1', PORT)
+        sock = MockSocket()
+        router = LitterRouter(sock, self.intfs, 'user_b',
+            coalescer=Coalescer(window=60))
+        sender = UDPSender(self.sock, dest=addr_a)
+
+        for hid in range(3):
+            headers = {'hto': 'user_b', 'hfrom': 'user_a', 'hid': hid,
+                       'htype': 'req', 'httl': 2, 'hwire': [WIRE_VERSION, 2]}
+            router.should_process({'headers': headers}, sender)
+            reply = {'headers': {'hto': 'user_a', 'hfrom': 'user_b',
+                     'hid': hid, 'htype': 'rep', 'httl': 4}, 'posts': []}
+            router.send(reply, sender, urgent=hid == 2)
+
+        # the replies wait for each other until the urgent one
+        self.assertEqual(len(sock.sent), 1)
+        data, dest = sock.sent[0]
+        self.assertEqual((data[0], dest), (BMAGIC, addr_a))
+        self.assertEqual([router.decode(packet)['headers']['hid']
+                          for packet in unbatch(data)], [0, 1, 2])
+        self.assertEqual(router.stats()['coalesce']['saved'], 2)
+        self.assertEqual(router.flush(), None)
+
+    def test_peers(self):
+        sock = MockSocket()
+        router = LitterRouter(sock, self.intfs, 'user_b')
+        addrs = [('10.0.0.%d' % i, PORT) for i in range(1, 4)]
+        for i, addr in enumerate(addrs):
+            headers = {'hto': 'user_b', 'hfrom': 'user_%d' % i, 'hid': i,
+                       'htype': 'req', 'httl': 2}
+            router.should_process({'headers': headers},
+                UDPSender(self.sock, dest=addr))
+
+        request = {'headers': {'hto': 'any', 'hfrom': 'user_b', 'hid': 10,
+                   'htype': 'req', 'httl': 5}}
+        router.send(request)
+        self.assertTrue(sock.sent[-1][1] in addrs)
+        self.assertEqual(router.stats()['peers']['pending'], 1)
+
+        reply = {'headers': {'hto': 'user_b', 'hfrom': 'user_x', 'hid': 10,
+                 'htype': 'rep', 'httl': 3}}
+        router.should_process(reply, UDPSender(self.sock, dest=addrs[0]))
+        stats = router.stats()['peers']
+        self.assertEqual((stats['pending'], stats['replies']), (0, 1))
+
+    def test_fanout(self):
+        sock = MockSocket()
+        router = LitterRouter(sock, self.intfs, 'user_b')
+        push = {'posts': [], 'headers': {'hto': 'any', 'hfrom': 'user_b',
+                'hid': 10, 'htype': 'req', 'httl': 1, 'hfan': 3}}
+
+        # nobody known yet, the push goes to the segment
+        router.send(push)
+        self.assertTrue(all(dest == (MCAST_ADDR, PORT)
+            for data, dest in sock.sent))
+
+        addrs = [('10.0.0.%d' % i, PORT) for i in range(1, 6)]
+        for i, addr in enumerate(addrs):
+            headers = {'hto': 'user_b', 'hfrom': 'user_%d' % i, 'hid': i,
+                       'htype': 'req', 'httl': 2}
+            router.should_process({'headers': headers},
+                UDPSender(self.sock, dest=addr))
+
+        # distinct peers other than the previous hop, no reply awaited
+        del sock.sent[:]
+        push['headers'].update({'hid': 11, 'httl': 1})
+        router.send(push, UDPSender(self.sock, dest=addrs[0]))
+        dests = [dest for data, dest in sock.sent]
+        self.assertEqual(len(set(dests)), 3)
+        self.assertTrue(set(dests) <= set(addrs[1:]))
+        self.assertEqual(router.stats()['peers']['pending'], 0)
+
+    def test_bounded(self):
+        router = LitterRouter(self.sock, self.intfs, 'user_a',
+            route_capacity=2, request_capacity=10)
+
+        for i in range(100):
+            headers = {'hto': 'all', 'hfrom': 'user%d' % i, 'hid': i,
+                       'htype': 'req', 'httl': 1}
+            sender = UDPSender(self.sock, dest=('10.0.0.%d' % (i % 5), PORT))
+            router.send({'headers': headers}, sender)
+
+        stats = router.stats()
+        self.assertEqual(stats['requests']['size'], 10)
+        self.assertEqual(stats['requests']['evicted'], 90)
+        self.assertEqual(stats['addrs']['size'], 2)
+        self.assertEqual(stats['uids']['evicted'], 98)
         
 
 if __name__ == '__main__':
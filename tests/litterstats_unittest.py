@@ -0,0 +1,60 @@
+#!/usr/bin/env python
+
+import logging
+import unittest
+from litterstats import *
+
+class Handler(logging.Handler):
+
+    def __init__(self):
+        logging.Handler.__init__(self)
+        self.messages = []
+
+    def emit(self, record):
+        self.messages.append(record.getMessage())
+
+
+class QueryStatsTest(unittest.TestCase):
+
+    def test_normalize(self):
+        self.assertEqual(normalize("SELECT sig FROM posts\n    WHERE sig IN "
+            "(?, ?, ?)"), "SELECT sig FROM posts WHERE sig IN (?, ...)")
+        self.assertEqual(normalize("PRAGMA incremental_vacuum(1000)"),
+            "PRAGMA incremental_vacuum(N)")
+
+    def test(self):
+        stats = QueryStats()
+        stats.record("SELECT ? IN (?, ?)", 0.0002, 3)
+        stats.record("SELECT ? IN (?, ?, ?)", 0.002, 1)
+        stats.record("DELETE FROM pull", 0.00001, 0)
+
+        report = stats.report()
+        first, second = report['queries']
+        self.assertEqual(first['sql'], "SELECT ? IN (?, ...)")
+        self.assertEqual((first['calls'], first['rows']), (2, 4))
+        self.assertAlmostEqual(first['max'], 2.0)
+        self.assertEqual(sum(first['histogram']), 2)
+        self.assertEqual(first['histogram'][BUCKETS.index(0.25)], 1)
+        self.assertEqual(first['histogram'][BUCKETS.index(2.5)], 1)
+        self.assertEqual(second['histogram'][0], 1)
+
+        stats.clear()
+        self.assertEqual(stats.report()['queries'], [])
+
+    def test_slow(self):
+        handler = Handler()
+        logging.getLogger().addHandler(handler)
+        try:
+            stats = QueryStats(slow=0.1)
+            stats.record("SELECT 1", 0.05, 1)
+            stats.record("SELECT 2", 0.2, 1, ('param',))
+        finally:
+            logging.getLogger().removeHandler(handler)
+
+        self.assertEqual(len(handler.messages), 1)
+        self.assertTrue("SELECT 2" in handler.messages[0])
+        self.assertTrue("200.0 ms" in handler.messages[0])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,14 +1,24 @@
 #!/usr/bin/env python
 
+import os
+import shutil
+import sqlite3
+import tempfile
+import threading
+import time
 import unittest
 from litterstore import *
+from littersync import SYNC_BRANCH
+from litterstats import QueryStats
 
 class LitterUnit(unittest.TestCase):
     """Unit test for litter store in double user case"""
 
+    engine = 'sqlite'
+
     def setUp(self):
-        self.litter_a = LitterStore("usera", test=True)
-        self.litter_b = LitterStore("userb", test=True)
+        self.litter_a = LitterStore("usera", test=True, engine=self.engine)
+        self.litter_b = LitterStore("userb", test=True, engine=self.engine)
 
     def tearDown(self):
         self.litter_a.close()
@@ -28,7 +38,8 @@ class LitterUnit(unittest.TestCase):
         request['posts'].append(('this is my first post',))
         request['posts'].append(('this is my second post',))
         result = self.litter_a.process(request)
-        self.assertEqual(result, {'headers':None})
+        self.assertEqual(result, {'headers':None,
+            'ingest':{'new':2, 'dup':0}})
 
         request = {'m':'gen_push'}
         result = self.litter_a.process(request)
@@ -48,14 +59,620 @@ class LitterUnit(unittest.TestCase):
         self.assertEqual(result['headers']['httl'], 4)
 
         result = self.litter_b.process(result)
-        self.assertEqual(result, {'headers':None})
+        self.assertEqual(result, {'headers':None,
+            'ingest':{'new':2, 'dup':0}})
 
         request = {'m':'get','begin':0,'limit':10}
         result = self.litter_b.process(request)
         self.assertEqual(result['headers'], None)
-        self.assertEqual(len(result['posts']),1)
+        self.assertEqual(len(result['posts']),2)
         self.assertEqual(result['posts'][0][1],'usera')
 
+    def test_push(self):
+        result = self.litter_a.process({'m':'gen_push',
+            'posts':[{'msg':'news'}, {'msg':'secret', 'perms':0}]})
+        self.assertEqual([post[0] for post in result['posts']], ['news'])
+        self.assertEqual(result['push'], PUSH_HOPS)
+        self.assertEqual(result['headers']['hto'], 'any')
+        self.assertEqual(result['headers']['hfan'], PUSH_FANOUT)
+        self.assertEqual(result['headers']['httl'], 1)
+
+        # private posts are not pushed
+        result = self.litter_a.process({'m':'gen_push',
+            'posts':[{'msg':'secret', 'perms':0}]})
+        self.assertEqual((result['posts'], result['headers']), ([], None))
+
+        # a node that did not have the post pushes it on, once
+        push = self.litter_a.process({'m':'gen_push',
+            'posts':[{'msg':'more news'}]})
+        result = self.litter_b.process(push)
+        self.assertEqual(result['ingest'], {'new':1, 'dup':0})
+        self.assertEqual(result['push'], PUSH_HOPS - 1)
+        self.assertEqual(result['headers']['hfrom'], 'userb')
+        self.assertNotEqual(result['headers']['hid'], push['headers']['hid'])
+        self.assertEqual([post[6] for post in result['posts']],
+            [post[6] for post in push['posts']])
+
+        result = self.litter_b.process(push)
+        self.assertEqual((result['ingest']['new'], result['headers']),
+            (0, None))
+
+        # and not past the last hop
+        push = self.litter_a.process({'m':'gen_push',
+            'posts':[{'msg':'last news'}]})
+        push['push'] = 1
+        result = self.litter_b.process(push)
+        self.assertEqual((result['ingest']['new'], result['headers']),
+            (1, None))
+
+    def test_ingest(self):
+        request = {'posts':[['post %d' % i] for i in range(5)]}
+        request['posts'].append(['x' * 141])
+        result = self.litter_a.process(request)
+        self.assertEqual(result['ingest'], {'new':5, 'dup':0})
+
+        # replaying a batch only reports duplicates
+        posts = self.litter_a.process({'m':'get', 'limit':10})['posts']
+        result = self.litter_b.process({'posts':posts})
+        self.assertEqual(result['ingest'], {'new':5, 'dup':0})
+        result = self.litter_b.process({'posts':posts[:3]})
+        self.assertEqual(result['ingest'], {'new':0, 'dup':3})
+
+        # watermark for usera is the newest txtime of the batch
+        result = self.litter_b.process({'m':'gen_pull'})
+        friends = dict(result['query']['friends'])
+        self.assertEqual(friends['usera'], posts[0][2])
+
+    def test_filter(self):
+        posts = [['post %d' % i, 'userc', i, i, i, 1, 'sig%d' % i]
+                 for i in range(1, 11)]
+        self.litter_a.process({'posts':posts[:6]})
+
+        # a replayed batch is dropped before the engine writes anything
+        result = self.litter_a.process({'posts':posts[:6]})
+        self.assertEqual(result['ingest'], {'new':0, 'dup':6})
+        # and the stored posts of a mixed batch too
+        result = self.litter_a.process({'posts':posts})
+        self.assertEqual(result['ingest'], {'new':4, 'dup':6})
+        stats = self.litter_a.process({'m':'stats'})['filter']
+        self.assertEqual((stats['count'], stats['skipped']), (10, 12))
+
+        # a store without the filter gives the same answer
+        litter = LitterStore("userd", test=True, engine=self.engine,
+            filter_capacity=None)
+        litter.process({'posts':posts[:6]})
+        result = litter.process({'posts':posts[:6]})
+        self.assertEqual(result['ingest'], {'new':0, 'dup':6})
+        result = litter.process({'posts':posts})
+        self.assertEqual(result['ingest'], {'new':4, 'dup':6})
+        self.assertEqual(litter.process({'m':'stats'})['filter'], None)
+        litter.close()
+
+    def test_queries(self):
+        self.assertEqual(self.litter_a.process({'m':'queries'})['queries'],
+            None)
+
+        stats = QueryStats()
+        litter = LitterStore("userd", test=True, engine=self.engine,
+            stats=stats)
+        litter.process({'posts':[['first'], ['second']]})
+        litter.process({'m':'gen_pull'})
+
+        result = litter.process({'m':'queries'})['queries']
+        self.assertEqual(result['slow'], None)
+        calls = sum(query['calls'] for query in result['queries'])
+        self.assertTrue(calls > 0)
+        self.assertTrue(all(sum(query['histogram']) == query['calls']
+            for query in result['queries']))
+        litter.close()
+
+    def test_pull(self):
+        posts = [['post %d' % i, 'user%s' % 'cd'[i % 2], i, i, i / 2 + 1, 1,
+                  'sig%d' % i] for i in range(1, 41)]
+        self.litter_a.process({'posts':posts})
+
+        # oldest first across friends, capped at PULL_LIMIT
+        query = {'m':'pull', 'uid':'userb',
+                 'friends':[['userc', 10], ['userd', 30], ['usere', 0]]}
+        result = self.litter_a.process({'query':query,
+            'headers':{'hfrom':'userb', 'hid':1, 'htype':'req'}})
+        txtimes = [post[2] for post in result['posts']]
+        self.assertEqual(txtimes,
+            sorted(range(12, 41, 2) + range(31, 41, 2))[:PULL_LIMIT])
+
+    def test_gaps(self):
+        posts = [['post %d' % postid, 'userc', postid, postid, postid, 1,
+                  'sig%d' % postid] for postid in (2, 3, 5, 6, 9)]
+        self.litter_a.process({'posts':posts[:2]})
+        self.litter_a.process({'posts':posts[4:]})
+
+        request = self.litter_a.process({'m':'gen_gap'})['query']
+        self.assertEqual(request['friends'], {'userc': [(0, 2), (3, 9)]})
+
+        # filling the middle of a gap splits it
+        self.litter_a.process({'posts':posts[2:4]})
+        request = self.litter_a.process({'m':'gen_gap'})['query']
+        self.assertEqual(request['friends'],
+            {'userc': [(0, 2), (3, 5), (6, 9)]})
+
+        # the gap reply only carries the missing posts
+        self.litter_b.process({'posts':posts + [['post 1', 'userc', 1, 1, 1,
+            1, 'sig1']]})
+        result = self.litter_b.process({'query':request,
+            'headers':{'hfrom':'usera', 'hid':1, 'htype':'req'}})
+        self.assertEqual(sorted(post[4] for post in result['posts']), [1])
+
+        self.litter_a.process({'posts':result['posts']})
+        request = self.litter_a.process({'m':'gen_gap'})['query']
+        self.assertEqual(request['friends'], {'userc': [(3, 5), (6, 9)]})
+
+    def test_sync(self):
+        posts = [['post %d' % i, 'user%s' % uid, i, i, i, 1, 'sig%s%d' % (uid,
+                  i)] for uid in 'cd' for i in range(1, 201)]
+        self.litter_b.process({'posts':posts})
+        self.litter_a.process({'posts':[post for post in posts
+            if post[2] % 7 != 0]})
+
+        # rounds only carry the ranges that still differ
+        request = self.litter_a.process({'m':'gen_sync'})
+        self.assertEqual(request['headers']['hto'], 'any')
+        self.assertEqual(len(request['query']['ranges']), 1)
+
+        fetched = []
+        for rounds in range(10):
+            self.assertEqual(request['query']['m'], 'sync')
+            result = self.litter_b.process(request)
+            self.assertEqual(result['headers']['hto'], 'usera')
+            self.assertTrue(len(result['sync']['ranges']) <= SYNC_BRANCH *
+                len(request['query']['ranges']))
+            fetched.extend(post[2] for post in result['posts'])
+
+            request = self.litter_a.process(result)
+            if 'query' not in request:
+                break
+            self.assertEqual(request['headers']['hto'], 'userb')
+        self.assertEqual(rounds, 1)
+        self.assertEqual(sorted(fetched), sorted(2 * range(7, 201, 7)))
+
+        # once in sync the first digest settles it
+        result = self.litter_b.process(self.litter_a.process(
+            {'m':'gen_sync'}))
+        self.assertEqual((result['posts'], result['sync']['ranges']),
+            ([], []))
+
+    def test_sync_private(self):
+        # more runs than a leaf lists, so digests are compared
+        posts = [['post %d' % i, 'user%02d' % uid, i, i, i, 1, 'sig%d-%d' % (
+                  uid, i)] for uid in range(40) for i in range(1, 4)]
+        self.litter_b.process({'posts':posts + [['mine'],
+            {'msg':'secret', 'perms':0}, ['mine again']]})
+
+        request = self.litter_a.process({'m':'gen_sync'})
+        while 'query' in request:
+            request = self.litter_a.process(self.litter_b.process(request))
+
+        # the private post is never sent, nor part of the digests
+        result = self.litter_b.process(self.litter_a.process(
+            {'m':'gen_sync'}))
+        self.assertEqual((result['posts'], result['sync']['ranges']),
+            ([], []))
+        self.assertEqual(len(self.litter_a.process({'m':'get',
+            'limit':200})['posts']), 122)
+
+    def test_page(self):
+        # posts sharing a txtime are ordered by sig across pages
+        posts = [['post %d' % i, 'userc', i / 2 + 1, i / 2 + 1, i + 1, 1,
+                  'sig%02d' % i] for i in range(25)]
+        self.litter_a.process({'posts':posts})
+
+        sigs = []
+        request = {'m':'get', 'limit':10}
+        while True:
+            result = self.litter_a.process(request)
+            sigs.extend(post[6] for post in result['posts'])
+            if result['cursor'] == None:
+                break
+            request['cursor'] = result['cursor']
+        self.assertEqual(sigs, ['sig%02d' % i for i in range(24, -1, -1)])
+
+        # a time range with a cursor stays inside the range
+        result = self.litter_a.process({'m':'get', 'limit':3, 'begin':5,
+            'until':9})
+        self.assertEqual([post[2] for post in result['posts']], [8, 8, 7])
+        result = self.litter_a.process({'m':'get', 'limit':3, 'begin':5,
+            'cursor':result['cursor']})
+        self.assertEqual([post[2] for post in result['posts']], [7, 6, 6])
+        self.assertNotEqual(result['cursor'], None)
+        result = self.litter_a.process({'m':'get', 'limit':3, 'begin':5,
+            'cursor':result['cursor']})
+        self.assertEqual(result['posts'], [])
+        self.assertEqual(result['cursor'], None)
+
+        self.assertRaises(StoreError, self.litter_a.process,
+            {'m':'get', 'limit':3, 'cursor':'bogus'})
+
+    def test_cache(self):
+        self.litter_a.process({'posts':[['<b>first</b>'], ['second']]})
+        first = self.litter_a.process({'m':'get', 'limit':2})['posts']
+        self.assertEqual(first[1][0], '&lt;b&gt;first&lt;/b&gt;')
+
+        # the write after the fill goes straight into the cache
+        self.litter_a.process({'posts':[['third']]})
+        result = self.litter_a.process({'m':'get', 'limit':3})
+        self.assertEqual([post[0] for post in result['posts']],
+            ['third', 'second', '&lt;b&gt;first&lt;/b&gt;'])
+
+        stats = self.litter_a.process({'m':'stats'})['cache']
+        self.assertEqual((stats['hits'], stats['misses']), (1, 1))
+
+        # a large limit or a time range goes to the database
+        self.litter_a.process({'m':'get', 'limit':1000})
+        stats = self.litter_a.process({'m':'stats'})['cache']
+        self.assertEqual((stats['hits'], stats['misses']), (1, 1))
+
+        # no posts for no limit, whether the ring is filled or not
+        for limit in (0, -1, 0, -2):
+            self.assertEqual(self.litter_a.process({'m':'get',
+                'limit':limit})['posts'], [])
+
+
+class LogLitterUnit(LitterUnit):
+    """Same as LitterUnit over the append-only log"""
+
+    engine = 'log'
+
+
+class ShardedLitterUnit(LitterUnit):
+    """Same as LitterUnit over sqlite files split by author"""
+
+    engine = 'sharded'
+
+
+class RetentionTest(unittest.TestCase):
+    """Archives other authors' posts past the configured limits"""
+
+    engine = 'sqlite'
+
+    def posts(self, uid, postids, txtime=0):
+        return [['post %d' % postid, uid, txtime + postid, txtime + postid,
+                 postid, 1, '%s%d' % (uid, postid)] for postid in postids]
+
+    def test_count(self):
+        litter = LitterStore("usera", test=True, max_posts=3,
+            engine=self.engine)
+        litter.process({'posts':[['mine %d' % i] for i in range(5)]})
+        litter.process({'posts':self.posts('userc', [1] + range(3, 11))})
+
+        result = litter.process({'m':'gen_gap'})
+        self.assertEqual(result['query']['friends'], {'userc': [(1, 3)]})
+
+        result = litter.process({'m':'compact'})
+        self.assertEqual(result['compact']['archived'], 6)
+
+        result = litter.process({'m':'get', 'limit':100})
+        self.assertEqual(len(result['posts']), 8)
+
+        # the gap is behind the horizon, peers are not asked to refill it
+        result = litter.process({'m':'gen_gap'})
+        self.assertEqual(result['query'], [])
+
+        result = litter.process({'m':'archive', 'uid':'userc', 'limit':4})
+        self.assertEqual([post[2] for post in result['posts']], [7, 6, 5, 4])
+        result = litter.process({'m':'archive', 'begin':3, 'until':5})
+        self.assertEqual([post[2] for post in result['posts']], [4])
+        litter.close()
+
+    def test_age(self):
+        now = time.time()
+        litter = LitterStore("usera", test=True, max_age=100,
+            engine=self.engine)
+        litter.process({'posts':self.posts('userc', range(1, 4), now - 1000)})
+        litter.process({'posts':self.posts('userd', [5], now - 50)})
+
+        result = litter.process({'m':'compact'})
+        self.assertEqual(result['compact']['archived'], 3)
+
+        # the missing start of userd is only asked for back to the horizon
+        result = litter.process({'m':'gen_gap'})
+        gaps = result['query']['friends']
+        self.assertEqual(gaps.keys(), ['userd'])
+        self.assertTrue(now - 101 < gaps['userd'][0][0] < now - 99)
+        litter.close()
+
+    def test_size(self):
+        litter = LitterStore("usera", test=True, max_bytes=1,
+            engine=self.engine)
+        litter.process({'posts':[['mine']]})
+        litter.process({'posts':self.posts('userc', range(1, 1001))})
+
+        result = litter.process({'m':'compact'})
+        self.assertEqual(result['compact']['archived'], 1000)
+        self.assertTrue(result['compact']['freed'] > 0)
+
+        result = litter.process({'m':'get', 'limit':10})
+        self.assertEqual([post[0] for post in result['posts']], ['mine'])
+        result = litter.process({'m':'archive', 'limit':1000})
+        self.assertEqual(len(result['posts']), 1000)
+        litter.close()
+
+
+class LogRetentionTest(RetentionTest):
+    """Same as RetentionTest over the append-only log"""
+
+    engine = 'log'
+
+
+class ShardedRetentionTest(RetentionTest):
+    """Same as RetentionTest over sqlite files split by author"""
+
+    engine = 'sharded'
+
+
+class SearchTest(unittest.TestCase):
+    """Full-text search over the posts kept in sqlite"""
+
+    def setUp(self):
+        self.litter = LitterStore("usera", test=True, max_posts=2)
+        self.litter.process({'posts':[['red <fox> jumps'], ['lazy dog'],
+            ['the red dog']]})
+        self.litter.process({'posts':[['red %s' % word, 'userc', txtime,
+            txtime, txtime, 1, 'sig%d' % txtime] for txtime, word in
+            ((1, 'apple'), (2, 'fox fox'), (3, 'dog'))]})
+
+    def tearDown(self):
+        self.litter.close()
+
+    def search(self, **request):
+        request['m'] = 'search'
+        return [post[0] for post in self.litter.process(request)['posts']]
+
+    def test(self):
+        self.assertEqual(len(self.search(text='red', limit=10)), 5)
+        self.assertEqual(self.search(text='fox', limit=1), ['red fox fox'])
+        self.assertEqual(self.search(text='RED dog', uid='userc'),
+            ['red dog'])
+        self.assertEqual(self.search(text='red', uid='userc', order='time',
+            begin=1, until=3), ['red fox fox'])
+        # words are matched as words, never as query syntax
+        self.assertEqual(self.search(text='"fox" OR'), [])
+        self.assertRaises(StoreError, self.search, text='  ')
+
+        # archived posts leave the index
+        self.litter.process({'m':'compact'})
+        self.assertEqual(self.search(text='apple'), [])
+        self.assertEqual(self.search(text='red', uid='userc'),
+            ['red dog', 'red fox fox'])
+
+
+class QueryPlanTest(unittest.TestCase):
+    """Fails if a hot query goes back to a full table scan or a sort"""
+
+    def setUp(self):
+        self.litter = LitterStore("usera", test=True)
+
+    def tearDown(self):
+        self.litter.close()
+
+    def assertIndexed(self, action, params, scan=None, sort=False):
+        """scan names the one table allowed a full scan, sort allows a
+           temp b-tree for ORDER BY, virtual tables use their own index"""
+
+        for detail in self.litter.explain(action, params):
+            self.assertFalse(detail.startswith('SCAN') and 'USING' not in
+                detail and 'VIRTUAL TABLE INDEX' not in detail and
+                detail != 'SCAN ' + str(scan),
+                "%s -- %s" % (detail, action))
+            self.assertFalse('TEMP B-TREE' in detail and not sort,
+                "%s -- %s" % (detail, action))
+
+    def test(self):
+        self.assertIndexed(GET_ALL_SQL % DISPLAY_COLUMNS,
+            (0, 10, 10, None, 10))
+        self.assertIndexed(GET_ALL_SQL % DISPLAY_COLUMNS,
+            (0, 10, 10, 'sig', 10))
+        self.assertIndexed(GET_UID_SQL % POST_COLUMNS,
+            ('userb', 1, 0, 10, 10, 'sig', 10))
+        self.assertIndexed(RANGES_SQL, ('usera',))
+        self.assertIndexed(TOUCHING_RANGES_SQL, ('userb', 10))
+        self.assertIndexed(FRIENDS_SQL, ('usera',))
+
+        # the watermark table is walked once, posts are searched per fid
+        self.assertIndexed(PULL_SQL, (10,), scan='pull', sort=True)
+        self.assertIndexed(PULL_WATERMARK_SQL, ('userb', 'userb'),
+            scan='pull')
+
+        # bm25 order comes out of the fts index, newest first is sorted
+        self.assertIndexed(SEARCH_SQL % (DISPLAY_COLUMNS,
+            SEARCH_ORDERS['rank']), ('red', None, None, 0, 10, 10))
+        self.assertIndexed(SEARCH_SQL % (DISPLAY_COLUMNS,
+            SEARCH_ORDERS['time']), ('red', None, None, 0, 10, 10),
+            sort=True)
+
+
+class MigrationTest(unittest.TestCase):
+    """Opens a database created before the indexes existed"""
+
+    def setUp(self):
+        self.cwd = os.getcwd()
+        self.tmpdir = tempfile.mkdtemp()
+        os.chdir(self.tmpdir)
+
+    def tearDown(self):
+        os.chdir(self.cwd)
+        shutil.rmtree(self.tmpdir)
+
+    def test(self):
+        con = sqlite3.connect("usera.db")
+        con.execute("CREATE TABLE posts (uid TEXT, postid INTEGER, msg TEXT, "
+            "txtime NUM, rxtime NUM, perms NUM, sig TEXT, "
+            "PRIMARY KEY(sig ASC))")
+        con.execute("CREATE TABLE friends (uid TEXT, fid TEXT, txtime NUM, "
+            "PRIMARY KEY(uid, fid))")
+        con.executemany("INSERT INTO posts VALUES (?, ?, ?, ?, ?, ?, ?)",
+            [('userb', postid, 'old <post>', postid, postid, 1,
+              'sig%d' % postid) for postid in (2, 3, 5, 9)])
+        con.execute("INSERT INTO friends VALUES ('usera', 'userb', 9)")
+        con.commit()
+        con.close()
+
+        litter = LitterStore("usera")
+        plan = litter.explain(GET_ALL_SQL % DISPLAY_COLUMNS,
+            (0, 10, 10, None, 10))
+        self.assertTrue('posts_txtime_sig' in plan[0])
+
+        # gaps come from the ranges built out of the old posts
+        result = litter.process({'m':'gen_gap'})
+        self.assertEqual(result['query']['friends'],
+            {'userb': [(0, 2), (3, 5), (5, 9)]})
+
+        # escaped once for the browser, raw for peers
+        result = litter.process({'m':'get', 'limit':1})
+        self.assertEqual(result['posts'][0][0], 'old &lt;post&gt;')
+        result = litter.process({'query':{'m':'pull', 'uid':'userc',
+            'friends':[['userb', 8]]}})
+        self.assertEqual(result['posts'][0][0], 'old <post>')
+
+        # old posts are in the search index
+        result = litter.process({'m':'search', 'text':'post'})
+        self.assertEqual(len(result['posts']), 4)
+        litter.close()
+
+        # the sig filter is built from the db once, then read from its file
+        litter = LitterStore("usera")
+        self.assertTrue(os.path.isfile("usera.filter"))
+        result = litter.process({'m':'stats'})
+        self.assertEqual(result['filter']['count'], 4)
+        litter.close()
+
+        con = sqlite3.connect("usera.db")
+        version = con.execute("PRAGMA user_version").fetchone()[0]
+        names = [row[0] for row in con.execute("SELECT name FROM "
+            "sqlite_master WHERE type == 'index' and sql IS NOT NULL")]
+        con.close()
+
+        self.assertEqual(version, SCHEMA_VERSION)
+        self.assertEqual(len(names), 3)
+
+    def test_no_fts(self):
+        litter = LitterStore("usera")
+        litter.process({'posts':[['first']]})
+        litter.close()
+
+        # what a sqlite without FTS5 sees of the index
+        con = sqlite3.connect("usera.db")
+        con.execute("DROP TABLE posts_fts")
+        con.execute("PRAGMA writable_schema = ON")
+        con.execute("INSERT INTO sqlite_master VALUES ('table', 'posts_fts', "
+            "'posts_fts', 0, 'CREATE VIRTUAL TABLE posts_fts USING "
+            "nofts(msg)')")
+        con.execute("PRAGMA user_version = 4")
+        con.commit()
+        con.close()
+
+        # everything but search still works
+        litter = LitterStore("usera")
+        litter.process({'posts':[['second']]})
+        result = litter.process({'m':'get', 'limit':10})
+        self.assertEqual([post[0] for post in result['posts']],
+            ['second', 'first'])
+        self.assertRaises(StoreError, litter.process,
+            {'m':'search', 'text':'first'})
+        litter.close()
+
+        con = sqlite3.connect("usera.db")
+        version = con.execute("PRAGMA user_version").fetchone()[0]
+        con.close()
+        self.assertEqual(version, 4)
+
+
+class StorePoolTest(unittest.TestCase):
+    """Reads through the pool while the writer holds the db open"""
+
+    def setUp(self):
+        self.cwd = os.getcwd()
+        self.tmpdir = tempfile.mkdtemp()
+        os.chdir(self.tmpdir)
+        self.litter = LitterStore("usera")
+        self.pool = StorePool("usera", size=2)
+
+    def tearDown(self):
+        self.pool.close()
+        self.litter.close()
+        os.chdir(self.cwd)
+        shutil.rmtree(self.tmpdir)
+
+    def test(self):
+        con = sqlite3.connect("usera.db")
+        mode = con.execute("PRAGMA journal_mode").fetchone()[0]
+        con.close()
+        self.assertEqual(mode, 'wal')
+
+        self.litter.process({'posts':[['first'], ['second']]})
+        result = self.pool.process({'m':'get', 'limit':10})
+        self.assertEqual([post[0] for post in result['posts']],
+            ['second', 'first'])
+        self.assertEqual(result['headers'], None)
+
+        # without a cache either
+        for limit in (0, -1):
+            self.assertEqual(self.pool.process({'m':'get',
+                'limit':limit})['posts'], [])
+
+        self.assertRaises(StoreError, self.pool.process, {'m':'gen_pull'})
+        self.assertRaises(StoreError, LitterStore, "usera", test=True,
+            readonly=True)
+        self.assertRaises(StoreError, self.pool.process,
+            {'m':'get', 'limit':1, 'posts':[['sneaky']]})
+
+    def test_stats(self):
+        # the filter of the writer is shared with the readers
+        bloom = BloomFilter("userb.filter", capacity=1000)
+        litter = LitterStore("userb", bloom=bloom)
+        pool = StorePool("userb", size=1, bloom=bloom)
+        try:
+            posts = [['post %d' % i, 'userc', i, i, i, 1, 'sig%d' % i]
+                     for i in range(1, 4)]
+            litter.process({'posts':posts})
+            litter.process({'posts':posts})
+
+            result = pool.process({'m':'stats'})
+            self.assertNotEqual(result['filter'], None)
+            self.assertEqual((result['filter']['count'],
+                result['filter']['skipped']), (3, 3))
+        finally:
+            pool.close()
+            litter.close()
+
+    def test_close(self):
+        cache = SlowCache()
+        pool = StorePool("usera", size=1, cache=cache)
+        reader = threading.Thread(target=pool.process, args=({'m':'stats'},))
+        reader.start()
+        self.assertTrue(cache.entered.wait(10))
+
+        # a store still in use does not hold up close
+        begin = time.time()
+        pool.close()
+        self.assertTrue(time.time() - begin < 1)
+        self.assertRaises(StoreError, pool.process, {'m':'get', 'limit':1})
+
+        cache.release.set()
+        reader.join(10)
+        self.assertFalse(reader.is_alive())
+
+
+class SlowCache:
+    """Holds a stats request until released"""
+
+    def __init__(self):
+        self.entered = threading.Event()
+        self.release = threading.Event()
+
+    def stats(self):
+        self.entered.set()
+        self.release.wait(10)
+        return {}
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,81 @@
+#!/usr/bin/env python
+
+import unittest
+from littersync import *
+
+class DigestTreeTest(unittest.TestCase):
+
+    def test(self):
+        tree = DigestTree([('userc', 1, 100), ('userd', 3, 4)])
+        other = DigestTree([('userc', 1, 49), ('userc', 51, 100),
+            ('userd', 3, 4)])
+
+        # few runs are listed, whatever the number of postids
+        self.assertEqual(tree.summary(), [None, None,
+            [['userc', 1, 100], ['userd', 3, 4]]])
+        self.assertEqual(key_runs(other.keys_in(['userc', 40],
+            ['userc', 60])), [['userc', 40, 49], ['userc', 51, 59]])
+
+        # the digest of a range only depends on the keys it holds
+        tree = DigestTree([('user%02d' % i, 1, 100) for i in range(20)])
+        digest = tree.summary()
+        self.assertEqual(digest[2], 2000)
+        self.assertFalse(tree.differs(digest))
+        self.assertTrue(DigestTree([('user%02d' % i, 1, 100 - (i == 7))
+            for i in range(20)]).differs(digest))
+
+        # parts hold as many keys and cover the range
+        parts = tree.split(None, None)
+        self.assertEqual(len(parts), SYNC_BRANCH)
+        self.assertEqual(sum(len(list(run_keys(part[2])))
+            for part in parts), 2000)
+        self.assertEqual([part[0] for part in parts[1:]],
+            [part[1] for part in parts[:-1]])
+
+    def test_add(self):
+        tree = DigestTree([('userc', 1, 10), ('userc', 12, 20),
+            ('userd', 5, 9)])
+        tree.add([('userc', 11), ('userd', 3), ('usere', 1), ('userc', 5)])
+
+        # the same tree as one built with the keys
+        built = DigestTree([('userc', 1, 20), ('userd', 3, 3),
+            ('userd', 5, 9), ('usere', 1, 1)])
+        self.assertEqual((tree.keys, tree.sums, tree.starts),
+            (built.keys, built.sums, built.starts))
+        self.assertEqual(tree.summary(), built.summary())
+
+    def test_drop_keys(self):
+        self.assertEqual(list(drop_keys([('userc', 1, 10), ('userd', 1, 1),
+            ('usere', 4, 6)], [('userc', 1), ('userc', 5), ('userd', 1),
+            ('usere', 6)])), [('userc', 2, 4), ('userc', 6, 10),
+            ('usere', 4, 5)])
+
+    def test_rounds(self):
+        tree = DigestTree([('user%02d' % i, 1, 1000) for i in range(20)])
+        other = DigestTree([('user%02d' % i, 1, 1000) for i in range(3)] +
+            [('user03', 1, 499), ('user03', 501, 700)] +
+            [('user%02d' % i, 1, 1000) for i in range(4, 20)])
+
+        # the parts of the first split are runs already
+        rounds = 0
+        keys, ranges = [], [other.summary()]
+        while len(ranges) > 0:
+            missing, ranges = answer(tree, ranges, 1000)
+            want, ranges = compare(other, ranges, 1000)
+            keys.extend(missing + want)
+            rounds += 1
+        self.assertEqual(keys, [('user03', 500)] +
+            [('user03', postid) for postid in range(701, 1001)])
+        self.assertEqual(rounds, 1)
+
+        # a limit cuts the keys and the ranges after them
+        missing, ranges = answer(tree, [other.summary(['user03', 0],
+            ['user04', 0])], 10)
+        self.assertEqual(len(missing), 11)
+        keys, ranges = clip(tree, missing, ranges, 10)
+        self.assertEqual(keys[-1], ('user03', 709))
+        self.assertEqual(ranges[0][0], ['user03', 710])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,109 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import json
+import zlib
+import unittest
+from litterwire import *
+
+SIG = "0123456789abcdef0123456789abcdef01234567"
+
+class WireTest(unittest.TestCase):
+
+    def test_roundtrip(self):
+        reply = {'headers': {'hto': 'usera', 'hfrom': 'userb', 'hid': 2 ** 47,
+                             'htype': 'rep', 'httl': 4, 'hwire': [1, 3]},
+                 'posts': [[u'caf\xe9 post %d' % i, 'userb', 1.5 + i, 2.25,
+                            i, 1, SIG] for i in range(3)],
+                 'other': [None, True, False, -7, 0.1, '', SIG.upper()]}
+
+        packet = encode(reply)
+        self.assertEqual(packet[0], MAGIC)
+        # same message json would give, every string back as unicode
+        self.assertEqual(decode(packet), json.loads(encode_json(reply)))
+        self.assertTrue(len(packet) < len(encode_json(reply)))
+
+    def test_json(self):
+        self.assertEqual(decode('{"m": "get", "limit": 10}'),
+            {'m': 'get', 'limit': 10})
+
+    def test_compress(self):
+        stats = WireStats()
+        reply = {'posts': [[u'post %d' % i, 'userb', 1.5 + i, 2.25, i, 1, SIG]
+                           for i in range(100)]}
+
+        for packet in (encode(reply), encode_json(reply)):
+            packed = compress(packet, stats)
+            self.assertEqual(packed[0], ZMAGIC)
+            self.assertTrue(len(packed) < len(packet) / 2)
+            self.assertEqual(decode(packed, stats), decode(packet))
+
+        small = encode_json({'m': 'get'})
+        self.assertEqual(compress(small, stats), small)
+        self.assertEqual(stats.compressed, 2)
+        self.assertEqual(stats.inflated, 2)
+        self.assertTrue(stats.stats()['compress_ratio'] < 0.5)
+
+    def test_fragments(self):
+        now = [0]
+        reassembler = Reassembler(timeout=5, max_pending=6 * MTU)
+        reassembler.clock = lambda: now[0]
+        packet = "".join(chr(i % 251) for i in range(5 * MTU))
+
+        pieces = fragment(packet)
+        self.assertTrue(max(len(piece) for piece in pieces) <= MTU)
+        results = [reassembler.add(piece, 'a') for piece in
+                   reversed(pieces)]
+        self.assertEqual(results[:-1], [None] * (len(pieces) - 1))
+        self.assertTrue(results[-1] == packet)
+
+        # a lost fragment, the rest expires
+        small = fragment(packet[:2 * MTU])
+        reassembler.add(small[0], 'a')
+        now[0] = 6
+        reassembler.add(small[1], 'b')
+        self.assertEqual(reassembler.stats()['expired'], 1)
+
+        # past max_pending the oldest messages go, the rest of b then c
+        for piece in pieces[:4]:
+            reassembler.add(piece, 'c')
+        for piece in pieces[:3]:
+            reassembler.add(piece, 'd')
+        stats = reassembler.stats()
+        self.assertEqual((stats['completed'], stats['evicted']), (1, 2))
+
+        self.assertEqual(reassembler.add("junk", 'a'), None)
+        self.assertEqual(reassembler.add(pieces[0], 'd'), None)
+        self.assertEqual(reassembler.stats()['invalid'], 2)
+
+    def test_batch(self):
+        packets = [encode({'m': 'pull'}), encode_json({'m': 'gap'}),
+                   "x" * 300]
+        data = batch(packets)
+        self.assertEqual(data[0], BMAGIC)
+        self.assertTrue(len(data) <= 1 + sum(len(packet) + BATCH_OVERHEAD
+                                             for packet in packets))
+        self.assertEqual(unbatch(data), packets)
+
+        self.assertRaises(WireError, unbatch, data[:-1])
+        self.assertRaises(WireError, unbatch, batch([data]))
+        self.assertRaises(WireError, unbatch, BMAGIC + "\x80")
+
+    def test_errors(self):
+        packet = encode({'posts': [['a post', 'userb', 1.0]]})
+        self.assertRaises(WireError, decode, packet[:-3])
+        self.assertRaises(WireError, decode, packet + "\x00")
+        self.assertRaises(WireError, decode, MAGIC + chr(WIRE_VERSION + 1))
+        self.assertRaises(WireError, encode, {1: 'not a string key'})
+        self.assertRaises(WireError, encode, {'set': set()})
+
+        # inflating past MAX_INFLATE, a packet inside a packet, garbage
+        bomb = ZMAGIC + zlib.compress(MAGIC + "\x00" * (MAX_INFLATE + 1))
+        self.assertRaises(WireError, decode, bomb)
+        nested = ZMAGIC + zlib.compress(ZMAGIC + zlib.compress(packet))
+        self.assertRaises(WireError, decode, nested)
+        self.assertRaises(WireError, decode, ZMAGIC + "not deflate")
+
+
+if __name__ == '__main__':
+    unittest.main()
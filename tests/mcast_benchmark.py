@@ -0,0 +1,55 @@
+#!/usr/bin/env python
+"""Multicast send throughput with 1, 2 and 4 interfaces.
+
+The shared socket switches IP_MULTICAST_IF before every sendto, like
+UDPSender did for each interface. Dedicated sockets are opened once per
+interface by MulticastServer.init_senders and only call sendto. Without
+arguments every interface is the loopback address, give the addresses of
+real interfaces to use those.
+
+usage: PYTHONPATH=../src python mcast_benchmark.py [address ...]
+"""
+
+import sys
+import time
+import socket
+import logging
+from litter import MulticastServer
+from litterrouter import UDPSender
+
+PACKETS = 20000
+PACKET = "x" * 300
+COUNTS = (1, 2, 4)
+
+
+def timed(sender):
+    begin = time.time()
+    for i in xrange(PACKETS):
+        sender.send(PACKET)
+    return PACKETS / (time.time() - begin)
+
+
+def main():
+    addrs = sys.argv[1:] or ['127.0.0.1']
+    logging.disable(logging.CRITICAL)
+
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.setsockopt(socket.SOL_IP, socket.IP_MULTICAST_TTL, 1)
+    sock.setsockopt(socket.SOL_IP, socket.IP_MULTICAST_LOOP, 0)
+
+    for count in COUNTS:
+        intfs = [addrs[i % len(addrs)] for i in range(count)]
+        shared = timed(UDPSender(sock, intfs))
+
+        msocks = MulticastServer.init_senders(intfs, port=0)
+        dedicated = timed(UDPSender(sock, intfs, msocks=msocks))
+        for msock in msocks:
+            msock.close()
+
+        print "%d interfaces  shared %7.0f sends/s  dedicated %7.0f " \
+            "sends/s  %4.2fx" % (count, shared, dedicated,
+            dedicated / shared)
+
+
+if __name__ == '__main__':
+    main()
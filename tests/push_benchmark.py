@@ -0,0 +1,126 @@
+#!/usr/bin/env python
+"""Time for a new post to reach every node of a simulated LAN.
+
+The mesh of flood_benchmark, where every node already follows every other
+one and knows its neighbours from a round of pulls. A node writes a post
+and each node pulls from its neighbours once a minute at a random offset,
+like the timer of litter.py main. The stub push sent the post to the
+segment with httl 2 and left the rest to the pulls. The gossip push sends
+it to PUSH_FANOUT peers that push it on while it is new to them. Latencies
+are from the post to its arrival at each node, over POSTS posts written by
+different nodes.
+
+usage: PYTHONPATH=../src python push_benchmark.py [nodes]
+"""
+
+import sys
+import time
+import random
+import logging
+from litterrouter import Sender, MCAST_ADDR, PORT, SEEN_TTL
+from litterstore import PUSH_FANOUT, HID_BITS
+from flood_benchmark import Mesh
+
+POSTS = 10
+PULL_PERIOD = 60
+
+
+class PushMesh(Mesh):
+    """Mesh that records when a post reaches each node"""
+
+    def __init__(self, size):
+        Mesh.__init__(self, size, SEEN_TTL)
+        self.sig = None
+        self.arrivals = {}
+
+    def handle(self, addr, request, sender):
+        response = Mesh.handle(self, addr, request, sender)
+        if response != None and response.get('ingest', {}).get('new') and \
+            self.sig in [post[6] for post in request['posts']
+            if isinstance(post, list)]:
+            self.arrivals.setdefault(addr, self.now)
+        return response
+
+    def follow_all(self):
+        """Every node has the first post of every other one, and its
+           neighbours in the routing table"""
+
+        posts = []
+        for sock, router, store in self.nodes.values():
+            posts.extend(store.process({'m': 'get', 'limit': 1})['posts'])
+        for sock, router, store in self.nodes.values():
+            store.process({'posts': posts})
+        self.run(('gen_pull',), rounds=1)
+
+    def post(self, addr, stub):
+        """Writes a post on addr, pushed like the stub did or by gossip,
+           then runs the pull timers until every node has it. Returns the
+           arrival times and the datagrams of the push alone."""
+
+        sock, router, store = self.nodes[addr]
+        multicast = Sender()
+        multicast.dest = (MCAST_ADDR, PORT)
+        start = self.now
+
+        if stub:
+            result = store.process({'posts': [{'msg': 'news at %f' %
+                start}]})
+            post = store.process({'m': 'get', 'limit': 1})['posts'][0]
+            router.send({'posts': [post], 'headers': {'hto': 'all',
+                'hfrom': 'node%d' % self.addrs.index(addr), 'hid':
+                random.getrandbits(HID_BITS), 'htype': 'req', 'httl': 2}},
+                multicast)
+        else:
+            response = self.handle(addr, {'m': 'gen_push', 'posts':
+                [{'msg': 'news at %f' % start}]}, multicast)
+            post = response['posts'][0]
+
+        self.sig = post[6]
+        self.arrivals = {}
+        before = self.datagrams
+        self.run(methods=(), rounds=0)
+        pushed = self.datagrams - before
+
+        for target in self.addrs:
+            self.schedule(start + random.uniform(0, PULL_PERIOD),
+                (target, 'gen_pull', None))
+        self.run(methods=(), rounds=0)
+        return [self.arrivals.get(target, None) for target in self.addrs
+            if target != addr], pushed
+
+
+def percentile(values, share):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(share * len(values)))]
+
+
+def main():
+    size = int(sys.argv[1]) if len(sys.argv) > 1 else 50
+    logging.disable(logging.CRITICAL)
+
+    for name, stub in (('stub push', True), ('gossip', False)):
+        mesh = PushMesh(size)
+        mesh.follow_all()
+
+        latencies = []
+        missed = 0
+        datagrams = 0
+        begin = time.time()
+        for i in range(POSTS):
+            start = mesh.now
+            arrivals, pushed = mesh.post(mesh.addrs[i * size / POSTS], stub)
+            datagrams += pushed
+            missed += arrivals.count(None)
+            latencies.extend(at - start for at in arrivals if at != None)
+        spent = time.time() - begin
+
+        within = 100.0 * sum(1 for latency in latencies if latency < 1) / \
+            ((size - 1) * POSTS)
+        print "%-9s %3d nodes  p50 %6.3f s  p90 %6.3f s  max %6.3f s  " \
+            "within 1 s %5.1f%%  missed %2d  push %4d datagrams  %5.2f s" % (
+            name, size, percentile(latencies, 0.5), percentile(latencies,
+            0.9), max(latencies), within, missed, datagrams / POSTS, spent)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,121 @@
+#!/usr/bin/env python
+"""Latency of 'get' while the store is ingesting gossip.
+
+Runs a writer thread that owns the LitterStore (like WorkerThread) and keeps
+it busy with batches of remote posts, then measures 'get' latency twice:
+queued behind the writer, and answered from a StorePool.
+
+usage: PYTHONPATH=../src python readpool_benchmark.py [seconds] [readers]
+"""
+
+import os
+import sys
+import time
+import shutil
+import tempfile
+import threading
+import Queue
+from litterstore import LitterStore, StorePool
+
+BATCH = 100
+
+
+def make_batch(start):
+    return [['post %d' % i, 'peer%d' % (i % 50), start + i, start + i,
+             i + 1, 1, 'sig%d' % i] for i in range(start, start + BATCH)]
+
+
+class Writer(threading.Thread):
+
+    def __init__(self, queue):
+        threading.Thread.__init__(self)
+        self.queue = queue
+
+    def run(self):
+        store = LitterStore("bench")
+        while True:
+            request, reply = self.queue.get()
+            if request == None:
+                break
+            result = store.process(request)
+            if reply != None:
+                reply.put(result)
+        store.close()
+
+
+def ingest(queue, running):
+    start = 0
+    while running.is_set():
+        queue.put(({'posts': make_batch(start)}, None))
+        start += BATCH
+
+
+def read(get, seconds, latencies):
+    end = time.time() + seconds
+    while time.time() < end:
+        begin = time.time()
+        get({'m': 'get', 'limit': 10})
+        latencies.append(time.time() - begin)
+
+
+def percentile(values, pct):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * pct / 100.0))]
+
+
+def run(mode, seconds, readers):
+    queue = Queue.Queue(100)
+    writer = Writer(queue)
+    writer.start()
+    pool = StorePool("bench", size=readers)
+
+    def worker_get(request):
+        reply = Queue.Queue(1)
+        queue.put((request, reply))
+        return reply.get()
+
+    get = worker_get if mode == 'worker' else pool.process
+    # let the writer create the schema before the pool opens connections
+    worker_get({'m': 'get', 'limit': 1})
+
+    running = threading.Event()
+    running.set()
+    feeder = threading.Thread(target=ingest, args=(queue, running))
+    feeder.start()
+
+    latencies = []
+    threads = [threading.Thread(target=read, args=(get, seconds, latencies))
+               for i in range(readers)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    running.clear()
+    feeder.join()
+    queue.put((None, None))
+    writer.join()
+    pool.close()
+
+    print "%-6s gets %6d  p50 %7.2f ms  p99 %7.2f ms" % (mode,
+        len(latencies), percentile(latencies, 50) * 1000,
+        percentile(latencies, 99) * 1000)
+
+
+def main():
+    seconds = float(sys.argv[1]) if len(sys.argv) > 1 else 5
+    readers = int(sys.argv[2]) if len(sys.argv) > 2 else 2
+    cwd = os.getcwd()
+
+    for mode in ('worker', 'pool'):
+        tmpdir = tempfile.mkdtemp()
+        os.chdir(tmpdir)
+        try:
+            run(mode, seconds, readers)
+        finally:
+            os.chdir(cwd)
+            shutil.rmtree(tmpdir)
+
+
+if __name__ == '__main__':
+    main()
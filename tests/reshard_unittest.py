@@ -0,0 +1,56 @@
+#!/usr/bin/env python
+
+import os
+import shutil
+import tempfile
+import unittest
+from litterengine import SQLiteEngine, ShardedEngine, StoreError
+from reshard import reshard
+
+def row(uid, postid):
+    return (uid, postid, postid, postid, 'post %d' % postid, 1,
+            '%s%d' % (uid, postid), 'post %d' % postid, uid)
+
+
+class ReshardTest(unittest.TestCase):
+    """Splits a single file store and splits the shards again"""
+
+    def setUp(self):
+        self.cwd = os.getcwd()
+        self.tmpdir = tempfile.mkdtemp()
+        os.chdir(self.tmpdir)
+
+    def tearDown(self):
+        os.chdir(self.cwd)
+        shutil.rmtree(self.tmpdir)
+
+    def read(self, engine):
+        # archived posts with the same txtime come in no particular order
+        return (engine.scan(limit=1000), engine.gap_ranges("usera"),
+                engine.horizons(), sorted(engine.watermarks("usera")),
+                sorted(engine.archive_scan(limit=1000)),
+                engine.search("post 7", order='time'))
+
+    def test(self):
+        engine = SQLiteEngine("usera")
+        for uid in ("userb", "userc", "userd", "usere", "userf"):
+            engine.insert("usera", [row(uid, i) for i in (1, 2, 3, 7, 9)])
+        engine.compact("usera", max_posts=3)
+        expect = self.read(engine)
+        engine.close()
+
+        # the single file is left alone until it is converted
+        self.assertRaises(StoreError, ShardedEngine, "usera")
+
+        for shards in (3, 2):
+            reshard("usera", shards)
+            engine = ShardedEngine("usera")
+            self.assertEqual(self.read(engine), expect)
+            engine.close()
+
+        self.assertTrue(os.path.isfile("usera.db"))
+        self.assertTrue(os.path.isfile("usera.3-2.db"))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,102 @@
+#!/usr/bin/env python
+"""Replies to gen_rand_pull with uniform and with scored next hops.
+
+Runs the mesh of flood_benchmark. SLOW of the nodes are behind a link
+SLOW_FACTOR times slower than the others, and after a first round of
+gen_pull that fills the routing tables DEAD of them leave without a word.
+Every node then sends gen_rand_pull each round. For every window of
+WINDOW rounds it reports the share of pulls answered and the mean time to
+the first reply, a pull sent to a departed node is never answered.
+
+usage: PYTHONPATH=../src python rtt_benchmark.py [nodes]
+"""
+
+import sys
+import logging
+import random
+from litterrouter import SEEN_TTL, REPLY_TIMEOUT
+from flood_benchmark import Mesh, LATENCY
+
+SLOW = 0.3
+SLOW_FACTOR = 20
+DEAD = 0.2
+ROUNDS = 60
+WINDOW = 10
+
+
+class RttMesh(Mesh):
+
+    def __init__(self, size, reply_timeout):
+        Mesh.__init__(self, size, SEEN_TTL, reply_timeout=reply_timeout)
+        random.seed(2)
+        others = list(self.addrs)
+        random.shuffle(others)
+        self.dead = set(others[:int(size * DEAD)])
+        self.slow = set(others[int(size * DEAD):int(size * (DEAD + SLOW))])
+        self.departed = False
+
+        self.uids = dict(('node%d' % i, addr)
+                         for i, addr in enumerate(self.addrs))
+
+        # (uid, hid) -> (round, time sent) of pulls waiting for a reply
+        self.pulls = {}
+        self.answered = {}
+
+    def deliver(self, target, data, source):
+        if self.departed and target in self.dead:
+            return
+        latency = LATENCY
+        if target in self.slow or source in self.slow:
+            latency *= SLOW_FACTOR
+        self.schedule(self.now + random.expovariate(1 / latency),
+            (target, data, source))
+
+    def handle(self, addr, request, sender):
+        if self.departed and addr in self.dead:
+            return None
+
+        headers = request.get('headers', None)
+        if headers != None and headers.get('htype') == 'rep' and \
+            self.uids.get(headers.get('hto')) == addr:
+            pull = self.pulls.pop((headers['hto'], headers['hid']), None)
+            if pull != None:
+                self.answered.setdefault(pull[0], []).append(
+                    self.now - pull[1])
+
+        response = Mesh.handle(self, addr, request, sender)
+        if request.get('m') == 'gen_rand_pull' and response != None:
+            headers = response['headers']
+            self.pulls[(headers['hfrom'], headers['hid'])] = (self.round,
+                self.now)
+        return response
+
+    def run(self):
+        self.round = -1
+        Mesh.run(self, ('gen_pull',), 1)
+        self.departed = True
+        for i in range(ROUNDS):
+            self.round = i
+            Mesh.run(self, ('gen_rand_pull',), 1)
+
+
+def main():
+    size = int(sys.argv[1]) if len(sys.argv) > 1 else 50
+    logging.disable(logging.CRITICAL)
+    live = size - int(size * DEAD)
+
+    for name, reply_timeout in (('uniform', None), ('scored', REPLY_TIMEOUT)):
+        mesh = RttMesh(size, reply_timeout)
+        mesh.run()
+
+        for first in range(0, ROUNDS, WINDOW):
+            waits = []
+            for i in range(first, first + WINDOW):
+                waits.extend(mesh.answered.get(i, []))
+            print "%-8s %3d nodes  rounds %2d-%2d  answered %5.1f%%  " \
+                "first reply %6.1f ms" % (name, size, first,
+                first + WINDOW - 1, 100.0 * len(waits) / (live * WINDOW),
+                sum(waits) * 1000 / max(len(waits), 1))
+
+
+if __name__ == '__main__':
+    main()
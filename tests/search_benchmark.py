@@ -0,0 +1,97 @@
+#!/usr/bin/env python
+"""Cost of full-text search, at ingest and at query time.
+
+Ingest stores batches of remote posts through SQLiteEngine, which adds
+them to the fts index in the same transaction. A full rebuild of the index
+is timed next to it. Queries compare MATCH against the LIKE scan a client
+filtering every post amounts to.
+
+usage: PYTHONPATH=../src python search_benchmark.py [posts]
+"""
+
+import os
+import sys
+import cgi
+import time
+import shutil
+import random
+import sqlite3
+import tempfile
+from litterengine import SQLiteEngine
+
+AUTHORS = 100
+BATCH = 100
+WORDS = 20000
+QUERIES = ['w1', 'w17', 'w150', 'w3 w9']
+
+
+def make_rows(size):
+    random.seed(1)
+    rows = []
+    for i in range(size):
+        # a few common words and a long tail, like real text
+        msg = ' '.join('w%d' % min(int(random.paretovariate(0.7)), WORDS)
+                       for j in range(12))
+        uid = 'peer%d' % (i % AUTHORS)
+        rows.append((uid, i / AUTHORS + 1, i, i, msg, 1, 'sig%d' % i,
+                     cgi.escape(msg), uid))
+    return rows
+
+
+def timed(func, repeat=3):
+    best = None
+    for i in range(repeat):
+        begin = time.time()
+        result = func()
+        spent = time.time() - begin
+        best = spent if best == None else min(best, spent)
+    return best, result
+
+
+def main():
+    size = int(sys.argv[1]) if len(sys.argv) > 1 else 1000000
+    cwd = os.getcwd()
+    tmpdir = tempfile.mkdtemp()
+    os.chdir(tmpdir)
+
+    try:
+        rows = make_rows(size)
+        engine = SQLiteEngine("bench")
+
+        begin = time.time()
+        for i in range(0, len(rows), BATCH):
+            engine.insert("bench", rows[i:i + BATCH])
+        ingest = time.time() - begin
+        print "%8d posts  ingest %7.0f posts/s" % (size, size / ingest)
+
+        con = sqlite3.connect("bench.db")
+        rebuild, _ = timed(lambda: con.execute("INSERT INTO posts_fts "
+            "(posts_fts) VALUES ('rebuild')"), 1)
+        con.commit()
+        print "%8d posts  full rebuild %7.1f s, %.1f%% of ingest" % (size,
+            rebuild, rebuild / ingest * 100)
+
+        for text in QUERIES:
+            like = "SELECT sig FROM posts WHERE " + " and ".join(
+                "' ' || msg || ' ' LIKE ?" for word in text.split())
+            params = ['%% %s %%' % word for word in text.split()]
+            scan, expect = timed(lambda: con.execute(like,
+                params).fetchall())
+            match, rank = timed(lambda: engine.search(text, limit=10))
+            recent, _ = timed(lambda: engine.search(text, limit=10,
+                order='time'))
+            assert set(row[6] for row in rank) <= set(row[0] for row in expect)
+            print "%-8s %7d hits  like %8.1f ms  rank %7.1f ms  " \
+                "time %7.1f ms" % (text, len(expect), scan * 1000,
+                match * 1000, recent * 1000)
+
+        con.close()
+        engine.close()
+
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(tmpdir)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,76 @@
+#!/usr/bin/env python
+"""Ingest and read throughput of a single SQLite file against shards.
+
+Ingest stores batches of remote posts from many authors like gossip does,
+every batch touches most shards. Newest reads everybody's latest posts,
+which fans out to every shard and merges, uid reads one author from its
+shard.
+
+usage: PYTHONPATH=../src python shard_benchmark.py [posts]
+"""
+
+import os
+import sys
+import cgi
+import time
+import shutil
+import tempfile
+from litterengine import SQLiteEngine, ShardedEngine
+
+AUTHORS = 100
+BATCH = 100
+SCANS = 2000
+
+
+def make_rows(size):
+    rows = []
+    for i in range(size):
+        msg = 'post %d <of> %d' % (i, size)
+        uid = 'peer%d' % (i % AUTHORS)
+        rows.append((uid, i / AUTHORS + 1, i, i, msg, 1, 'sig%d' % i,
+                     cgi.escape(msg), uid))
+    return rows
+
+
+def run(name, engine, rows):
+    begin = time.time()
+    for i in range(0, len(rows), BATCH):
+        engine.insert("bench", rows[i:i + BATCH])
+    ingest = len(rows) / (time.time() - begin)
+
+    begin = time.time()
+    for i in range(SCANS):
+        engine.scan(limit=100, display=True)
+    newest = SCANS / (time.time() - begin)
+
+    begin = time.time()
+    for i in range(SCANS):
+        engine.scan('peer%d' % (i % AUTHORS), 1, limit=20)
+    single = SCANS / (time.time() - begin)
+    engine.close()
+
+    print "%-10s %8d posts  ingest %8.0f posts/s  newest %7.0f scans/s  " \
+        "uid %7.0f scans/s" % (name, len(rows), ingest, newest, single)
+
+
+def main():
+    size = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    rows = make_rows(size)
+    cwd = os.getcwd()
+
+    for shards in (None, 2, 4, 8):
+        tmpdir = tempfile.mkdtemp()
+        os.chdir(tmpdir)
+        try:
+            if shards == None:
+                run("sqlite", SQLiteEngine("bench"), rows)
+            else:
+                run("sharded:%d" % shards, ShardedEngine("bench",
+                    shards=shards), rows)
+        finally:
+            os.chdir(cwd)
+            shutil.rmtree(tmpdir)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,113 @@
+#!/usr/bin/env python
+"""Bytes and round trips to catch up with a peer, sync against pull + gap.
+
+Both stores hold the posts of wire_benchmark, the lagging one misses a
+random share of them. The pull + gap side repeats what the timer sent so
+far, a pull then a gap request, until neither brings a post. The sync side
+runs gen_sync rounds until the digests agree. Every request and reply is
+encoded and compressed like the router does for a version 2 hop.
+
+usage: PYTHONPATH=../src python sync_benchmark.py [divergence ...]
+"""
+
+import sys
+import time
+import random
+from jsoncert import JsonCert
+from litterstore import LitterStore
+from litterwire import WireStats, encode, compress
+from wire_benchmark import AUTHORS, POSTS, WORDS
+
+
+def make_posts():
+    random.seed(1)
+    posts = []
+    for i in range(AUTHORS * POSTS):
+        uid = 'user%02d-laptop.lan' % (i % AUTHORS)
+        msg = ' '.join(random.choice(WORDS) for j in
+                       range(random.randint(2, 25)))[:140]
+        txtime = 1300000000 + i * 7.123456
+        postid = i / AUTHORS + 1
+        sig = JsonCert.cal_hash('%s%s%s%s%s' % (msg, uid, txtime, postid, 1))
+        posts.append([msg, uid, txtime, txtime + 0.25, postid, 1, sig])
+    return posts
+
+
+def make_stores(posts, divergence):
+    random.seed(2)
+    full = LitterStore('peer-full', test=True)
+    full.process({'posts': posts})
+    behind = LitterStore('peer-behind', test=True)
+    behind.process({'posts': [post for post in posts
+                              if random.random() >= divergence]})
+    return full, behind
+
+
+class Exchange:
+    """Runs requests of one store against the other, counting the bytes"""
+
+    def __init__(self, full, behind):
+        self.full = full
+        self.behind = behind
+        self.stats = WireStats()
+        self.bytes = 0
+        self.trips = 0
+        self.posts = 0
+
+    def size(self, message):
+        return len(compress(encode(message), self.stats))
+
+    def ask(self, request):
+        """Reply of the full store and what the lagging one makes of it"""
+
+        self.bytes += self.size(request)
+        reply = self.full.process(request)
+        self.bytes += self.size(reply)
+        self.trips += 1
+        self.posts += len(reply['posts'])
+        return self.behind.process(reply)
+
+
+def pull_gap(exchange):
+    while True:
+        posts = exchange.posts
+        for meth in ('gen_pull', 'gen_gap'):
+            request = exchange.behind.process({'m': meth})
+            # no gap left, nothing is sent
+            if request['query']:
+                exchange.ask(request)
+        if exchange.posts == posts:
+            break
+
+
+def sync(exchange):
+    request = exchange.behind.process({'m': 'gen_sync'})
+    while 'query' in request:
+        request = exchange.ask(request)
+
+
+def main():
+    divergences = [float(arg) for arg in sys.argv[1:]] or [0, 0.01, 0.1, 0.5]
+    posts = make_posts()
+
+    for divergence in divergences:
+        for name, run in (('pull+gap', pull_gap), ('sync', sync)):
+            full, behind = make_stores(posts, divergence)
+            exchange = Exchange(full, behind)
+            begin = time.time()
+            run(exchange)
+            spent = time.time() - begin
+
+            left = sum(1 for post in full.process({'m': 'get',
+                'limit': len(posts)})['posts']) - len(behind.process(
+                {'m': 'get', 'limit': len(posts)})['posts'])
+            print "divergence %4.1f%%  %-8s  %3d round trips  %8d bytes  " \
+                "%5d posts  %4d still missing  %6.2f s" % (100 * divergence,
+                name, exchange.trips, exchange.bytes, exchange.posts, left,
+                spent)
+            full.close()
+            behind.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,80 @@
+#!/usr/bin/env python
+"""Size and speed of the binary wire format against json.
+
+Packets are real pull replies: a store holding posts of AUTHORS authors
+answers pull requests that start from random watermarks, and the router
+adds the headers it sends. Messages are random words up to 140 characters,
+sigs are the sha1 digests LitterStore makes.
+
+usage: PYTHONPATH=../src python wire_benchmark.py [replies]
+"""
+
+import sys
+import time
+import random
+from jsoncert import JsonCert
+from litterstore import LitterStore
+from litterwire import WIRE_VERSION, encode, encode_json, decode
+
+AUTHORS = 50
+POSTS = 100
+WORDS = ['lunch', 'meeting', 'the', 'build', 'is', 'broken', 'again', 'at',
+         'noon', 'who', 'wants', 'coffee', 'printer', 'on', 'floor', '3']
+
+
+def make_store():
+    random.seed(1)
+    store = LitterStore('reader-desktop-%d' % AUTHORS, test=True)
+    posts = []
+    for i in range(AUTHORS * POSTS):
+        uid = 'user%02d-laptop.lan' % (i % AUTHORS)
+        msg = ' '.join(random.choice(WORDS) for j in
+                       range(random.randint(2, 25)))[:140]
+        txtime = 1300000000 + i * 7.123456
+        postid = i / AUTHORS + 1
+        sig = JsonCert.cal_hash('%s%s%s%s%s' % (msg, uid, txtime, postid, 1))
+        posts.append([msg, uid, txtime, txtime + 0.25, postid, 1, sig])
+    store.process({'posts': posts})
+    return store
+
+
+def make_replies(store, count):
+    replies = []
+    for i in range(count):
+        friends = [['user%02d-laptop.lan' % j,
+                    1300000000 + random.randint(0, AUTHORS * POSTS) * 7]
+                   for j in range(AUTHORS)]
+        request = {'query': {'m': 'pull', 'uid': 'peer-%d' % i,
+                   'friends': friends}, 'headers': {'hto': 'any',
+                   'hfrom': 'peer-%d' % i, 'hid': random.getrandbits(48),
+                   'htype': 'req', 'httl': 5}}
+        reply = store.process(request)
+        reply['headers']['hwire'] = [WIRE_VERSION, reply['headers']['httl']]
+        replies.append(reply)
+    return replies
+
+
+def timed(func, items):
+    begin = time.time()
+    results = [func(item) for item in items]
+    return (time.time() - begin) / len(items), results
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+    replies = make_replies(make_store(), count)
+    posts = sum(len(reply['posts']) for reply in replies)
+
+    for name, encoder in (('json', encode_json), ('binary', encode)):
+        encoded, packets = timed(encoder, replies)
+        decoded, messages = timed(decode, packets)
+        size = sum(len(packet) for packet in packets)
+        assert messages[0]['posts'][0][6] == replies[0]['posts'][0][6]
+        print "%-6s %4d replies  %5.1f posts  %6.0f bytes/reply  " \
+            "%5.1f bytes/post  encode %6.1f us  decode %6.1f us" % (name,
+            count, float(posts) / count, float(size) / count,
+            float(size) / posts, encoded * 1e6, decoded * 1e6)
+
+
+if __name__ == '__main__':
+    main()